@@ -1,48 +1,580 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Request, Depends
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo import monitoring
 import os
 import logging
+import logging.handlers
+import queue
+import atexit
 import asyncio
 import uuid
 import json
+import base64
 import re
 import time
-import requests
 from pathlib import Path
+from collections import OrderedDict, deque
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Union
-from datetime import datetime
-import telegram
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-import openai
-from duckduckgo_search import DDGS
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Union, Callable
+from datetime import datetime, timedelta
 import shutil
+import functools
+import random
+import contextvars
+import contextlib
+import bisect
+import socket
+import ipaddress
+import sys
+import threading
+import hmac
+import hashlib
+import sysconfig
+import traceback
+import copy
+import gzip
+import bz2
+import lzma
+import tarfile
+import zipfile
+import csv
+import io
+import codecs
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from urllib.robotparser import RobotFileParser
+from concurrent.futures import ThreadPoolExecutor
+
+if TYPE_CHECKING:
+    # Annotations only; httpx itself is imported on first use
+    import httpx
 
 # Setup paths and environment variables
 ROOT_DIR = Path(__file__).parent
 DATASET_DIR = ROOT_DIR / "datasets"
-DATASET_DIR.mkdir(exist_ok=True)
 
 load_dotenv(ROOT_DIR / '.env')
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Records are queued by the caller and written by a background thread, so a
+# slow stderr never blocks the event loop. LOG_FORMAT=text keeps the old lines.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+# Info logs per call site: the first LOG_SAMPLE_BURST every 10s, then 1 in LOG_SAMPLE_EVERY
+LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', '50'))
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', '100'))
+
+current_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_request_id", default=None)
+
+class LogSampler(logging.Filter):
+    """Thins out high-volume info logs per call site; warnings always pass.
+    
+    Each site (file and line) logs its first `burst` records per window and
+    then one in `every`. The next record that gets through from a site
+    carries `sampled_out`, the number skipped since the last one.
+    """
+    
+    WINDOW_SECONDS = 10
+    
+    def __init__(self, burst: int, every: int):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self.sites: Dict[tuple, list] = {}
+        self.suppressed = 0
+        self.lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            # [window start, records seen in window, skipped since last emitted]
+            site = self.sites.get((record.pathname, record.lineno))
+            if site is None or now - site[0] >= self.WINDOW_SECONDS:
+                skipped = site[2] if site else 0
+                site = self.sites[(record.pathname, record.lineno)] = [now, 0, skipped]
+            site[1] += 1
+            if site[1] > self.burst and (site[1] - self.burst) % self.every:
+                site[2] += 1
+                self.suppressed += 1
+                return False
+            if site[2]:
+                record.sampled_out = site[2]
+                site[2] = 0
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of growing without bound.
+    
+    Only the message is rendered in the calling thread; tracebacks are
+    formatted by the listener. The request id is captured here because the
+    listener thread has no request context.
+    """
+    
+    def __init__(self, log_queue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+        self.dropped_since_last = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.request_id = current_request_id.get()
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            self.dropped_since_last += 1
+            return
+        if self.dropped_since_last:
+            record.dropped_before = self.dropped_since_last
+            self.dropped_since_last = 0
+        self.queue.put_nowait(record)
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id"""
+    
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        # Anything passed through extra={...}, plus sampled_out/dropped_before
+        for key, value in vars(record).items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextLogFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"[{request_id}] {line}" if request_id else line
+
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_handler = NonBlockingQueueHandler(log_queue, LOG_QUEUE_SIZE)
+log_sampler = LogSampler(LOG_SAMPLE_BURST, LOG_SAMPLE_EVERY)
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging():
+    """Route the root logger (and uvicorn's loggers) through the log queue"""
+    global log_listener
+    if log_listener is not None:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else TextLogFormatter())
+    log_handler.addFilter(log_sampler)
+    
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(log_handler)
+    # uvicorn installs its own synchronous stream handlers before importing the app
+    for name in ("uvicorn", "uvicorn.access"):
+        logging.getLogger(name).handlers.clear()
+        logging.getLogger(name).propagate = True
+    
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log_listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Write out whatever is still queued"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
 logger = logging.getLogger(__name__)
 
 # Initialize API keys and tokens
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 
+# Multi-worker deployment: worker count (as read by uvicorn) and identity
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+CONFIG_POLL_SECONDS = float(os.environ.get('CONFIG_POLL_SECONDS', '5'))
+CONFIG_VALIDATION_TIMEOUT = float(os.environ.get('CONFIG_VALIDATION_TIMEOUT', '10'))
+LEADER_LEASE_SECONDS = float(os.environ.get('LEADER_LEASE_SECONDS', '30'))
+# Server-sent events are relayed between workers through a capped collection of this size
+EVENT_RELAY_BYTES = int(os.environ.get('EVENT_RELAY_BYTES', str(1024 * 1024)))
+
+# Admin-only diagnostics (profiler, slow request log); disabled when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '2000'))
+SLOW_REQUEST_LOG_BYTES = int(os.environ.get('SLOW_REQUEST_LOG_BYTES', str(16 * 1024 * 1024)))
+PROFILE_MAX_SECONDS = 60
+
+# Event loop watchdog: stalls longer than this are logged with the blocking stack
+LOOP_WATCHDOG_ENABLED = os.environ.get('LOOP_WATCHDOG_ENABLED', '1') == '1'
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.environ.get('LOOP_WATCHDOG_THRESHOLD_MS', '250'))
+
+# Response compression: minimum body size, and the size above which it runs in a thread
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_THREAD_BYTES = int(os.environ.get('COMPRESSION_THREAD_BYTES', str(256 * 1024)))
+
+# Telegram update delivery: "polling" (local dev) or "webhook"
+TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'polling')
+TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL', '')
+TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_MAX_CONCURRENT_UPDATES = int(os.environ.get('TELEGRAM_MAX_CONCURRENT_UPDATES', '32'))
+# Bot API endpoint, for a self-hosted Bot API server (empty = api.telegram.org)
+TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL', '')
+
+# Metrics
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+    
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, values)} {total}")
+        return lines
+
+class Gauge:
+    """Gauge read at scrape time from a callback returning {label values: value}"""
+    
+    def __init__(self, name: str, help: str, labels: tuple, callback: Callable[[], Dict[tuple, float]]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {str(e)}")
+            return lines
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket histogram per label set, rendered in Prometheus format.
+    
+    Recording is a bisect and three additions with no lock, so it is cheap
+    enough for hot paths. Observations from worker threads can in rare
+    races lose an increment, which is acceptable for monitoring.
+    """
+    
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}
+    
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # [per-bucket counts (last one is +Inf), sum, count]
+            series = self.series.setdefault(label_values, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in list(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.labels, values, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, values)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+    
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+    
+    def gauge(self, name: str, help: str, callback: Callable[[], Dict[tuple, float]], labels: tuple = ()) -> Gauge:
+        metric = Gauge(name, help, labels, callback)
+        self.metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+upstream_request_duration = metrics.histogram(
+    "upstream_request_duration_seconds", "Outbound call latency including retries", ("upstream", "outcome")
+)
+stage_duration = metrics.histogram(
+    "stage_duration_seconds", "Time spent in instrumented hot-path stages", ("stage",)
+)
+mongo_command_duration = metrics.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection", ("collection", "command")
+)
+mongo_command_failures = metrics.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands by collection", ("collection", "command")
+)
+event_loop_lag = metrics.histogram(
+    "event_loop_lag_seconds", "Delay of a periodic event loop probe beyond its schedule",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+dataset_bytes = metrics.counter("dataset_processed_bytes_total", "Dataset bytes processed")
+dataset_records = metrics.counter("dataset_processed_records_total", "Dataset records processed")
+dataset_processing_duration = metrics.histogram(
+    "dataset_processing_seconds", "Time to process one dataset",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+)
+metrics.gauge("log_queue_depth", "Log records waiting to be written", lambda: {(): log_queue.qsize()})
+metrics.gauge(
+    "log_records_dropped", "Log records discarded since start",
+    lambda: {("queue_full",): log_handler.dropped, ("sampled",): log_sampler.suppressed}, ("reason",)
+)
+dataset_chunk_count = metrics.counter(
+    "dataset_chunks_total", "Dataset chunks by whether they had to be indexed", ("result",)
+)
+dataset_last_throughput = {"bytes": 0.0, "records": 0.0}
+metrics.gauge(
+    "dataset_last_throughput_per_second", "Throughput of the most recently processed dataset",
+    lambda: {(unit,): value for unit, value in dataset_last_throughput.items()}, ("unit",)
+)
+
+class RequestTrace:
+    """Spans recorded while serving one request, for the slow request log"""
+    
+    MAX_SPANS = 200
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+    
+    def add(self, name: str, started: float, duration: float):
+        if len(self.spans) < self.MAX_SPANS:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((started - self.start) * 1000, 2),
+                "duration_ms": round(duration * 1000, 2)
+            })
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+def record_span(name: str, started: float, duration: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a block of hot-path work into stage_duration_seconds.
+    
+    The time is also added as a span to the current request's trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, name)
+        record_span(name, start, elapsed)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command by collection via pymongo's command monitoring"""
+    
+    def __init__(self):
+        self.pending: Dict[tuple, str] = {}
+    
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        if isinstance(target, str):
+            self.pending[(event.connection_id, event.request_id)] = target
+    
+    def succeeded(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            duration = event.duration_micros / 1e6
+            mongo_command_duration.observe(duration, collection, event.command_name)
+            # Motor runs commands in a copied context, so the request trace is visible here
+            record_span(f"mongo:{collection}.{event.command_name}", time.perf_counter() - duration, duration)
+    
+    def failed(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+            mongo_command_failures.inc(collection, event.command_name)
+
+loop_stalls = metrics.counter(
+    "event_loop_stalls_total", "Event loop stalls over the watchdog threshold by call site", ("call_site",)
+)
+loop_stall_duration = metrics.histogram(
+    "event_loop_stall_seconds", "Duration of event loop stalls over the watchdog threshold",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+LIBRARY_PATHS = tuple({sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"]})
+
+class LoopWatchdog:
+    """Detects event loop stalls and captures what the loop was running.
+    
+    A coroutine on the loop refreshes a heartbeat every `interval` and a
+    daemon thread checks it. When the heartbeat is older than `threshold`,
+    the loop thread's stack is captured once for that stall and attributed
+    to the innermost frame of our own code (the call site that blocked).
+    When healthy this costs one timestamp per interval, so it stays on in
+    production. The heartbeat's own lateness feeds event_loop_lag_seconds.
+    """
+    
+    def __init__(self, threshold: float, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.sites: Dict[str, Dict[str, Any]] = {}
+        self.stalls = 0
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _heartbeat(self):
+        while True:
+            beat = time.monotonic()
+            # How late this wake-up was; any lag means the loop was busy
+            event_loop_lag.observe(max(0.0, beat - self.last_beat - self.interval))
+            self.last_beat = beat
+            await asyncio.sleep(self.interval)
+    
+    def start(self):
+        """Start watching the running loop (call from a coroutine)"""
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+    
+    @staticmethod
+    def call_site(frame) -> str:
+        """Innermost frame outside the stdlib and installed packages"""
+        leaf = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if not filename.startswith(LIBRARY_PATHS) and not filename.startswith("<"):
+                break
+            frame = frame.f_back
+        frame = frame or leaf
+        return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+    
+    def _capture(self) -> Optional[Dict[str, str]]:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return None
+        return {"site": self.call_site(frame), "stack": "".join(traceback.format_stack(frame))}
+    
+    def _watch(self):
+        stalled_beat = None
+        capture = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self.last_beat
+            if time.monotonic() - beat > self.threshold + self.interval:
+                if stalled_beat != beat:
+                    stalled_beat = beat
+                    capture = self._capture()
+            elif stalled_beat is not None and beat != stalled_beat:
+                # The loop is back; it was stuck from the missed beat until this one
+                if capture is not None:
+                    self._record(capture, beat - stalled_beat - self.interval)
+                stalled_beat = capture = None
+    
+    def _record(self, capture: Dict[str, str], duration: float):
+        site = capture["site"]
+        entry = self.sites.get(site)
+        if entry is None:
+            entry = self.sites[site] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": capture["stack"]}
+            logger.warning(f"Event loop blocked for {duration * 1000:.0f}ms at {site}\n{capture['stack']}")
+        else:
+            logger.warning(f"Event loop blocked for {duration * 1000:.0f}ms at {site} (seen {entry['count'] + 1} times)")
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + duration * 1000, 1)
+        entry["max_ms"] = round(max(entry["max_ms"], duration * 1000), 1)
+        entry["last_seen"] = datetime.utcnow()
+        self.stalls += 1
+        loop_stalls.inc(site)
+        loop_stall_duration.observe(duration)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        sites = sorted(self.sites.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        return {
+            "enabled": self._task is not None and not self._stop.is_set(),
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "sites": [{"call_site": site, **entry} for site, entry in sites]
+        }
+
+loop_watchdog = LoopWatchdog(LOOP_WATCHDOG_THRESHOLD_MS / 1000)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Create collections
@@ -51,118 +583,2208 @@ search_results = db.search_results
 datasets = db.datasets
 user_profiles = db.user_profiles
 
-# Initialize OpenAI client if API key is available
-openai_client = None
-if OPENAI_API_KEY:
-    openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Analytics rollup collections (incremented at write time, never scanned)
+usage_hourly = db.usage_hourly
+search_term_counts = db.search_term_counts
+telegram_user_activity = db.telegram_user_activity
+llm_latency_daily = db.llm_latency_daily
+llm_usage_daily = db.llm_usage_daily
+chat_batches = db.chat_batches
+
+# State shared between workers: runtime config, leases, seen Telegram updates
+app_config = db.app_config
+leader_locks = db.leader_locks
+telegram_updates = db.telegram_updates
+# Capped collection every worker tails to pass server-sent events on
+event_relay = db.event_relay
+
+# Capped log of requests slower than SLOW_REQUEST_THRESHOLD_MS
+slow_requests = db.slow_requests
+
+# Saved security searches and their per-watchlist seen-URL sets
+watchlists = db.watchlists
+watchlist_seen = db.watchlist_seen
+watchlist_hits = db.watchlist_hits
 
-# Create the main app without a prefix
-app = FastAPI()
+# Dataset versions: content-addressed chunks with their IOC index, and the
+# ordered chunk list (manifest) of every version, in batches
+dataset_chunks = db.dataset_chunks
+dataset_manifests = db.dataset_manifests
+
+# Status checks older than this are expired by a TTL index
+STATUS_CHECK_TTL_DAYS = int(os.environ.get('STATUS_CHECK_TTL_DAYS', '30'))
+
+# Per-user conversation memory limits
+CONVERSATION_CACHE_USERS = int(os.environ.get('CONVERSATION_CACHE_USERS', '1000'))
+CONVERSATION_CONTEXT_TOKENS = int(os.environ.get('CONVERSATION_CONTEXT_TOKENS', '1500'))
+CONVERSATION_SUMMARY_TOKENS = int(os.environ.get('CONVERSATION_SUMMARY_TOKENS', '300'))
+# With several workers, how long a cached conversation is used before its stored version is checked
+CONVERSATION_RECHECK_SECONDS = float(os.environ.get('CONVERSATION_RECHECK_SECONDS', '2'))
+
+# LLM model, per-route token limits and pricing (USD per 1K tokens)
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-4')
+LLM_ROUTE_LIMITS = {
+    "chat": {"prompt_tokens": 3000, "completion_tokens": 500},
+    "telegram": {"prompt_tokens": 3000, "completion_tokens": 500},
+    "person_summary": {"prompt_tokens": 1000, "completion_tokens": 150},
+    "batch": {"prompt_tokens": 3000, "completion_tokens": 500},
+}
+LLM_PROMPT_PRICE_PER_1K = float(os.environ.get('LLM_PROMPT_PRICE_PER_1K', '0.03'))
+LLM_COMPLETION_PRICE_PER_1K = float(os.environ.get('LLM_COMPLETION_PRICE_PER_1K', '0.06'))
+
+# Daily token budgets (0 disables the limit)
+LLM_DAILY_TOKEN_BUDGET = int(os.environ.get('LLM_DAILY_TOKEN_BUDGET', '0'))
+LLM_USER_DAILY_TOKEN_BUDGET = int(os.environ.get('LLM_USER_DAILY_TOKEN_BUDGET', '0'))
+
+# Admission control for expensive routes and per-client rate limits
+CHAT_MAX_CONCURRENT = int(os.environ.get('CHAT_MAX_CONCURRENT', '8'))
+SEARCH_MAX_CONCURRENT = int(os.environ.get('SEARCH_MAX_CONCURRENT', '8'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '16'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '2'))
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', '30'))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', '10'))
+# Peers whose X-Real-IP header is believed (IPs or CIDRs); nginx runs in the same container
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if network.strip()
+]
+
+# Deep search: page fetching limits and page cache size
+DEEP_SEARCH_MAX_PAGES = int(os.environ.get('DEEP_SEARCH_MAX_PAGES', '5'))
+DEEP_SEARCH_MAX_BYTES = int(os.environ.get('DEEP_SEARCH_MAX_BYTES', '1000000'))
+DEEP_SEARCH_PER_HOST = int(os.environ.get('DEEP_SEARCH_PER_HOST', '2'))
+DEEP_SEARCH_TIMEOUT = float(os.environ.get('DEEP_SEARCH_TIMEOUT', '8'))
+DEEP_SEARCH_WORKERS = int(os.environ.get('DEEP_SEARCH_WORKERS', '4'))
+DEEP_SEARCH_USER_AGENT = os.environ.get('DEEP_SEARCH_USER_AGENT', 'CyberSecAIBot/1.0')
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', '500'))
+# Redirects followed per page (each hop is checked again) and hosts whose robots.txt and
+# concurrency limits are kept
+DEEP_SEARCH_MAX_REDIRECTS = int(os.environ.get('DEEP_SEARCH_MAX_REDIRECTS', '5'))
+DEEP_SEARCH_MAX_HOSTS = int(os.environ.get('DEEP_SEARCH_MAX_HOSTS', '1000'))
+
+# Multi-query search: max phrasings per request and total latency budget
+SEARCH_FANOUT_MAX_QUERIES = int(os.environ.get('SEARCH_FANOUT_MAX_QUERIES', '5'))
+SEARCH_FANOUT_BUDGET = float(os.environ.get('SEARCH_FANOUT_BUDGET', '8'))
+
+# Watchlist scheduler: poll interval, global concurrency and minimum interval
+WATCHLIST_POLL_SECONDS = float(os.environ.get('WATCHLIST_POLL_SECONDS', '30'))
+WATCHLIST_MAX_CONCURRENT = int(os.environ.get('WATCHLIST_MAX_CONCURRENT', '4'))
+WATCHLIST_MIN_INTERVAL_MINUTES = int(os.environ.get('WATCHLIST_MIN_INTERVAL_MINUTES', '15'))
+# Watchlists a Telegram chat may create with /watch
+MAX_WATCHES_PER_CHAT = int(os.environ.get('MAX_WATCHES_PER_CHAT', '20'))
+
+# Batch chat parallelism (shared by all running batches) and size limit
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))
+BATCH_MAX_PROMPTS = int(os.environ.get('BATCH_MAX_PROMPTS', '1000'))
+BATCH_CLIENT_PROMPTS_PER_HOUR = float(os.environ.get('BATCH_CLIENT_PROMPTS_PER_HOUR', '2000'))
+BATCH_HEARTBEAT_SECONDS = 10
+# Batch answers are stored in bulk every BATCH_PERSIST_EVERY answers or BATCH_PERSIST_SECONDS
+BATCH_PERSIST_EVERY = int(os.environ.get('BATCH_PERSIST_EVERY', '50'))
+BATCH_PERSIST_SECONDS = float(os.environ.get('BATCH_PERSIST_SECONDS', '2'))
+
+# Shutdown: how long running work may take to finish before it is cancelled
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '10'))
+
+# Dataset processing: most bytes chunked and indexed per step, checkpoint interval, and
+# how long a "processing" dataset may go without a checkpoint before another worker resumes it
+DATASET_SCAN_SLICE_BYTES = int(os.environ.get('DATASET_SCAN_SLICE_BYTES', str(64 * 1024 * 1024)))
+DATASET_CHECKPOINT_SECONDS = float(os.environ.get('DATASET_CHECKPOINT_SECONDS', '5'))
+DATASET_STALE_SECONDS = float(os.environ.get('DATASET_STALE_SECONDS', '60'))
+# Average content-defined chunk size; chunks are indexed once and shared by versions
+DATASET_CHUNK_BYTES = int(os.environ.get('DATASET_CHUNK_BYTES', str(64 * 1024)))
+# Uploads are decompressed and parsed by a reader thread in blocks, up to
+# DATASET_PIPELINE_BLOCKS ahead of indexing; a single JSON record may not
+# exceed DATASET_MAX_RECORD_BYTES
+DATASET_READ_BLOCK_BYTES = int(os.environ.get('DATASET_READ_BLOCK_BYTES', str(1024 * 1024)))
+DATASET_PIPELINE_BLOCKS = int(os.environ.get('DATASET_PIPELINE_BLOCKS', '16'))
+DATASET_MAX_RECORD_BYTES = int(os.environ.get('DATASET_MAX_RECORD_BYTES', str(16 * 1024 * 1024)))
+# Limits against decompression bombs: bytes produced by all decompression layers
+# together, and files inside archives; a dataset exceeding either fails
+DATASET_MAX_EXPANDED_BYTES = int(os.environ.get('DATASET_MAX_EXPANDED_BYTES', str(32 * 1024 ** 3)))
+DATASET_MAX_MEMBERS = int(os.environ.get('DATASET_MAX_MEMBERS', '10000'))
+
+# Upper bounds (ms) of the fixed LLM latency histogram buckets
+LLM_LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000]
+
+# Outbound call timeouts (seconds); retries are handled by OutboundClient
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '30'))
+SEARCH_TIMEOUT = float(os.environ.get('SEARCH_TIMEOUT', '10'))
+SEARCH_HEDGE_AFTER = float(os.environ.get('SEARCH_HEDGE_AFTER', '3'))
+# Threads per upstream; an attempt abandoned at its timeout holds one until the SDK gives up
+OUTBOUND_MAX_THREADS = int(os.environ.get('OUTBOUND_MAX_THREADS', '32'))
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '60'))
+
+# Integration clients. The openai, telegram, duckduckgo_search and bs4
+# packages are slow to import, so they are imported where first used and
+# these clients are created at startup only when configured.
+openai_client = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Telegram bot instance
-telegram_bot = None
-if TELEGRAM_BOT_TOKEN:
-    telegram_bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
+# Telegram bot instance
+telegram_bot = None
+
+# Running telegram.ext Application (set by start_telegram_bot)
+telegram_application = None
+
+# Define Models
+class StatusCheck(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    client_name: str
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class StatusCheckCreate(BaseModel):
+    client_name: str
+
+class DatasetUpload(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    description: str
+    file_path: str
+    upload_date: datetime = Field(default_factory=datetime.utcnow)
+    status: str = "uploaded"
+    version: int = 1
+    format: Optional[str] = None
+    
+class DatasetUploadCreate(BaseModel):
+    name: str
+    description: str
+
+class SearchQuery(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    query: str
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    result: Optional[Dict[str, Any]] = None
+    
+class NameSearchQuery(BaseModel):
+    name: str
+    
+class WebSearchQuery(BaseModel):
+    query: str
+    deep: bool = False
+    queries: Optional[List[str]] = None
+    expand: bool = False
+    
+class MessageData(BaseModel):
+    message: str
+    
+class BatchChatRequest(BaseModel):
+    prompts: List[str]
+    batch_id: Optional[str] = None
+    
+class TelegramConfig(BaseModel):
+    token: str
+    expected_version: Optional[int] = None
+    
+class OpenAIConfig(BaseModel):
+    api_key: str
+    expected_version: Optional[int] = None
+
+class WatchlistCreate(BaseModel):
+    name: str
+    query: str
+    interval_minutes: int = 1440
+    telegram_chat_id: Optional[int] = None
+
+# Server push
+def json_default(value: Any):
+    """json.dumps fallback that keeps datetimes in ISO 8601"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class EventHub:
+    """Pub/sub hub that fans events out to SSE subscribers.
+    
+    Each event is encoded once and the same frame is queued for every
+    subscriber. Queues are bounded: a subscriber that falls behind loses its
+    oldest frames instead of slowing down publishers.
+    
+    Subscribers are per process, so while the relay runs every frame is also
+    written to a capped collection that each worker tails. A stream served by
+    one worker then sees dataset progress and status events from all of them.
+    """
+    
+    def __init__(self, queue_size: int = 100, relay_size: int = 1000):
+        self.queue_size = queue_size
+        self.relay_size = relay_size
+        self.subscribers = set()
+        # Frames waiting to be written for other workers; only set while the relay runs
+        self.outbox: Optional[asyncio.Queue] = None
+    
+    def subscribe(self) -> asyncio.Queue:
+        subscriber = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: asyncio.Queue):
+        self.subscribers.discard(subscriber)
+    
+    def publish(self, event: str, data: Any):
+        frame = f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+        self.deliver(frame)
+        if self.outbox is not None:
+            self._put_dropping_oldest(self.outbox, frame)
+    
+    def deliver(self, frame: str):
+        for subscriber in self.subscribers:
+            self._put_dropping_oldest(subscriber, frame)
+    
+    @staticmethod
+    def _put_dropping_oldest(target: asyncio.Queue, frame: str):
+        if target.full():
+            try:
+                target.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        target.put_nowait(frame)
+    
+    async def run_relay(self, collection):
+        """Write this worker's frames to the capped collection and deliver the others'"""
+        self.outbox = asyncio.Queue(maxsize=self.relay_size)
+        try:
+            await asyncio.gather(self._relay_out(collection), self._relay_in(collection))
+        finally:
+            self.outbox = None
+    
+    async def _relay_out(self, collection):
+        while True:
+            frames = [await self.outbox.get()]
+            while not self.outbox.empty() and len(frames) < 100:
+                frames.append(self.outbox.get_nowait())
+            try:
+                await collection.insert_many([{"worker_id": WORKER_ID, "frame": frame} for frame in frames])
+            except Exception as e:
+                logger.error(f"Error relaying events: {str(e)}")
+    
+    async def _relay_in(self, collection):
+        # Start after the newest stored frame; nothing published before startup is replayed
+        newest = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = newest["_id"] if newest else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            try:
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        if doc["worker_id"] != WORKER_ID:
+                            self.deliver(doc["frame"])
+            except Exception as e:
+                logger.error(f"Error reading relayed events: {str(e)}")
+            # The cursor dies on an empty collection or when it falls behind; reopen it
+            await asyncio.sleep(1)
+
+event_hub = EventHub()
+
+# Lifecycle
+class ShuttingDown(Exception):
+    """Raised when new work is submitted after shutdown has started"""
+
+class Lifecycle:
+    """Tracks background tasks so shutdown can stop intake and drain them.
+    
+    Service loops (schedulers, pollers, monitors) are cancelled as soon as
+    shutdown starts. Work tasks get until the drain deadline to finish and
+    are cancelled after it. Resumable work checks `stopping` and saves a
+    checkpoint instead of running to completion. Holding the tasks here also
+    keeps them from being garbage collected while they run.
+    """
+    
+    def __init__(self):
+        self.stopping = False
+        self.services = set()
+        self.work = set()
+    
+    def start(self):
+        self.stopping = False
+    
+    def spawn(self, coro, service: bool = False) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        tasks = self.services if service else self.work
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+    
+    def check_accepting(self):
+        if self.stopping:
+            raise ShuttingDown("Server is shutting down")
+    
+    async def shutdown(self, timeout: float) -> Dict[str, int]:
+        """Cancel services, wait up to `timeout` for work, cancel the rest"""
+        self.stopping = True
+        services = list(self.services)
+        for task in services:
+            task.cancel()
+        await asyncio.gather(*services, return_exceptions=True)
+        
+        deadline = time.monotonic() + timeout
+        drained = 0
+        # Work can spawn more work (a handler queues a reply), so keep looking
+        while self.work and time.monotonic() < deadline:
+            done, _ = await asyncio.wait(
+                set(self.work), timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+            )
+            drained += len(done)
+        
+        leftovers = list(self.work)
+        for task in leftovers:
+            task.cancel()
+        if leftovers:
+            await asyncio.wait(leftovers, timeout=5)
+            logger.warning(f"Cancelled {len(leftovers)} background tasks still running after {timeout}s")
+        return {"drained": drained, "cancelled": len(leftovers)}
+
+lifecycle = Lifecycle()
+
+async def shutting_down_handler(request: Request, exc: ShuttingDown):
+    # The client (or Telegram) retries, on this worker after restart or on another one
+    return FastJSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+# Outbound calls
+# Absolute (monotonic) deadline of the request being served, if any
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """Raised when no time is left in the request deadline for an upstream call"""
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.probe_in_flight = False
+    
+    def before_call(self):
+        if self.state == "open":
+            wait = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if wait > 0:
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open, retry in {wait:.0f}s)")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit half-open, probe in flight)")
+            self.probe_in_flight = True
+    
+    def release(self):
+        """End a call without judging the upstream (e.g. it was cancelled)"""
+        self.probe_in_flight = False
+    
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "times_opened": self.opens
+        }
+
+# Every OutboundClient by upstream name, for /api/upstreams
+outbound_clients: Dict[str, "OutboundClient"] = {}
+
+class OutboundClient:
+    """Wraps blocking upstream calls with deadlines, retries and a breaker.
+    
+    Calls run in this client's own bounded thread pool so they never block
+    the event loop, and an upstream that hangs cannot use up the threads
+    other work runs on. Each attempt is bounded by the per-call timeout and
+    by whatever is left of the current request deadline; with `timeout_kwarg`
+    set, that bound is also passed to the SDK so an abandoned attempt stops
+    too instead of running on in its thread. Retryable failures are retried with full-jitter
+    exponential backoff. With `hedge_after` set, a second attempt is started
+    if the first has not answered in time and the first result wins; only
+    use that for idempotent calls.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 5.0,
+        hedge_after: Optional[float] = None,
+        retry_on: Union[tuple, Callable[[], tuple]] = (Exception,),
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        timeout_kwarg: Optional[str] = None,
+        max_threads: int = OUTBOUND_MAX_THREADS
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.timeout_kwarg = timeout_kwarg
+        self.max_threads = max_threads
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self._retry_on = retry_on
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.calls = 0
+        self.attempts = 0
+        self.hedges = 0
+        outbound_clients[name] = self
+    
+    def remaining(self) -> float:
+        deadline = request_deadline.get()
+        if deadline is None:
+            return self.timeout
+        return min(self.timeout, deadline - time.monotonic())
+    
+    async def _attempt(self, func, args, kwargs):
+        timeout = self.remaining()
+        if timeout <= 0:
+            raise DeadlineExceeded(f"{self.name}: request deadline exceeded")
+        self.breaker.before_call()
+        self.attempts += 1
+        if self.timeout_kwarg:
+            kwargs = {**kwargs, self.timeout_kwarg: timeout}
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix=f"outbound-{self.name}")
+        # Like to_thread: the call sees this task's context variables
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        try:
+            result = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self.executor, call), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except (asyncio.TimeoutError, *self.retry_on):
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            # A rejected request (bad input, auth) says nothing about health
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+    
+    async def _hedged(self, func, args, kwargs):
+        first = asyncio.ensure_future(self._attempt(func, args, kwargs))
+        if self.hedge_after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        
+        self.hedges += 1
+        pending = {first, asyncio.ensure_future(self._attempt(func, args, kwargs))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def call(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) under this client's policies"""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await self._call(func, args, kwargs)
+            outcome = "ok"
+            return result
+        except CircuitOpenError:
+            outcome = "circuit_open"
+            raise
+        except DeadlineExceeded:
+            outcome = "deadline"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            upstream_request_duration.observe(elapsed, self.name, outcome)
+            record_span(f"upstream:{self.name}", start, elapsed)
+    
+    async def _call(self, func, args, kwargs):
+        self.calls += 1
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._hedged(func, args, kwargs)
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except (asyncio.TimeoutError, *self.retry_on) as e:
+                error = e
+            if attempt == self.retries:
+                break
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if delay >= self.remaining():
+                break
+            logger.warning(f"{self.name} call failed ({type(error).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        if isinstance(error, asyncio.TimeoutError):
+            raise DeadlineExceeded(f"{self.name}: timed out") from error
+        raise error
+    
+    @property
+    def retry_on(self) -> tuple:
+        # A callable is resolved on first use so the upstream SDK is only
+        # imported once something actually calls it
+        if callable(self._retry_on):
+            self._retry_on = self._retry_on()
+        return self._retry_on
+    
+    def close(self):
+        if self.executor is not None:
+            # Calls still queued are dropped; running ones end at their SDK timeout
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.snapshot(),
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "hedge_after": self.hedge_after,
+            "max_threads": self.max_threads,
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "hedges": self.hedges
+        }
+
+def openai_transient_errors() -> tuple:
+    import openai
+    return (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+def search_transient_errors() -> tuple:
+    from duckduckgo_search.exceptions import DuckDuckGoSearchException
+    return (DuckDuckGoSearchException,)
+
+openai_upstream = OutboundClient(
+    "openai",
+    timeout=OPENAI_TIMEOUT,
+    retry_on=openai_transient_errors,
+    timeout_kwarg="timeout"
+)
+search_upstream = OutboundClient(
+    "duckduckgo",
+    timeout=SEARCH_TIMEOUT,
+    hedge_after=SEARCH_HEDGE_AFTER,
+    retry_on=search_transient_errors,
+    timeout_kwarg="timeout"
+)
+
+# Utility Functions
+async def set_dataset_status(dataset_id: str, status: str, **fields):
+    """Persist a dataset status change and push it to subscribers"""
+    await datasets.update_one(
+        {"id": dataset_id}, 
+        {"$set": {"status": status, **fields}}
+    )
+    event_hub.publish("dataset", {"id": dataset_id, "status": status, **fields})
+
+class ContentChunker:
+    """Cuts a byte stream into content-defined chunks that end after a newline.
+    
+    A line closes a chunk when a fingerprint of its first and last 8 bytes
+    falls below a threshold proportional to the line's length, so chunks
+    average `avg_size` bytes (between a quarter and four times that). The
+    decision depends only on the line itself. An edit therefore changes the
+    chunks around it, and the chunks after it come out identical. Feeding the
+    same stream in differently sized pieces gives the same chunks.
+    """
+    
+    def __init__(self, avg_size: int, offset: int = 0):
+        self.avg_size = avg_size
+        self.min_size = avg_size // 4
+        self.max_size = avg_size * 4
+        self.offset = offset  # Stream position of the first unchunked byte
+        self.buffer = b""
+    
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        self.buffer = self.buffer + data if self.buffer else data
+        return self._emit(at_eof=False)
+    
+    def finish(self) -> List[Dict[str, Any]]:
+        return self._emit(at_eof=True)
+    
+    def _emit(self, at_eof: bool) -> List[Dict[str, Any]]:
+        import numpy as np
+        buffer = self.buffer
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        ends = np.flatnonzero(data == 10) + 1
+        cuts = self._cuts(np, data, ends, at_eof)
+        if not cuts:
+            return []
+        
+        newlines = np.diff(np.searchsorted(ends, [0] + cuts, side="right")).tolist()
+        view = memoryview(buffer)
+        chunks = []
+        previous = 0
+        for cut, records in zip(cuts, newlines):
+            if at_eof and cut == len(buffer) and buffer[-1:] != b"\n":
+                records += 1  # Final record without a trailing newline
+            chunk = view[previous:cut]
+            chunks.append({
+                # sha256 has hardware support on current CPUs; 128 bits is plenty
+                "hash": hashlib.sha256(chunk).hexdigest()[:32],
+                "offset": self.offset + previous,
+                "size": cut - previous,
+                "records": records,
+                "data": chunk
+            })
+            previous = cut
+        self.offset += previous
+        self.buffer = buffer[previous:]
+        return chunks
+    
+    def _cuts(self, np, data, ends, at_eof: bool) -> List[int]:
+        candidates = []
+        if len(ends):
+            starts = np.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1]
+            lengths = ends - starts
+            # First and last 8 bytes before the newline, read as 8-byte windows
+            short = lengths < 9
+            windows = np.lib.stride_tricks.sliding_window_view(data, 8) if len(data) >= 8 else None
+            if windows is not None:
+                heads = windows[np.where(short, 0, starts)]
+                tails = windows[np.where(short, 0, ends - 9)]
+            else:
+                heads = tails = np.zeros((len(ends), 8), dtype=np.uint8)
+            if short.any():
+                # Clamped to the line, so the fingerprint never looks past its newline
+                index = np.flatnonzero(short)
+                span = np.arange(8)
+                heads[index] = data[np.minimum(starts[index, None] + span, ends[index, None] - 1)]
+                tails[index] = data[np.maximum(ends[index, None] - 9 + span, starts[index, None])]
+            fingerprint = np.ascontiguousarray(heads).view("<u8").ravel() * np.uint64(0x9E3779B97F4A7C15)
+            fingerprint ^= np.ascontiguousarray(tails).view("<u8").ravel()
+            fingerprint ^= fingerprint >> np.uint64(31)
+            fingerprint *= np.uint64(0xBF58476D1CE4E5B9)
+            fingerprint ^= fingerprint >> np.uint64(29)
+            chance = lengths * (2.0 ** 53 / self.avg_size)
+            candidates = ends[(fingerprint >> np.uint64(11)).astype(np.float64) < chance].tolist()
+        
+        cuts = []
+        last = 0
+        for candidate in candidates:
+            while candidate - last > self.max_size:
+                last = self._forced_cut(np, ends, last)
+                cuts.append(last)
+            if candidate - last >= self.min_size:
+                cuts.append(candidate)
+                last = candidate
+        while len(data) - last > self.max_size:
+            last = self._forced_cut(np, ends, last)
+            cuts.append(last)
+        if at_eof and last < len(data):
+            cuts.append(len(data))
+        return cuts
+    
+    def _forced_cut(self, np, ends, last: int) -> int:
+        """Latest line end that keeps the chunk under max_size, else max_size"""
+        index = int(np.searchsorted(ends, last + self.max_size, side="right")) - 1
+        if index >= 0 and ends[index] > last + self.min_size:
+            return int(ends[index])
+        return last + self.max_size
+
+# One leading \b and explicit case classes: IGNORECASE and a \b per branch
+# halve the throughput of Python's regex engine on indicator-heavy feeds
+IOC_PATTERN = re.compile(
+    rb"\b(?:"
+    rb"(?P<url>[hH][tT][tT][pP][sS]?://[^\s\"'<>,;]+)"
+    rb"|(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b)"
+    rb"|(?P<ipv4>(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)\b)"
+    rb"|(?P<cve>[cC][vV][eE]-\d{4}-\d{4,}\b)"
+    rb"|(?P<sha256>[a-fA-F0-9]{64}\b)"
+    rb"|(?P<sha1>[a-fA-F0-9]{40}\b)"
+    rb"|(?P<md5>[a-fA-F0-9]{32}\b)"
+    rb"|(?P<domain>(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,24}\b)"
+    rb")"
+)
+
+def extract_iocs(data: bytes) -> Dict[str, Any]:
+    """Indicators in a chunk: lowercased values and a count per type"""
+    values = set()
+    types: Dict[str, int] = {}
+    for match in IOC_PATTERN.finditer(data):
+        value = match.group().decode("utf-8", "replace").lower().rstrip(".")
+        if value not in values:
+            values.add(value)
+            types[match.lastgroup] = types.get(match.lastgroup, 0) + 1
+    return {"iocs": sorted(values), "ioc_types": types}
+
+# Dataset formats
+DATASET_SNIFF_BYTES = 64 * 1024
+DATASET_MAX_NESTING = 3  # Archive or compression layers, e.g. .tar.gz inside a .zip
+
+CONTAINER_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),  # Empty archive
+)
+
+CEF_LINE = re.compile(rb"CEF:\d+\|")
+# RFC 5424 (<PRI>), RFC 3164 ("Oct 19 10:00:00 host") and ISO-timestamped syslog lines
+SYSLOG_LINE = re.compile(
+    rb"<\d{1,3}>|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d \S|\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\S* \S+ \S"
+)
+
+@functools.lru_cache(maxsize=None)
+def get_zstandard():
+    """The zstandard module, or None if it is not installed"""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def sniff_container(head: bytes) -> Optional[str]:
+    """Compression or archive format from the first bytes of a stream"""
+    for magic, name in CONTAINER_MAGIC:
+        if head.startswith(magic):
+            return name
+    if head[:3] == b"BZh" and head[3:4].isdigit():
+        return "bz2"
+    if head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+def delimited_fields(lines: List[bytes], delimiter: str) -> bool:
+    """Whether most lines split into the same number (>1) of fields"""
+    text = b"\n".join(lines).decode("utf-8", "replace")
+    counts = [len(row) for row in csv.reader(io.StringIO(text), delimiter=delimiter) if row]
+    if not counts:
+        return False
+    common = max(set(counts), key=counts.count)
+    return common > 1 and counts.count(common) >= len(counts) * 0.8
+
+def starts_json_array(text: bytes, complete: bool) -> bool:
+    """Whether text starting with "[" is a JSON array, not e.g. "[2024-10-19 10:00] ..." log lines"""
+    sample = text.decode("utf-8", "replace")
+    position = len(sample) - len(sample[1:].lstrip())
+    if sample[position:position + 1] == "]":
+        return True
+    try:
+        _, end = json.JSONDecoder().raw_decode(sample, position)
+    except json.JSONDecodeError:
+        # A first element too large for the sample
+        return not complete and sample[position:position + 1] in ("{", "[", '"')
+    following = sample[end:].lstrip()[:1]
+    return following in ("", ",", "]")
+
+def sniff_record_format(head: bytes, complete: bool) -> str:
+    """Record format of an uncompressed member from its first bytes.
+    
+    One of json (arrays or concatenated documents), jsonl, cef, syslog, tsv,
+    csv, text, or binary for content that is not text.
+    """
+    if b"\x00" in head[:4096]:
+        return "binary"
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+    if text.startswith(b"[") and starts_json_array(text, complete):
+        return "json"
+    lines = text.split(b"\n")
+    if not complete and len(lines) > 1:
+        lines.pop()  # Cut off by the sample size
+    lines = [line.strip() for line in lines[:50] if line.strip()]
+    if not lines:
+        return "text"
+    
+    def most(predicate) -> bool:
+        return sum(1 for line in lines if predicate(line)) >= len(lines) * 0.8
+    
+    if text.startswith(b"{"):
+        return "jsonl" if most(lambda line: line[:1] == b"{" and line[-1:] == b"}") else "json"
+    if most(lambda line: CEF_LINE.search(line, 0, 256)):
+        return "cef"
+    if most(SYSLOG_LINE.match):
+        return "syslog"
+    if delimited_fields(lines, "\t"):
+        return "tsv"
+    if delimited_fields(lines, ","):
+        return "csv"
+    return "text"
+
+def read_blocks(stream, size: int):
+    while True:
+        block = stream.read(size)
+        if not block:
+            return
+        yield block
+
+# A CSV field: quoted (a quote, then text with "" as escaped quotes, then a quote,
+# no newline inside) or unquoted, where quotes are ordinary characters
+CSV_FIELD = rb'(?:"[^"\n]*+(?:""[^"\n]*+)*+"[^,\n]*+|[^,\n"][^,\n]*+|)'
+# Whole records with no newline inside quotes, skipped in one regex call
+CSV_PLAIN_RECORDS = re.compile(rb"(?:" + CSV_FIELD + rb"(?:," + CSV_FIELD + rb")*+\n)*+")
+CSV_QUOTED_TEXT = re.compile(rb'[^"]*+(?:""[^"]*+)*+')
+
+def csv_records(blocks):
+    """CSV with newlines inside quoted fields turned into spaces, one record per line.
+    
+    Follows the CSV quoting rules: a quote opens a quoted field only at the
+    start of a field, and "" inside one is an escaped quote, so a stray quote
+    such as 5" screen is an ordinary character. The output is as long as the
+    input, so offsets still match the file.
+    """
+    quoted = False
+    pending = False  # Inside quotes and the previous block ended on a quote
+    previous = b"\n"  # Last byte of the previous block
+    for block in blocks:
+        if not quoted and b'"' not in block:
+            previous = block[-1:]
+            yield block
+            continue
+        output = None
+        position = 0
+        if pending:
+            pending = False
+            if block[:1] == b'"':
+                position = 1  # The two quotes were an escaped quote
+            else:
+                quoted = False
+        while position < len(block):
+            if quoted:
+                end = CSV_QUOTED_TEXT.match(block, position).end()
+                if block.find(b"\n", position, end) >= 0:
+                    if output is None:
+                        output = bytearray(block)
+                    output[position:end] = block[position:end].replace(b"\n", b" ")
+                if end >= len(block) - 1:
+                    # No closing quote yet, or a last quote that may be half of ""
+                    pending = end == len(block) - 1
+                    break
+                quoted = False
+                position = end + 1
+                continue
+            if (block[position - 1:position] if position else previous) == b"\n":
+                position = CSV_PLAIN_RECORDS.match(block, position).end()
+            quote = block.find(b'"', position)
+            newline = block.find(b"\n", position)
+            if 0 <= newline < quote or (quote < 0 and newline >= 0):
+                position = newline + 1
+            elif quote < 0:
+                break
+            else:
+                before = block[quote - 1:quote] if quote else previous
+                quoted = before in (b",", b"\n")
+                position = quote + 1
+        previous = block[-1:]
+        yield bytes(output) if output is not None else block
+
+def json_records(blocks):
+    """JSON arrays, or documents one after another, as one compact record per line.
+    
+    Each record is the document's own text with its line breaks replaced by
+    spaces (JSON strings cannot contain raw ones), so nothing is re-encoded.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    whitespace = re.compile(r"[\s,]*")
+    buffer = ""
+    depth = 0  # Open top-level arrays
+    blocks = iter(blocks)
+    at_eof = False
+    while not at_eof:
+        block = next(blocks, None)
+        at_eof = block is None
+        buffer += text_decoder.decode(block or b"", final=at_eof)
+        records = []
+        position = 0
+        while True:
+            position = whitespace.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if depth == 0 and buffer[position] == "[":
+                depth += 1
+                position += 1
+                continue
+            if depth and buffer[position] == "]":
+                depth -= 1
+                position += 1
+                continue
+            try:
+                _, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if at_eof:
+                    raise ValueError(f"Invalid JSON record at character {e.pos}") from None
+                break
+            if end == len(buffer) and not at_eof:
+                break  # A number at the end of the buffer may continue in the next block
+            records.append(buffer[position:end].replace("\r", " ").replace("\n", " "))
+            position = end
+        buffer = buffer[position:]
+        if len(buffer) > DATASET_MAX_RECORD_BYTES:
+            raise ValueError(f"JSON record larger than {DATASET_MAX_RECORD_BYTES} bytes")
+        if records:
+            yield ("\n".join(records) + "\n").encode("utf-8")
+
+# Line-oriented formats are already one record per line and pass through as is
+RECORD_PARSERS = {"json": json_records, "csv": csv_records}
+SEEKABLE_FORMATS = {"jsonl", "cef", "syslog", "tsv", "csv", "text"}
+
+class PrefixedReader(io.RawIOBase):
+    """A stream with bytes already read from it put back in front"""
+    
+    def __init__(self, prefix: bytes, stream):
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+class ExpansionCounter:
+    """Passes reads through to a decompressed stream, charging them to a DatasetReader"""
+    
+    def __init__(self, stream, reader: "DatasetReader"):
+        self.stream = stream
+        self.reader = reader
+    
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.reader.block_size
+        data = self.stream.read(size)
+        self.reader.charge_expanded(len(data))
+        return data
+
+class DatasetReader:
+    """The records of an uploaded dataset as one stream of lines.
+    
+    Compressed files (gzip, bz2, xz, zstd) and archives (zip, tar, and any
+    nesting of them) are expanded while streaming, without temporary files.
+    Each member is sniffed and routed to the parser for its record format,
+    and members are concatenated. Offsets and sizes of chunks refer to this
+    stream. For an uncompressed line-oriented file it is the file itself.
+    
+    Decompressed bytes and archive members are limited by
+    DATASET_MAX_EXPANDED_BYTES and DATASET_MAX_MEMBERS; going over either
+    raises ValueError.
+    """
+    
+    def __init__(self, file_path: str, block_size: Optional[int] = None):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.block_size = block_size or DATASET_READ_BLOCK_BYTES
+        with open(file_path, "rb") as handle:
+            head = handle.read(DATASET_SNIFF_BYTES)
+        self.container = sniff_container(head)
+        self.format = self.container or sniff_record_format(head, complete=len(head) < DATASET_SNIFF_BYTES)
+        self.members: List[Dict[str, Any]] = []
+        self.position = 0
+        self.ends_with_newline = True
+        self.expanded = 0
+    
+    @property
+    def seekable(self) -> bool:
+        """Whether stream offsets are file offsets"""
+        return self.format in SEEKABLE_FORMATS
+    
+    def blocks(self, skip: int = 0):
+        """The record stream from offset `skip`, in blocks (blocking)"""
+        self.members = []
+        self.ends_with_newline = True
+        self.expanded = 0
+        with open(self.file_path, "rb") as handle:
+            if skip and self.seekable:
+                # Resuming at a chunk boundary, which is always at a line start
+                handle.seek(skip)
+                self.position = skip
+                source = self._member(self.name, handle, self.format)
+            else:
+                self.position = 0
+                source = self._expand(self.name, handle, 0)
+            for block in source:
+                start = self.position
+                self.position += len(block)
+                if block:
+                    self.ends_with_newline = block[-1:] == b"\n"
+                if self.position > skip:
+                    yield block[skip - start:] if start < skip else block
+        if skip and self.seekable and self.members:
+            self.members[0].update(offset=0, size=self.position)
+    
+    def read_spans(self, spans: List[tuple]):
+        """Bytes of each (offset, size) span of the stream, in offset order (blocking)"""
+        spans = sorted(spans)
+        if self.seekable:
+            parse = RECORD_PARSERS.get(self.format)
+            with open(self.file_path, "rb") as handle:
+                for offset, size in spans:
+                    handle.seek(offset)
+                    data = handle.read(size)
+                    yield b"".join(parse([data])) if parse else data
+            return
+        index = 0
+        parts = []
+        position = 0
+        for block in self.blocks():
+            end = position + len(block)
+            while index < len(spans):
+                offset, size = spans[index]
+                if offset >= end:
+                    break
+                parts.append(block[max(offset - position, 0):offset + size - position])
+                if offset + size > end:
+                    break
+                yield b"".join(parts)
+                parts = []
+                index += 1
+            if index == len(spans):
+                return
+            position = end
+    
+    def _expand(self, name: str, stream, depth: int):
+        # Decompressors claim to be seekable but rewind the stream under them,
+        # which archive members cannot do; only files and zip members really seek
+        seekable = depth == 0 or isinstance(stream, zipfile.ZipExtFile)
+        if seekable:
+            start = stream.tell()
+            head = stream.read(DATASET_SNIFF_BYTES)
+            stream.seek(start)
+        else:
+            head = stream.read(DATASET_SNIFF_BYTES)
+            stream = io.BufferedReader(PrefixedReader(head, stream), self.block_size)
+        
+        container = sniff_container(head)
+        if container is None:
+            yield from self._member(name, stream, sniff_record_format(head, complete=len(head) < DATASET_SNIFF_BYTES))
+        elif depth >= DATASET_MAX_NESTING:
+            self._skip(name, container, "nested too deeply")
+        elif container == "zip":
+            if not seekable:
+                self._skip(name, container, "zip archives inside tar or compressed files are not supported")
+                return
+            with zipfile.ZipFile(stream) as archive:
+                files = [info for info in archive.infolist() if not info.is_dir()]
+                if len(self.members) + len(files) > DATASET_MAX_MEMBERS:
+                    raise ValueError(f"Upload has more than {DATASET_MAX_MEMBERS} files")
+                for info in files:
+                    # Zip members end at their declared size, so it can be charged up front
+                    self.charge_expanded(info.file_size)
+                    with archive.open(info) as member:
+                        yield from self._expand(f"{name}/{info.filename}", member, depth + 1)
+        elif container == "tar":
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                for info in archive:
+                    if info.isfile():
+                        yield from self._expand(f"{name}/{info.name}", archive.extractfile(info), depth + 1)
+        else:
+            yield from self._expand(name, ExpansionCounter(self._decompress(container, stream), self), depth + 1)
+    
+    def charge_expanded(self, size: int):
+        self.expanded += size
+        if self.expanded > DATASET_MAX_EXPANDED_BYTES:
+            raise ValueError(f"Upload expands to more than {DATASET_MAX_EXPANDED_BYTES} bytes")
+    
+    def _add_member(self, member: Dict[str, Any]):
+        if len(self.members) >= DATASET_MAX_MEMBERS:
+            raise ValueError(f"Upload has more than {DATASET_MAX_MEMBERS} files")
+        self.members.append(member)
+    
+    def _decompress(self, container: str, stream):
+        if container == "gzip":
+            return gzip.GzipFile(fileobj=stream)
+        if container == "bz2":
+            return bz2.BZ2File(stream)
+        if container == "xz":
+            return lzma.LZMAFile(stream)
+        zstandard = get_zstandard()
+        if zstandard is None:
+            raise ValueError("zstd input needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    
+    def _member(self, name: str, stream, record_format: str):
+        member = {"name": name, "format": record_format, "offset": self.position, "size": 0}
+        self._add_member(member)
+        if record_format == "binary":
+            member["skipped"] = "not text"
+            return
+        if not self.ends_with_newline:
+            yield b"\n"  # Keep the previous member's last record separate
+            member["offset"] = self.position
+        parse = RECORD_PARSERS.get(record_format)
+        blocks = read_blocks(stream, self.block_size)
+        yield from parse(blocks) if parse else blocks
+        member["size"] = self.position - member["offset"]
+    
+    def _skip(self, name: str, container: str, reason: str):
+        self._add_member({"name": name, "format": container, "offset": self.position, "size": 0, "skipped": reason})
+
+class DatasetPipeline:
+    """Runs a DatasetReader in its own thread, up to `depth` blocks ahead.
+    
+    Reading, decompressing and parsing the next blocks overlap with chunking
+    and indexing the current ones; file reads, zlib, bz2, lzma and zstd
+    release the GIL while they work.
+    """
+    
+    def __init__(self, reader: DatasetReader, skip: int = 0, depth: Optional[int] = None):
+        self.reader = reader
+        self.queue: queue.Queue = queue.Queue(maxsize=depth or DATASET_PIPELINE_BLOCKS)
+        self.stopped = threading.Event()
+        self.done = False
+        self.thread = threading.Thread(target=self._run, args=(skip,), name="dataset-reader", daemon=True)
+        self.thread.start()
+    
+    def _put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self, skip: int):
+        try:
+            for block in self.reader.blocks(skip):
+                if not self._put(block):
+                    return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+    
+    async def _get(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return await asyncio.to_thread(self.queue.get)
+    
+    async def read(self, size: int) -> bytes:
+        """The next blocks of the stream, up to about `size` bytes; b"" at the end.
+        
+        Only the first block is waited for; the rest are taken if already
+        queued, so chunking starts as soon as a block is ready and the reader
+        keeps running ahead meanwhile.
+        """
+        parts = []
+        total = 0
+        while total < size and not self.done:
+            if parts:
+                try:
+                    block = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                block = await self._get()
+            if block is None:
+                self.done = True
+            elif isinstance(block, Exception):
+                self.done = True
+                raise block
+            else:
+                parts.append(block)
+                total += len(block)
+        return b"".join(parts)
+    
+    def close(self):
+        self.stopped.set()
+        with contextlib.suppress(queue.Empty):
+            while True:
+                self.queue.get_nowait()
+        # Wakes a get() left waiting by a cancelled read
+        with contextlib.suppress(queue.Full):
+            self.queue.put_nowait(None)
+
+def chunk_block(chunker: ContentChunker, data: bytes) -> List[Dict[str, Any]]:
+    """Chunk the next part of the stream; b"" flushes the end (blocking)"""
+    return chunker.feed(data) if data else chunker.finish()
+
+def index_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Chunk documents with their IOC index (blocking)"""
+    now = datetime.utcnow()
+    return [
+        {"_id": chunk["hash"], "size": chunk["size"], "records": chunk["records"], "created_at": now,
+         **extract_iocs(bytes(chunk["data"]))}
+        for chunk in chunks
+    ]
+
+async def store_chunks(dataset_id: str, seq: int, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Index the chunks not seen before and record this slice of the manifest.
+    
+    Returns the chunks that were new.
+    """
+    hashes = [chunk["hash"] for chunk in chunks]
+    known = {doc["_id"] async for doc in dataset_chunks.find({"_id": {"$in": hashes}}, {"_id": 1})}
+    new_chunks = list({chunk["hash"]: chunk for chunk in chunks if chunk["hash"] not in known}.values())
+    if new_chunks:
+        docs = await asyncio.to_thread(index_chunks, new_chunks)
+        try:
+            await dataset_chunks.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Another version being processed indexed the same chunk first
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    await dataset_manifests.insert_one({
+        "dataset_id": dataset_id,
+        "seq": seq,
+        "chunks": hashes,
+        "offsets": [chunk["offset"] for chunk in chunks],
+        "sizes": [chunk["size"] for chunk in chunks]
+    })
+    dataset_chunk_count.inc("new", amount=len(new_chunks))
+    dataset_chunk_count.inc("reused", amount=len(chunks) - len(new_chunks))
+    return new_chunks
+
+async def save_dataset_checkpoint(dataset_id: str, status: str, progress: Dict[str, Any]):
+    """Record how far processing got, so another run can continue from there"""
+    await set_dataset_status(
+        dataset_id, status,
+        checkpoint=dict(progress),
+        worker_id=WORKER_ID,
+        heartbeat_at=datetime.utcnow()
+    )
+
+async def process_dataset(dataset_id: str, file_path: str, checkpoint: Optional[Dict[str, Any]] = None):
+    """Process uploaded dataset in the background.
+    
+    A reader thread decompresses and parses the upload (see DatasetReader)
+    while the record stream is cut into content-defined chunks. Only chunks
+    that no earlier version (of any dataset) contained are indexed. A
+    checkpoint is saved every DATASET_CHECKPOINT_SECONDS at a chunk boundary.
+    On shutdown it is saved with status "interrupted" and the next start
+    resumes from it.
+    """
+    progress = {"offset": 0, "records": 0, "seq": 0, "chunks": 0, "new_chunks": 0, "reused_bytes": 0}
+    if checkpoint and "seq" in checkpoint:
+        progress.update(checkpoint)
+    pipeline = None
+    try:
+        # Update status to processing
+        await save_dataset_checkpoint(dataset_id, "processing", progress)
+        # Manifest slices written after the checkpoint by an interrupted run
+        await dataset_manifests.delete_many({"dataset_id": dataset_id, "seq": {"$gte": progress["seq"]}})
+        
+        start = time.perf_counter()
+        resumed_at = progress["offset"]
+        chunker = ContentChunker(DATASET_CHUNK_BYTES, offset=progress["offset"])
+        reader = await asyncio.to_thread(DatasetReader, file_path)
+        pipeline = DatasetPipeline(reader, skip=progress["offset"])
+        saved_at = time.monotonic()
+        while True:
+            if lifecycle.stopping:
+                await save_dataset_checkpoint(dataset_id, "interrupted", progress)
+                logger.info(f"Dataset {dataset_id} interrupted at byte {progress['offset']}, will resume")
+                return
+            with stage("dataset_read"):
+                data = await pipeline.read(DATASET_SCAN_SLICE_BYTES)
+            with stage("dataset_chunk"):
+                chunks = await asyncio.to_thread(chunk_block, chunker, data)
+            if chunks:
+                with stage("dataset_index"):
+                    new_chunks = await store_chunks(dataset_id, progress["seq"], chunks)
+                progress["seq"] += 1
+                progress["offset"] = chunker.offset
+                progress["records"] += sum(chunk["records"] for chunk in chunks)
+                progress["chunks"] += len(chunks)
+                progress["new_chunks"] += len(new_chunks)
+                progress["reused_bytes"] += sum(chunk["size"] for chunk in chunks) - sum(chunk["size"] for chunk in new_chunks)
+            if not data:
+                break
+            if time.monotonic() - saved_at >= DATASET_CHECKPOINT_SECONDS:
+                await save_dataset_checkpoint(dataset_id, "processing", progress)
+                saved_at = time.monotonic()
+        
+        elapsed = time.perf_counter() - start
+        scanned = progress["offset"] - resumed_at
+        dataset_bytes.inc(amount=scanned)
+        dataset_records.inc(amount=progress["records"])
+        dataset_processing_duration.observe(elapsed)
+        dataset_last_throughput["bytes"] = scanned / max(elapsed, 1e-6)
+        dataset_last_throughput["records"] = progress["records"] / max(elapsed, 1e-6)
+        
+        # Update status to complete
+        await set_dataset_status(
+            dataset_id, "complete",
+            format=reader.format,
+            members=reader.members[:1000],
+            member_count=len(reader.members),
+            size_bytes=progress["offset"],
+            records=progress["records"],
+            chunks=progress["chunks"],
+            new_chunks=progress["new_chunks"],
+            reused_bytes=progress["reused_bytes"],
+            checkpoint=None
+        )
+        
+        logger.info(
+            f"Dataset {dataset_id} processed successfully: {progress['new_chunks']} of "
+            f"{progress['chunks']} chunks new"
+        )
+    except Exception as e:
+        # Update status to failed
+        await set_dataset_status(dataset_id, "failed", error=str(e))
+        logger.error(f"Error processing dataset {dataset_id}: {str(e)}")
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+async def resume_datasets():
+    """Pick up datasets left unfinished by a shutdown or a crashed worker"""
+    stale = datetime.utcnow() - timedelta(seconds=DATASET_STALE_SECONDS)
+    unfinished = {"$or": [
+        {"status": "interrupted"},
+        {"status": "processing", "heartbeat_at": {"$lt": stale}},
+        {"status": "uploaded", "upload_date": {"$lt": stale}}
+    ]}
+    try:
+        async for doc in datasets.find(unfinished, {"_id": 0, "id": 1, "file_path": 1}):
+            # Dataset files live on the disk of the host that received the upload
+            if not os.path.exists(doc["file_path"]):
+                continue
+            claimed = await datasets.find_one_and_update(
+                {"id": doc["id"], **unfinished},
+                {"$set": {"status": "processing", "worker_id": WORKER_ID, "heartbeat_at": datetime.utcnow()}}
+            )
+            if claimed is not None:
+                checkpoint = claimed.get("checkpoint")
+                logger.info(f"Resuming dataset {doc['id']} from byte {(checkpoint or {}).get('offset', 0)}")
+                lifecycle.spawn(process_dataset(doc["id"], doc["file_path"], checkpoint))
+    except Exception as e:
+        logger.error(f"Error resuming datasets: {str(e)}")
+
+async def run_dataset_resumer():
+    """Look for unfinished datasets at startup and then every DATASET_STALE_SECONDS"""
+    while True:
+        await resume_datasets()
+        await asyncio.sleep(DATASET_STALE_SECONDS * random.uniform(0.8, 1.2))
+
+def latency_bucket(latency_ms: float) -> str:
+    """Return the histogram bucket key for a latency in milliseconds"""
+    for bound in LLM_LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"le_{bound}"
+    return "le_inf"
+
+def histogram_percentile(buckets: Dict[str, int], total: int, percentile: float) -> Optional[int]:
+    """Estimate a percentile (upper bucket bound, ms) from a latency histogram"""
+    if not total:
+        return None
+    threshold = total * percentile / 100
+    seen = 0
+    for bound in LLM_LATENCY_BUCKETS_MS:
+        seen += buckets.get(f"le_{bound}", 0)
+        if seen >= threshold:
+            return bound
+    return None  # Falls in the open-ended bucket
+
+async def record_usage(event: str, query: Optional[str] = None, telegram_user_id: Optional[int] = None, count: int = 1):
+    """Increment the analytics rollups for a single event"""
+    now = datetime.utcnow()
+    updates = [
+        usage_hourly.update_one(
+            {"_id": now.strftime("%Y-%m-%dT%H")},
+            {
+                "$inc": {f"counts.{event}": count, "total": count},
+                "$setOnInsert": {"hour": now.replace(minute=0, second=0, microsecond=0)}
+            },
+            upsert=True
+        )
+    ]
+    if query:
+        term = " ".join(query.lower().split())[:200]
+        updates.append(search_term_counts.update_one(
+            {"_id": term},
+            {"$inc": {"count": 1}, "$set": {"last_seen": now}},
+            upsert=True
+        ))
+    if telegram_user_id is not None:
+        updates.append(telegram_user_activity.update_one(
+            {"_id": telegram_user_id},
+            {"$inc": {f"counts.{event}": 1, "total": 1}, "$set": {"last_seen": now}},
+            upsert=True
+        ))
+    try:
+        await asyncio.gather(*updates)
+    except Exception as e:
+        logger.error(f"Error recording usage for {event}: {str(e)}")
+
+async def record_llm_latency(latency_ms: float):
+    """Add an LLM call latency to today's histogram"""
+    try:
+        await llm_latency_daily.update_one(
+            {"_id": datetime.utcnow().strftime("%Y-%m-%d")},
+            {"$inc": {f"buckets.{latency_bucket(latency_ms)}": 1, "count": 1, "sum_ms": latency_ms}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Error recording LLM latency: {str(e)}")
+
+def ddgs_text(query: str, max_results: int, timeout: float = SEARCH_TIMEOUT) -> List[Dict]:
+    """Blocking DuckDuckGo text search (run through search_upstream)"""
+    from duckduckgo_search import DDGS
+    with DDGS(timeout=max(1, round(timeout))) as ddgs:
+        return [r for r in ddgs.text(query, max_results=max_results)]
+
+async def web_search(query: str, max_results: int = 5) -> List[Dict]:
+    """Search the web using DuckDuckGo"""
+    results = []
+    try:
+        results = await search_upstream.call(ddgs_text, query, max_results)
+    except Exception as e:
+        logger.error(f"Error searching web: {str(e)}")
+    return results
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoder(model: str = LLM_MODEL):
+    """Load the tokenizer for a model once; None if tiktoken is unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+        return None
+
+# Counts are cached by a digest of the text, so the cache never holds the texts
+TOKEN_COUNT_CACHE_SIZE = 4096
+token_count_cache: "OrderedDict[bytes, int]" = OrderedDict()
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the model tokenizer (about 4 chars/token fallback)"""
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    count = token_count_cache.get(key)
+    if count is not None:
+        token_count_cache.move_to_end(key)
+        return count
+    encoder = get_token_encoder()
+    if encoder is None:
+        count = len(text) // 4 + 1
+    else:
+        count = len(encoder.encode(text, disallowed_special=()))
+    token_count_cache[key] = count
+    if len(token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+        token_count_cache.popitem(last=False)
+    return count
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to a token budget, keeping its head and tail"""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    # Pasted logs usually matter most at the start and at the end
+    keep_chars = max(int(len(text) * max_tokens / total) - 50, 0)
+    while True:
+        half = keep_chars // 2
+        head = text[:half]
+        tail = text[len(text) - half:] if half else ""
+        trimmed = f"{head}\n[... {total - max_tokens} tokens truncated ...]\n{tail}"
+        # Token density is uneven, so the estimate can still be over budget
+        used = count_tokens(trimmed)
+        if used <= max_tokens or keep_chars == 0:
+            return trimmed
+        keep_chars = max(min(keep_chars - 2, int(keep_chars * max_tokens / used)), 0)
+
+class ConversationContext:
+    """Recent turns of one user's conversation plus a summary of older ones"""
+    
+    def __init__(self, summary: str = "", turns: Optional[List[Dict[str, str]]] = None, version: int = 0):
+        self.summary = summary
+        self.turns = list(turns or [])
+        self.version = version
+        # When this copy was last known to match the stored version
+        self.checked_at = time.monotonic()
+    
+    @classmethod
+    def from_profile(cls, profile: Optional[Dict[str, Any]]) -> "ConversationContext":
+        stored = (profile or {}).get("conversation") or {}
+        return cls(stored.get("summary", ""), stored.get("turns"), (profile or {}).get("conversation_version", 0))
+    
+    def turn_tokens(self) -> int:
+        return sum(count_tokens(turn["content"]) for turn in self.turns)
+    
+    def size_bytes(self) -> int:
+        return len(self.summary) + sum(len(turn["content"]) for turn in self.turns)
+    
+    def messages(self) -> List[Dict[str, str]]:
+        history = []
+        if self.summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        return history + self.turns
+    
+    def add_exchange(self, user_text: str, reply: str, token_budget: int, summary_budget: int):
+        # A single pasted log may not take more than half the window
+        max_chars = token_budget * 2
+        self.turns.append({"role": "user", "content": user_text[:max_chars]})
+        self.turns.append({"role": "assistant", "content": reply[:max_chars]})
+        
+        # Fold the oldest exchanges into the summary until the window fits
+        while self.turn_tokens() > token_budget and len(self.turns) > 2:
+            old_user, old_reply = self.turns[0], self.turns[1]
+            del self.turns[:2]
+            question = " ".join(old_user["content"].split())[:200]
+            answer = " ".join(old_reply["content"].split())[:200]
+            self.summary = f"{self.summary} User asked: {question} Assistant answered: {answer}".strip()
+        
+        # Keep the most recent part of the summary within its budget
+        max_summary_chars = summary_budget * 4
+        if len(self.summary) > max_summary_chars:
+            self.summary = "..." + self.summary[-max_summary_chars:]
+    
+    def to_document(self) -> Dict[str, Any]:
+        return {"summary": self.summary, "turns": self.turns}
+
+class ConversationMemory:
+    """LRU cache of per-user conversation contexts backed by user_profiles.
+    
+    Contexts are loaded lazily on first use and changes are written back by a
+    periodic flusher (or on eviction), so the chat path never waits on Mongo
+    writes. The cache holds at most `max_users` contexts, each bounded by the
+    token budget.
+    
+    In `shared` mode (several workers) each exchange is written before the
+    reply is sent, and only over the version it was built on. If another
+    worker wrote first, the stored conversation is reloaded and the exchange
+    applied to it again, so no exchange is lost. A cached context is used
+    without a round trip for `recheck_seconds` after it was loaded or
+    written; after that one query checks the stored version and returns the
+    newer conversation if there is one.
+    """
+    
+    def __init__(
+        self,
+        collection,
+        max_users: int,
+        token_budget: int,
+        summary_budget: int,
+        shared: bool = False,
+        recheck_seconds: float = CONVERSATION_RECHECK_SECONDS
+    ):
+        self.collection = collection
+        self.max_users = max_users
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.shared = shared
+        self.recheck_seconds = recheck_seconds
+        self.conflicts = 0
+        self.cache = OrderedDict()
+        self.loading: Dict[Any, asyncio.Future] = {}
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    async def get(self, user_id) -> ConversationContext:
+        context = self.cache.get(user_id)
+        if context is not None and self.shared and time.monotonic() - context.checked_at >= self.recheck_seconds:
+            context = await self._recheck(user_id, context)
+        if context is not None:
+            self.cache.move_to_end(user_id)
+            self.hits += 1
+            return context
+        
+        # Concurrent messages from the same user share a single load
+        if user_id in self.loading:
+            return await asyncio.shield(self.loading[user_id])
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.loading[user_id] = future
+        try:
+            profile = await self.collection.find_one({"user_id": user_id}, {"conversation": 1, "conversation_version": 1})
+            context = ConversationContext.from_profile(profile)
+        except Exception as e:
+            logger.error(f"Error loading conversation for {user_id}: {str(e)}")
+            context = ConversationContext()
+        finally:
+            del self.loading[user_id]
+        
+        self.cache[user_id] = context
+        self._evict()
+        future.set_result(context)
+        return context
+    
+    async def get_messages(self, user_id) -> List[Dict[str, str]]:
+        return (await self.get(user_id)).messages()
+    
+    async def _recheck(self, user_id, context: ConversationContext) -> ConversationContext:
+        """The cached context, or the stored one if another worker changed it"""
+        try:
+            # Only returns a document (with the conversation) if the version differs
+            profile = await self.collection.find_one(
+                {"user_id": user_id, "conversation_version": {"$nin": [context.version] + ([None] if not context.version else [])}},
+                {"conversation": 1, "conversation_version": 1}
+            )
+        except Exception as e:
+            logger.error(f"Error checking conversation version for {user_id}: {str(e)}")
+            return context
+        if profile is None:
+            context.checked_at = time.monotonic()
+            return context
+        context = self.cache[user_id] = ConversationContext.from_profile(profile)
+        return context
+    
+    async def add_exchange(self, user_id, user_text: str, reply: str):
+        context = await self.get(user_id)
+        if not self.shared:
+            context.add_exchange(user_text, reply, self.token_budget, self.summary_budget)
+            context.version += 1
+            self.dirty.add(user_id)
+            return
+        
+        for _ in range(3):
+            updated = ConversationContext(context.summary, context.turns, context.version + 1)
+            updated.add_exchange(user_text, reply, self.token_budget, self.summary_budget)
+            if await self._persist(user_id, updated, expected_version=context.version):
+                self.cache[user_id] = updated
+                self._evict()
+                return
+            # Another worker (or a concurrent message) wrote first: build on its version
+            self.conflicts += 1
+            self.cache.pop(user_id, None)
+            context = await self.get(user_id)
+        logger.error(f"Gave up saving conversation for {user_id} after repeated conflicts")
+    
+    def _evict(self):
+        while len(self.cache) > self.max_users:
+            user_id, context = self.cache.popitem(last=False)
+            self.evictions += 1
+            if user_id in self.dirty:
+                self.dirty.discard(user_id)
+                lifecycle.spawn(self._persist(user_id, context))
+    
+    async def _persist(self, user_id, context: ConversationContext, expected_version: Optional[int] = None) -> bool:
+        """Write a context back; False only if `expected_version` is no longer the stored one"""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if expected_version is not None:
+            # Profiles written before versioning have no conversation_version
+            query["conversation_version"] = {"$in": [expected_version] + ([None] if not expected_version else [])}
+        try:
+            result = await self.collection.update_one(
+                query,
+                {"$set": {
+                    "conversation": context.to_document(),
+                    "conversation_version": context.version,
+                    "updated_at": datetime.utcnow()
+                }},
+                # A profile only needs creating for a user's first exchange
+                upsert=not expected_version
+            )
+        except DuplicateKeyError:
+            # The upsert found no profile at that version, but the user has one
+            return False
+        except Exception as e:
+            # Mongo is unavailable: keep the cached copy and reply anyway
+            logger.error(f"Error saving conversation for {user_id}: {str(e)}")
+            return True
+        if expected_version and not result.matched_count:
+            return False
+        context.checked_at = time.monotonic()
+        return True
+    
+    async def flush(self):
+        """Write back every context changed since the last flush"""
+        dirty, self.dirty = self.dirty, set()
+        await asyncio.gather(*(
+            self._persist(user_id, self.cache[user_id]) for user_id in dirty if user_id in self.cache
+        ))
+    
+    async def run_flusher(self, interval: float = 2.0):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        sizes = [context.size_bytes() for context in self.cache.values()]
+        return {
+            "cached_users": len(self.cache),
+            "max_users": self.max_users,
+            "token_budget_per_user": self.token_budget,
+            "total_bytes": sum(sizes),
+            "max_user_bytes": max(sizes, default=0),
+            "pending_writes": len(self.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "write_conflicts": self.conflicts
+        }
+
+conversation_memory = ConversationMemory(
+    user_profiles,
+    CONVERSATION_CACHE_USERS,
+    CONVERSATION_CONTEXT_TOKENS,
+    CONVERSATION_SUMMARY_TOKENS,
+    shared=WEB_CONCURRENCY > 1
+)
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a daily LLM token budget has been used up"""
+
+def usage_day() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+async def check_token_budget(user_id=None):
+    """Raise TokenBudgetExceeded if today's global or per-user budget is spent"""
+    checks = []
+    if LLM_DAILY_TOKEN_BUDGET:
+        checks.append((f"{usage_day()}:global", LLM_DAILY_TOKEN_BUDGET))
+    if LLM_USER_DAILY_TOKEN_BUDGET and user_id is not None:
+        checks.append((f"{usage_day()}:user:{user_id}", LLM_USER_DAILY_TOKEN_BUDGET))
+    for key, budget in checks:
+        doc = await llm_usage_daily.find_one({"_id": key}, {"total_tokens": 1})
+        if doc and doc.get("total_tokens", 0) >= budget:
+            raise TokenBudgetExceeded(f"Daily token budget of {budget} tokens exceeded")
+
+async def record_llm_usage(route: str, user_id, prompt_tokens: int, completion_tokens: int, latency_ms: float):
+    """Meter one LLM call into the daily usage documents"""
+    cost = (prompt_tokens * LLM_PROMPT_PRICE_PER_1K + completion_tokens * LLM_COMPLETION_PRICE_PER_1K) / 1000
+    increments = {
+        "calls": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost_usd": cost,
+        "latency_ms": latency_ms
+    }
+    scopes = ["global", f"route:{route}"]
+    if user_id is not None:
+        scopes.append(f"user:{user_id}")
+    day = usage_day()
+    try:
+        await asyncio.gather(*(
+            llm_usage_daily.update_one(
+                {"_id": f"{day}:{scope}"},
+                {"$inc": increments, "$setOnInsert": {"day": day, "scope": scope}},
+                upsert=True
+            )
+            for scope in scopes
+        ))
+    except Exception as e:
+        logger.error(f"Error recording LLM usage: {str(e)}")
+    await record_llm_latency(latency_ms)
+
+async def llm_complete(
+    prompt: str,
+    system_prompt: str = "You are a cybersecurity expert assistant.",
+    history: Optional[List[Dict[str, str]]] = None,
+    route: str = "chat",
+    user_id=None
+) -> str:
+    """Run a budgeted, metered chat completion; raises on failure"""
+    limits = LLM_ROUTE_LIMITS[route]
+    await check_token_budget(user_id)
+    
+    # The newest prompt is trimmed first, then the oldest history is dropped
+    with stage("llm_prompt_build"):
+        prompt = truncate_to_tokens(prompt, limits["prompt_tokens"] // 2)
+        history = list(history or [])
+        fixed_tokens = count_tokens(system_prompt) + count_tokens(prompt)
+        while history and fixed_tokens + sum(count_tokens(m["content"]) for m in history) > limits["prompt_tokens"]:
+            history.pop(0)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            *history,
+            {"role": "user", "content": prompt}
+        ]
+    
+    start = time.perf_counter()
+    response = await openai_upstream.call(
+        openai_client.chat.completions.create,
+        model=LLM_MODEL,
+        messages=messages,
+        max_tokens=limits["completion_tokens"]
+    )
+    latency_ms = (time.perf_counter() - start) * 1000
+    content = response.choices[0].message.content or ""
+    
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or sum(count_tokens(m["content"]) for m in messages)
+    completion_tokens = getattr(usage, "completion_tokens", None) or count_tokens(content)
+    await record_llm_usage(route, user_id, prompt_tokens, completion_tokens, latency_ms)
+    return content
 
-# Define Models
-class StatusCheck(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    client_name: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+def extract_main_text(html: bytes, encoding: Optional[str] = None, max_chars: int = 5000) -> Dict[str, str]:
+    """Extract the title and main readable text from an HTML page"""
+    from bs4 import BeautifulSoup
+    with stage("html_extract"):
+        soup = BeautifulSoup(html, "lxml", from_encoding=encoding)
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        for tag in soup(["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg"]):
+            tag.decompose()
+        main = soup.find("article") or soup.find("main") or soup.body or soup
+        text = " ".join(main.get_text(" ").split())
+    return {"title": title, "text": text[:max_chars]}
 
-class StatusCheckCreate(BaseModel):
-    client_name: str
+class BlockedAddress(Exception):
+    """Raised when a fetched host resolves to a non-public address"""
 
-class DatasetUpload(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    description: str
-    file_path: str
-    upload_date: datetime = Field(default_factory=datetime.utcnow)
-    status: str = "uploaded"
+class VettedNetworkBackend:
+    """httpcore network backend that connects only to checked addresses.
     
-class DatasetUploadCreate(BaseModel):
-    name: str
-    description: str
+    The host is resolved once per connection, every address is checked, and
+    the socket is opened to the checked address itself. Resolving again in
+    the client would let a DNS-rebinding host pass the check with a public
+    address and then connect to a private one. TLS still verifies and sends
+    SNI for the original host name, and the Host header is unchanged.
+    """
+    
+    def __init__(self, vet):
+        import httpcore
+        self.vet = vet
+        self.backend = httpcore.AnyIOBackend()
+    
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await self.vet(host, port)
+        if address is None:
+            raise BlockedAddress(f"{host} does not resolve to a public address")
+        return await self.backend.connect_tcp(
+            address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+    
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise BlockedAddress("Unix sockets are not fetched")
+    
+    async def sleep(self, seconds: float):
+        await self.backend.sleep(seconds)
 
-class SearchQuery(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    query: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-    result: Optional[Dict[str, Any]] = None
+class PageFetcher:
+    """Fetches result pages concurrently for deep search.
     
-class NameSearchQuery(BaseModel):
-    name: str
+    Uses one pooled async HTTP client, limits concurrent requests per host,
+    honours robots.txt, stops reading at a size cap and revalidates cached
+    pages with ETag / Last-Modified. Text extraction runs in a dedicated
+    thread pool so parsing never blocks the event loop.
     
-class WebSearchQuery(BaseModel):
-    query: str
+    Result URLs come from outside, so hosts that resolve to loopback, private,
+    link-local or other non-global addresses are refused when connecting, and
+    redirects are followed here rather than by the client so every hop is
+    checked again.
+    """
     
-class MessageData(BaseModel):
-    message: str
+    ROBOTS_TTL = 3600
     
-class TelegramConfig(BaseModel):
-    token: str
+    def __init__(
+        self,
+        max_bytes: int,
+        per_host: int,
+        timeout: float,
+        workers: int,
+        cache_size: int,
+        user_agent: str,
+        max_redirects: int = DEEP_SEARCH_MAX_REDIRECTS,
+        max_hosts: int = DEEP_SEARCH_MAX_HOSTS,
+        allow_private: bool = False
+    ):
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.timeout = timeout
+        self.workers = workers
+        self.cache_size = cache_size
+        self.user_agent = user_agent
+        self.max_redirects = max_redirects
+        self.max_hosts = max_hosts
+        self.allow_private = allow_private
+        self.client: Optional["httpx.AsyncClient"] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # host -> [semaphore, requests using it]; idle hosts are evicted oldest first
+        self.host_limits: OrderedDict = OrderedDict()
+        self.robots: OrderedDict = OrderedDict()
+        self.cache = OrderedDict()
+        self.cache_hits = 0
     
-class OpenAIConfig(BaseModel):
-    api_key: str
-
-# Utility Functions
-async def process_dataset(dataset_id: str, file_path: str):
-    """Process uploaded dataset in the background"""
-    try:
-        # Update status to processing
-        await datasets.update_one(
-            {"id": dataset_id}, 
-            {"$set": {"status": "processing"}}
-        )
-        
-        # Simulate processing (in a real app, you'd analyze the dataset here)
-        await asyncio.sleep(2)
+    def _client(self) -> "httpx.AsyncClient":
+        import httpx
+        import httpcore
+        if self.client is None:
+            transport = httpx.AsyncHTTPTransport()
+            # httpx has no network backend option, so give the transport a pool that connects through one
+            transport._pool = httpcore.AsyncConnectionPool(
+                ssl_context=httpx.create_ssl_context(),
+                max_connections=50,
+                max_keepalive_connections=20,
+                network_backend=VettedNetworkBackend(self.public_address)
+            )
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=False,
+                headers={"User-Agent": self.user_agent},
+                transport=transport
+            )
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extract")
+        return self.client
+    
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.executor.shutdown(wait=False)
+            self.client = None
+    
+    @contextlib.asynccontextmanager
+    async def _host_limit(self, host: str):
+        entry = self.host_limits.get(host)
+        if entry is None:
+            entry = self.host_limits[host] = [asyncio.Semaphore(self.per_host), 0]
+            if len(self.host_limits) > self.max_hosts:
+                idle = [name for name, (_, users) in self.host_limits.items() if not users and name != host]
+                for name in idle[:len(self.host_limits) - self.max_hosts]:
+                    del self.host_limits[name]
+        self.host_limits.move_to_end(host)
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+    
+    async def public_address(self, host: str, port: int) -> Optional[str]:
+        """The address to connect to, if every address the host resolves to is globally routable"""
+        if self.allow_private:
+            return host
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            return None
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%")[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                return None
+        return infos[0][4][0] if infos else None
+    
+    async def allowed(self, url: str) -> bool:
+        """Check robots.txt for the URL's host (cached for an hour)"""
+        import httpx
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        cached = self.robots.get(origin)
+        if cached is None or time.monotonic() - cached[1] > self.ROBOTS_TTL:
+            parser = RobotFileParser()
+            try:
+                async with self._host_limit(parts.netloc):
+                    response = await self._client().get(f"{origin}/robots.txt")
+                if response.status_code in (401, 403):
+                    parser.disallow_all = True
+                elif response.status_code >= 300:
+                    # Redirected robots.txt is not followed and counts as missing
+                    parser.allow_all = True
+                else:
+                    parser.parse(response.text.splitlines())
+            except httpx.HTTPError:
+                parser.disallow_all = True
+            cached = self.robots[origin] = (parser, time.monotonic())
+            while len(self.robots) > self.max_hosts:
+                self.robots.popitem(last=False)
+        self.robots.move_to_end(origin)
+        return cached[0].can_fetch(self.user_agent, url)
+    
+    async def fetch(self, url: str) -> Dict[str, Any]:
+        """Fetch a page and return its extracted text, or why it was skipped"""
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                return {"url": url, "status": "unsupported"}
+            try:
+                # Raises for a port out of range
+                parts.port
+            except ValueError:
+                return {"url": url, "status": "unsupported"}
+            try:
+                if not await self.allowed(url):
+                    return {"url": url, "status": "blocked_by_robots"}
+                result = await self._get(url)
+            except BlockedAddress:
+                return {"url": url, "status": "blocked_address"}
+            if result["status"] != "redirect":
+                return result
+            url = result["location"]
+        return {"url": url, "status": "too_many_redirects"}
+    
+    async def _get(self, url: str) -> Dict[str, Any]:
+        """One request, without following redirects"""
+        import httpx
+        cached = self.cache.get(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
         
-        # Update status to complete
-        await datasets.update_one(
-            {"id": dataset_id}, 
-            {"$set": {"status": "complete"}}
-        )
+        try:
+            async with self._host_limit(urlsplit(url).netloc):
+                async with self._client().stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and cached:
+                        self.cache.move_to_end(url)
+                        self.cache_hits += 1
+                        return {"url": url, "status": "not_modified", **cached["page"]}
+                    if response.is_redirect and response.headers.get("location"):
+                        return {"url": url, "status": "redirect", "location": urljoin(url, response.headers["location"])}
+                    if response.status_code >= 300:
+                        return {"url": url, "status": f"http_{response.status_code}"}
+                    content_type = response.headers.get("content-type", "")
+                    if "html" not in content_type and "text/plain" not in content_type:
+                        return {"url": url, "status": "unsupported_content"}
+                    
+                    body = bytearray()
+                    truncated = False
+                    async for chunk in response.aiter_bytes():
+                        body.extend(chunk)
+                        if len(body) >= self.max_bytes:
+                            truncated = True
+                            break
+                    etag = response.headers.get("etag")
+                    last_modified = response.headers.get("last-modified")
+                    encoding = response.charset_encoding
+        except httpx.HTTPError as e:
+            return {"url": url, "status": "error", "error": str(e)}
         
-        logger.info(f"Dataset {dataset_id} processed successfully")
-    except Exception as e:
-        # Update status to failed
-        await datasets.update_one(
-            {"id": dataset_id}, 
-            {"$set": {"status": "failed", "error": str(e)}}
+        page = await asyncio.get_running_loop().run_in_executor(
+            self.executor, extract_main_text, bytes(body[:self.max_bytes]), encoding
         )
-        logger.error(f"Error processing dataset {dataset_id}: {str(e)}")
+        page["truncated"] = truncated
+        if etag or last_modified:
+            self.cache[url] = {"etag": etag, "last_modified": last_modified, "page": page}
+            self.cache.move_to_end(url)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return {"url": url, "status": "ok", **page}
 
-async def web_search(query: str, max_results: int = 5) -> List[Dict]:
-    """Search the web using DuckDuckGo"""
-    results = []
-    try:
-        with DDGS() as ddgs:
-            search_results = [r for r in ddgs.text(query, max_results=max_results)]
-            results = search_results
-    except Exception as e:
-        logger.error(f"Error searching web: {str(e)}")
+page_fetcher = PageFetcher(
+    DEEP_SEARCH_MAX_BYTES,
+    DEEP_SEARCH_PER_HOST,
+    DEEP_SEARCH_TIMEOUT,
+    DEEP_SEARCH_WORKERS,
+    PAGE_CACHE_SIZE,
+    DEEP_SEARCH_USER_AGENT
+)
+
+async def deep_web_search(query: str, max_results: int = 5) -> List[Dict]:
+    """Web search that also fetches the top result pages and extracts their text"""
+    return await attach_pages(await web_search(query, max_results))
+
+async def attach_pages(results: List[Dict]) -> List[Dict]:
+    """Fetch the top results' pages and add their extracted text to each"""
+    top = results[:DEEP_SEARCH_MAX_PAGES]
+    budget = page_fetcher.timeout * 2
+    deadline = request_deadline.get()
+    if deadline is not None:
+        budget = min(budget, deadline - time.monotonic())
+    
+    tasks = [asyncio.ensure_future(page_fetcher.fetch(result.get("href", ""))) for result in top]
+    if tasks:
+        # Whatever has not finished within the budget is reported as timed out
+        with stage("deep_fetch"):
+            await asyncio.wait(tasks, timeout=max(budget, 0))
+    for result, task in zip(top, tasks):
+        if task.done() and task.exception() is None:
+            page = task.result()
+        else:
+            task.cancel()
+            page = {"status": "timeout" if not task.done() else "error"}
+        result["page"] = {key: value for key, value in page.items() if key != "url"}
     return results
 
-async def get_llm_response(prompt: str) -> str:
+CVE_PATTERN = re.compile(r'\bCVE-\d{4}-\d{4,}\b', re.IGNORECASE)
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "ref", "source")
+
+def expand_security_query(query: str) -> List[str]:
+    """Phrase a security question a few ways to widen search recall"""
+    variants = [query]
+    cve = CVE_PATTERN.search(query)
+    if cve:
+        cve_id = cve.group(0).upper()
+        variants += [f"{cve_id} exploit", f"{cve_id} vendor advisory", f"{cve_id} patch"]
+    else:
+        variants += [f"{query} exploit", f"{query} security advisory"]
+    return variants
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL used to deduplicate search results"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    ))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower() or "https", host, path, query, ""))
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], queries: List[str], k: int = 60) -> List[Dict]:
+    """Merge ranked result lists by URL, scoring each by sum(1 / (k + rank))"""
+    fused: Dict[str, Dict] = {}
+    for query, results in zip(queries, result_lists):
+        for rank, result in enumerate(results, 1):
+            key = normalize_url(result.get("href", ""))
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**result, "score": 0.0, "matched_queries": []}
+            entry["score"] += 1 / (k + rank)
+            entry["matched_queries"].append(query)
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+
+async def multi_query_search(queries: List[str], max_results: int = 5) -> List[Dict]:
+    """Run several phrasings concurrently and fuse whatever returns in budget"""
+    budget = SEARCH_FANOUT_BUDGET
+    deadline = request_deadline.get()
+    if deadline is not None:
+        budget = min(budget, deadline - time.monotonic())
+    
+    tasks = [asyncio.ensure_future(web_search(query, max_results)) for query in queries]
+    await asyncio.wait(tasks, timeout=max(budget, 0))
+    finished_queries, result_lists = [], []
+    for query, task in zip(queries, tasks):
+        if task.done():
+            finished_queries.append(query)
+            result_lists.append(task.result())
+        else:
+            task.cancel()
+            logger.warning(f"Search for '{query}' missed the fan-out budget")
+    fused = reciprocal_rank_fusion(result_lists, finished_queries)
+    for result in fused:
+        result["score"] = round(result["score"], 5)
+    return fused
+
+async def get_llm_response(
+    prompt: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    route: str = "chat",
+    user_id=None
+) -> str:
     """Get response from OpenAI API"""
     if not openai_client:
         return "OpenAI API key not configured."
     
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a cybersecurity expert assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
-        )
-        return response.choices[0].message.content
+        return await llm_complete(prompt, history=history, route=route, user_id=user_id)
+    except TokenBudgetExceeded as e:
+        logger.warning(f"LLM request refused: {str(e)}")
+        return f"{str(e)}. Please try again tomorrow."
     except Exception as e:
         logger.error(f"OpenAI API error: {str(e)}")
         return f"Error: {str(e)}"
@@ -303,66 +2925,1185 @@ async def person_search(name: str) -> Dict[str, Any]:
             if url not in personal_info["possible_websites"]:
                 personal_info["possible_websites"].append(url)
     
-    # Generate a summary if OpenAI is available
-    if openai_client:
-        try:
-            # Prepare a concise dataset for summary generation
-            summary_data = {
-                "name": name,
-                "social_profiles": [p["platform"] for p in social_profiles],
-                "possible_occupations": personal_info["possible_occupations"],
-                "possible_locations": personal_info["possible_locations"],
-                "possible_education": personal_info["possible_education"],
-                "articles_count": len(articles),
-                "mentions_count": len(mentions)
-            }
-            
-            summary_prompt = f"""Based on the following information about {name}, provide a brief professional summary (2-3 sentences):
-            
-            {json.dumps(summary_data, indent=2)}
-            
-            Summary:"""
-            
-            response = openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a professional summarizer. Create concise, factual summaries based only on the provided information."},
-                    {"role": "user", "content": summary_prompt}
-                ],
-                max_tokens=150
+    # Generate a summary if OpenAI is available
+    if openai_client:
+        try:
+            # Prepare a concise dataset for summary generation
+            summary_data = {
+                "name": name,
+                "social_profiles": [p["platform"] for p in social_profiles],
+                "possible_occupations": personal_info["possible_occupations"],
+                "possible_locations": personal_info["possible_locations"],
+                "possible_education": personal_info["possible_education"],
+                "articles_count": len(articles),
+                "mentions_count": len(mentions)
+            }
+            
+            summary_prompt = f"""Based on the following information about {name}, provide a brief professional summary (2-3 sentences):
+            
+            {json.dumps(summary_data, indent=2)}
+            
+            Summary:"""
+            
+            personal_info["summary"] = await llm_complete(
+                summary_prompt,
+                system_prompt="You are a professional summarizer. Create concise, factual summaries based only on the provided information.",
+                route="person_summary"
+            )
+        except Exception as e:
+            logger.error(f"Error generating summary: {str(e)}")
+            personal_info["summary"] = f"Information gathered about {name} includes possible social profiles, professional details, and online mentions."
+    else:
+        personal_info["summary"] = f"Information gathered about {name} includes possible social profiles, professional details, and online mentions."
+    
+    # Assemble the results
+    results = {
+        "personal_info": personal_info,
+        "social_profiles": social_profiles,
+        "professional_info": professional_info,
+        "articles": articles,
+        "mentions": mentions[:5],  # Limit to top 5 mentions
+    }
+    
+    return results
+
+# Batch chat
+class ChatBatch:
+    """A running batch of chat prompts and its results in completion order.
+    
+    The batch runs in its own task, independent of any HTTP stream, so a
+    client that disconnects can follow it again by batch ID.
+    """
+    
+    def __init__(self, batch_id: str, prompts: List[str], results: Optional[List[Dict[str, Any]]] = None):
+        self.batch_id = batch_id
+        self.prompts = prompts
+        self.results: List[Dict[str, Any]] = list(results or [])
+        self.finished = False
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+    
+    def add_result(self, result: Dict[str, Any]):
+        self.results.append(result)
+        self.changed.set()
+        self.changed = asyncio.Event()
+    
+    def finish(self):
+        self.finished = True
+        self.changed.set()
+    
+    async def follow(self, after: int = 0):
+        """Yield results from position `after`, waiting for new ones until done"""
+        position = after
+        while True:
+            while position < len(self.results):
+                yield self.results[position]
+                position += 1
+            if self.finished:
+                return
+            await self.changed.wait()
+
+# Batches kept in memory for resuming (most recent last)
+active_batches = OrderedDict()
+MAX_TRACKED_BATCHES = 100
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+async def run_batch(batch: ChatBatch):
+    """Answer the prompts of a batch that have no stored result yet.
+    
+    Answers are buffered and stored with one bulk insert every
+    BATCH_PERSIST_EVERY answers or BATCH_PERSIST_SECONDS, so a batch resumed
+    after its worker went away only answers what was not stored. A failed
+    write keeps the answers buffered for the next flush.
+    """
+    # Batches outlive the request that started them
+    request_deadline.set(None)
+    answered = {result["index"] for result in batch.results}
+    unsaved: List[Dict[str, Any]] = []
+    flush_lock = asyncio.Lock()
+    
+    async def flush() -> bool:
+        """Store the buffered answers; returns True when none are left unsaved"""
+        async with flush_lock:
+            if not unsaved:
+                return True
+            docs = list(unsaved)
+            unsaved.clear()
+            try:
+                await conversations.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Duplicates were stored by an earlier attempt; retry only the rest
+                failed = {
+                    error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000
+                }
+                unsaved[:0] = [doc for index, doc in enumerate(docs) if index in failed]
+                if failed:
+                    logger.error(f"Error storing {len(failed)} results of chat batch {batch.batch_id}: {str(e)}")
+            except asyncio.CancelledError:
+                unsaved[:0] = docs
+                raise
+            except Exception as e:
+                unsaved[:0] = docs
+                logger.error(f"Error storing results of chat batch {batch.batch_id}: {str(e)}")
+            return not unsaved
+    
+    async def answer(index: int, prompt: str):
+        async with batch_semaphore:
+            response = await get_llm_response(prompt, route="batch")
+        result = {
+            "batch_id": batch.batch_id,
+            "index": index,
+            "seq": len(batch.results),
+            "message": prompt,
+            "response": response
+        }
+        batch.add_result(result)
+        unsaved.append({"id": str(uuid.uuid4()), "timestamp": datetime.utcnow(), **result})
+        if len(unsaved) >= BATCH_PERSIST_EVERY:
+            await flush()
+    
+    async def flusher():
+        while True:
+            await asyncio.sleep(BATCH_PERSIST_SECONDS)
+            await flush()
+    
+    async def heartbeat():
+        # Lets other workers see that this batch is still being worked on
+        while True:
+            await chat_batches.update_one(
+                {"batch_id": batch.batch_id},
+                {"$set": {"worker_id": WORKER_ID, "heartbeat_at": datetime.utcnow()}}
+            )
+            await asyncio.sleep(BATCH_HEARTBEAT_SECONDS)
+    
+    heartbeat_task = asyncio.create_task(heartbeat())
+    flusher_task = asyncio.create_task(flusher())
+    try:
+        await asyncio.gather(*(
+            answer(i, prompt) for i, prompt in enumerate(batch.prompts) if i not in answered
+        ))
+        for attempt in range(3):
+            if await flush():
+                break
+            await asyncio.sleep(2 ** attempt)
+        else:
+            # Left running: once heartbeats stop, a resume answers the unsaved prompts again
+            logger.error(f"Chat batch {batch.batch_id} finished with {len(unsaved)} results not stored")
+            return
+        await chat_batches.update_one(
+            {"batch_id": batch.batch_id},
+            {"$set": {"status": "complete", "completed_at": datetime.utcnow()}}
+        )
+        await record_usage("chat", count=len(batch.results) - len(answered))
+    except Exception as e:
+        logger.error(f"Error running chat batch {batch.batch_id}: {str(e)}")
+        await chat_batches.update_one(
+            {"batch_id": batch.batch_id},
+            {"$set": {"status": "failed", "error": str(e)}}
+        )
+    finally:
+        heartbeat_task.cancel()
+        flusher_task.cancel()
+        # Cancelled at shutdown: keep what was answered so a resume can skip it
+        if unsaved:
+            await flush()
+        batch.finish()
+
+def start_batch(batch_id: str, prompts: List[str], results: Optional[List[Dict[str, Any]]] = None) -> ChatBatch:
+    batch = ChatBatch(batch_id, prompts, results)
+    batch.task = lifecycle.spawn(run_batch(batch))
+    active_batches[batch_id] = batch
+    while len(active_batches) > MAX_TRACKED_BATCHES:
+        oldest_id = next(iter(active_batches))
+        if not active_batches[oldest_id].finished:
+            break
+        del active_batches[oldest_id]
+    return batch
+
+async def stored_batch_results(batch_id: str, after: int):
+    """Yield a finished batch's results back from the conversations collection"""
+    cursor = conversations.find(
+        {"batch_id": batch_id, "seq": {"$gte": after}},
+        {"_id": 0, "batch_id": 1, "index": 1, "seq": 1, "message": 1, "response": 1}
+    ).sort("seq", 1)
+    async for doc in cursor:
+        yield doc
+
+async def claim_stale_batch(record: Dict[str, Any]) -> bool:
+    """Atomically take over a batch whose worker stopped sending heartbeats"""
+    claimed = await chat_batches.find_one_and_update(
+        {"batch_id": record["batch_id"], "status": {"$ne": "complete"}, "heartbeat_at": record.get("heartbeat_at")},
+        {"$set": {"status": "running", "worker_id": WORKER_ID, "heartbeat_at": datetime.utcnow()}}
+    )
+    # Someone else (another request or worker) claimed it first
+    return claimed is not None
+
+async def batch_stream(batch_id: str, after: int = 0):
+    """Find (or restart) a batch and return an NDJSON stream of its results"""
+    if batch_id in active_batches:
+        results = active_batches[batch_id].follow(after)
+    else:
+        record = await chat_batches.find_one({"batch_id": batch_id})
+        if record is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        heartbeat = record.get("heartbeat_at")
+        if record["status"] == "complete":
+            results = stored_batch_results(batch_id, after)
+        elif (
+            (heartbeat and datetime.utcnow() - heartbeat < timedelta(seconds=BATCH_HEARTBEAT_SECONDS * 3))
+            or not await claim_stale_batch(record)
+        ):
+            if batch_id in active_batches:
+                # Claimed by a concurrent request to this worker
+                return await batch_stream(batch_id, after)
+            # Still running on another worker; follow-up results are only in that process
+            raise HTTPException(
+                status_code=409,
+                detail="Batch is running on another worker, retry shortly",
+                headers={"Retry-After": str(int(BATCH_HEARTBEAT_SECONDS))}
+            )
+        else:
+            # The process running it went away; answer only what it had not stored
+            stored = [result async for result in stored_batch_results(batch_id, 0)]
+            results = start_batch(batch_id, record["prompts"], stored).follow(after)
+    
+    async def lines():
+        async for result in results:
+            yield json.dumps(result, default=json_default) + "\n"
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Watchlists
+def next_watchlist_run(interval_minutes: int, now: Optional[datetime] = None) -> datetime:
+    """Next run time with +/-10% jitter so watchlists drift apart"""
+    interval = interval_minutes * 60 * random.uniform(0.9, 1.1)
+    return (now or datetime.utcnow()) + timedelta(seconds=interval)
+
+async def create_watchlist(data: WatchlistCreate) -> Dict[str, Any]:
+    interval = max(data.interval_minutes, WATCHLIST_MIN_INTERVAL_MINUTES)
+    now = datetime.utcnow()
+    watchlist = {
+        "id": str(uuid.uuid4()),
+        "name": data.name,
+        "query": data.query,
+        "interval_minutes": interval,
+        "telegram_chat_id": data.telegram_chat_id,
+        "enabled": True,
+        "created_at": now,
+        "last_run_at": None,
+        # First run lands anywhere in the first interval to spread load
+        "next_run_at": now + timedelta(seconds=random.uniform(0, min(interval * 60, 300))),
+        "baseline_done": False,
+        "hit_count": 0
+    }
+    await watchlists.insert_one(watchlist)
+    watchlist.pop("_id", None)
+    return watchlist
+
+async def run_watchlist(watchlist: Dict[str, Any]) -> Optional[int]:
+    """Re-run a watchlist's search and store (and announce) unseen URLs.
+    
+    Returns the number of new hits, or None when the search returned nothing
+    (web_search also returns nothing on upstream errors), in which case no
+    baseline was recorded either.
+    """
+    results = await web_search(watchlist["query"], max_results=10)
+    by_key = {}
+    for result in results:
+        if result.get("href"):
+            by_key.setdefault(normalize_url(result["href"]), result)
+    if not by_key:
+        return None
+    
+    seen = await watchlist_seen.find(
+        {"watchlist_id": watchlist["id"], "url_key": {"$in": list(by_key)}},
+        {"url_key": 1}
+    ).to_list(None)
+    new_keys = [key for key in by_key if key not in {doc["url_key"] for doc in seen}]
+    if not new_keys:
+        return 0
+    
+    now = datetime.utcnow()
+    try:
+        await watchlist_seen.insert_many(
+            [{"watchlist_id": watchlist["id"], "url_key": key, "first_seen": now} for key in new_keys],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        # A concurrent run recorded some of these first; it reports those
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+        new_keys = [key for index, key in enumerate(new_keys) if index not in duplicates]
+        if not new_keys:
+            return 0
+    
+    # The first run only records a baseline; later runs report new hits
+    if not watchlist.get("baseline_done"):
+        return 0
+    hits = [{
+        "watchlist_id": watchlist["id"],
+        "url": by_key[key].get("href"),
+        "title": by_key[key].get("title"),
+        "body": by_key[key].get("body"),
+        "found_at": now
+    } for key in new_keys]
+    await watchlist_hits.insert_many(hits)
+    
+    if watchlist.get("telegram_chat_id"):
+        message = f"🔔 {len(hits)} new result(s) for watchlist '{watchlist['name']}':\n\n"
+        for hit in hits:
+            message += f"• {hit['title']}\n  {hit['url']}\n"
+        telegram_send_queue.send(watchlist["telegram_chat_id"], message)
+    return len(hits)
+
+async def claim_due_watchlist() -> Optional[Dict[str, Any]]:
+    """Atomically take one due watchlist by pushing its next run forward"""
+    now = datetime.utcnow()
+    watchlist = await watchlists.find_one({"enabled": True, "next_run_at": {"$lte": now}}, sort=[("next_run_at", 1)])
+    if watchlist is None:
+        return None
+    claimed = await watchlists.find_one_and_update(
+        {"id": watchlist["id"], "next_run_at": watchlist["next_run_at"]},
+        {"$set": {"next_run_at": next_watchlist_run(watchlist["interval_minutes"], now), "last_run_at": now}}
+    )
+    # Someone else (another worker) claimed it first: try the next one
+    return claimed or await claim_due_watchlist()
+
+async def run_watchlist_scheduler():
+    """Run due watchlists forever, at most WATCHLIST_MAX_CONCURRENT at a time"""
+    semaphore = asyncio.Semaphore(WATCHLIST_MAX_CONCURRENT)
+    
+    async def run_one(watchlist):
+        # Each run is its own task, so this id only tags this run's logs
+        current_request_id.set(f"watchlist-{watchlist['id']}-{uuid.uuid4().hex[:8]}")
+        try:
+            found = await run_watchlist(watchlist)
+            if found is not None:
+                await watchlists.update_one(
+                    {"id": watchlist["id"]},
+                    {"$set": {"baseline_done": True}, "$inc": {"hit_count": found}}
+                )
+        except Exception as e:
+            logger.error(f"Error running watchlist {watchlist['id']}: {str(e)}")
+        finally:
+            semaphore.release()
+    
+    while True:
+        try:
+            while True:
+                await semaphore.acquire()
+                watchlist = await claim_due_watchlist()
+                if watchlist is None:
+                    semaphore.release()
+                    break
+                lifecycle.spawn(run_one(watchlist))
+        except Exception as e:
+            logger.error(f"Watchlist scheduler error: {str(e)}")
+        await asyncio.sleep(WATCHLIST_POLL_SECONDS * random.uniform(0.8, 1.2))
+
+# Multi-worker coordination
+class LeaderLease:
+    """Mongo-backed lease so exactly one worker holds a role at a time.
+    
+    The holder renews it well before it expires; if the holder dies, another
+    worker takes over once the lease has lapsed.
+    """
+    
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.is_leader = False
+    
+    async def try_acquire(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            await leader_locks.update_one(
+                {"_id": self.name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True
+            )
+            self.is_leader = True
+        except DuplicateKeyError:
+            # The lease exists and belongs to a live worker
+            self.is_leader = False
+        return self.is_leader
+    
+    async def release(self):
+        if self.is_leader:
+            await leader_locks.delete_one({"_id": self.name, "owner": WORKER_ID})
+            self.is_leader = False
+
+telegram_lease = LeaderLease("telegram_bot", LEADER_LEASE_SECONDS)
+telegram_lifecycle_lock = asyncio.Lock()
+runtime_config_version = 0
+
+async def sync_telegram_bot():
+    """Start or stop this worker's bot to match the token and leadership.
+    
+    In polling mode only the lease holder polls Telegram. In webhook mode any
+    worker may receive updates, so every worker runs the application and the
+    lease holder registers the webhook.
+    """
+    async with telegram_lifecycle_lock:
+        if not TELEGRAM_BOT_TOKEN:
+            await stop_telegram_bot()
+            return
+        try:
+            leader = await telegram_lease.try_acquire()
+        except Exception as e:
+            logger.error(f"Telegram leader election failed: {str(e)}")
+            leader = False
+        
+        if TELEGRAM_MODE == "webhook":
+            if telegram_application is None:
+                await start_telegram_bot(register_webhook=leader)
+        elif leader and telegram_application is None:
+            await start_telegram_bot()
+        elif not leader and telegram_application is not None:
+            logger.info("Lost Telegram leadership, stopping poller")
+            await stop_telegram_bot()
+
+async def run_telegram_supervisor():
+    """Renew the bot lease and keep the bot state in sync"""
+    while True:
+        await sync_telegram_bot()
+        await asyncio.sleep(LEADER_LEASE_SECONDS / 3)
+
+class ConfigValidationError(Exception):
+    """Raised when a submitted credential is rejected by its service"""
+
+class ConfigConflict(Exception):
+    """Raised when the shared config changed since the caller last read it"""
+
+config_apply_lock = asyncio.Lock()
+
+def build_openai_client(api_key: str):
+    """Client for a new key, sharing the current client's connection pool"""
+    if openai_client is not None:
+        return openai_client.copy(api_key=api_key)
+    import openai
+    return openai.OpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=0)
+
+async def validate_openai_key(api_key: str):
+    """Check a key against the API without blocking the event loop"""
+    import openai
+    candidate = build_openai_client(api_key)
+    try:
+        await asyncio.wait_for(
+            asyncio.to_thread(candidate.models.list, timeout=CONFIG_VALIDATION_TIMEOUT),
+            timeout=CONFIG_VALIDATION_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise ConfigValidationError("OpenAI did not answer in time")
+    except openai.APIError as e:
+        raise ConfigValidationError(str(e))
+    return candidate
+
+async def validate_telegram_token(token: str):
+    """Check a token with getMe; the returned bot is ready to use"""
+    import telegram.error
+    candidate = build_telegram_bot(token)
+    try:
+        await asyncio.wait_for(candidate.initialize(), timeout=CONFIG_VALIDATION_TIMEOUT)
+    except asyncio.TimeoutError:
+        await candidate.shutdown()
+        raise ConfigValidationError("Telegram did not answer in time")
+    except telegram.error.TelegramError as e:
+        await candidate.shutdown()
+        raise ConfigValidationError(str(e))
+    return candidate
+
+def build_telegram_bot(token: str):
+    import telegram
+    if TELEGRAM_API_BASE_URL:
+        return telegram.Bot(token=token, base_url=TELEGRAM_API_BASE_URL)
+    return telegram.Bot(token=token)
+
+def init_integrations():
+    """Create the clients for whichever integrations are configured"""
+    global openai_client, telegram_bot
+    if OPENAI_API_KEY and openai_client is None:
+        openai_client = build_openai_client(OPENAI_API_KEY)
+    if TELEGRAM_BOT_TOKEN and telegram_bot is None:
+        telegram_bot = build_telegram_bot(TELEGRAM_BOT_TOKEN)
+
+async def save_runtime_config(expected_version: Optional[int] = None, **values) -> Dict[str, Any]:
+    """Store config values shared by all workers and bump the version.
+    
+    With `expected_version` the write only succeeds if nobody else has
+    changed the config since that version was read.
+    """
+    query: Dict[str, Any] = {"_id": "runtime"}
+    if expected_version is not None:
+        query["version"] = expected_version
+    try:
+        return await app_config.find_one_and_update(
+            query,
+            {"$set": {**values, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+            upsert=expected_version is None or expected_version == 0,
+            return_document=ReturnDocument.AFTER
+        ) or {}
+    except DuplicateKeyError:
+        return {}
+
+async def update_runtime_config(expected_version: Optional[int] = None, clients: Optional[Dict[str, Any]] = None, **values) -> Dict[str, Any]:
+    """Persist a config change and apply it to this worker"""
+    try:
+        doc = await save_runtime_config(expected_version, **values)
+        if not doc:
+            raise ConfigConflict("Configuration was changed by someone else, reload and retry")
+        await apply_runtime_config(doc, clients)
+    finally:
+        # A validated bot holds its own connection pool; close it unless it went live
+        candidate = (clients or {}).get("telegram")
+        if candidate is not None and candidate is not telegram_bot:
+            await candidate.shutdown()
+    return doc
+
+async def apply_runtime_config(doc: Dict[str, Any], clients: Optional[Dict[str, Any]] = None):
+    """Swap this worker's clients over to the stored config.
+    
+    Each client is built before its global is replaced, so requests in
+    flight keep using the old one and new requests see the new one. Callers
+    that validated a credential pass the validated client in `clients` so it
+    is reused instead of built again.
+    """
+    global OPENAI_API_KEY, openai_client, TELEGRAM_BOT_TOKEN, telegram_bot, runtime_config_version
+    
+    clients = clients or {}
+    async with config_apply_lock:
+        if doc.get("version", 0) <= runtime_config_version:
+            return
+        
+        api_key = doc.get("openai_api_key")
+        if api_key is not None and api_key != OPENAI_API_KEY:
+            new_client = clients.get("openai") or (build_openai_client(api_key) if api_key else None)
+            openai_client, OPENAI_API_KEY = new_client, api_key
+            logger.info("OpenAI API key updated from shared config")
+        
+        token = doc.get("telegram_bot_token")
+        if token is not None and token != TELEGRAM_BOT_TOKEN:
+            new_bot = clients.get("telegram") or (build_telegram_bot(token) if token else None)
+            async with telegram_lifecycle_lock:
+                await stop_telegram_bot()
+                old_bot = telegram_bot
+                TELEGRAM_BOT_TOKEN, telegram_bot = token, new_bot
+                telegram_send_queue.bot = new_bot
+            if old_bot is not None:
+                await old_bot.shutdown()
+            logger.info("Telegram bot token updated from shared config")
+            # Start the new bot in the background so the caller isn't held up
+            lifecycle.spawn(sync_telegram_bot(), service=True)
+        
+        runtime_config_version = doc.get("version", 0)
+    event_hub.publish("status", await get_status())
+
+async def watch_runtime_config():
+    """Poll the shared config document and apply new versions"""
+    while True:
+        try:
+            doc = await app_config.find_one({"_id": "runtime"})
+            if doc and doc.get("version", 0) > runtime_config_version:
+                await apply_runtime_config(doc)
+        except Exception as e:
+            logger.error(f"Error watching runtime config: {str(e)}")
+        await asyncio.sleep(CONFIG_POLL_SECONDS)
+
+async def is_duplicate_update(update_id: int) -> bool:
+    """Check an update_id locally, then across workers via a unique insert"""
+    if update_dispatcher.is_duplicate(update_id):
+        return True
+    if WEB_CONCURRENCY > 1:
+        try:
+            await telegram_updates.insert_one({"_id": update_id, "received_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            return True
+    return False
+
+# Telegram Bot Handlers
+class TelegramUpdateDispatcher:
+    """Runs webhook updates concurrently while keeping per-chat order.
+    
+    Updates for the same chat are chained behind each other; different chats
+    run in parallel, bounded by a global semaphore. Recently seen update_ids
+    are remembered so Telegram's redeliveries are processed only once.
+    """
+    
+    def __init__(self, max_concurrency: int, max_seen: int = 10000):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.chat_tails: Dict[int, asyncio.Task] = {}
+        self.seen_update_ids = OrderedDict()
+        self.max_seen = max_seen
+    
+    def is_duplicate(self, update_id: int) -> bool:
+        if update_id in self.seen_update_ids:
+            return True
+        self.seen_update_ids[update_id] = None
+        if len(self.seen_update_ids) > self.max_seen:
+            self.seen_update_ids.popitem(last=False)
+        return False
+    
+    def submit(self, chat_id: int, handler) -> asyncio.Task:
+        previous = self.chat_tails.get(chat_id)
+        task = lifecycle.spawn(self._run(previous, handler))
+        self.chat_tails[chat_id] = task
+        
+        def _release(finished: asyncio.Task):
+            if self.chat_tails.get(chat_id) is finished:
+                del self.chat_tails[chat_id]
+        
+        task.add_done_callback(_release)
+        return task
+    
+    async def _run(self, previous: Optional[asyncio.Task], handler):
+        # Updates outlive the webhook request that queued them
+        request_deadline.set(None)
+        current_trace.set(None)
+        # Wait for the chat's previous update before taking a global slot
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self.semaphore:
+            try:
+                await handler()
+            except Exception as e:
+                logger.error(f"Error processing Telegram update: {str(e)}")
+
+update_dispatcher = TelegramUpdateDispatcher(TELEGRAM_MAX_CONCURRENT_UPDATES)
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def try_acquire(self, cost: float = 1) -> float:
+        """Take `cost` tokens if available; otherwise return seconds until they are"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+    
+    def is_full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+class TelegramSendQueue:
+    """Outbound message scheduler that stays under Telegram's rate limits.
+    
+    Messages are queued per chat and sent by one drain task per chat. Every
+    send takes a token from the chat's bucket (about 1/s for private chats,
+    20/min for groups) and from a global bucket (30/s). Chunks queued for the
+    same chat are coalesced up to the message size limit, and 429 responses
+    pause the chat for the requested retry_after.
+    """
+    
+    MESSAGE_LIMIT = 4000
+    MAX_ATTEMPTS = 3
+    
+    def __init__(self, global_rate: float = 30):
+        self.bot = None
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.pending: Dict[int, List[List[Any]]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.latencies_ms = deque(maxlen=1000)
+        self.sent = 0
+        self.dropped = 0
+        self.retries = 0
+    
+    def send(self, chat_id: int, text: str):
+        """Queue text for a chat, splitting and coalescing chunks"""
+        pending = self.pending.setdefault(chat_id, [])
+        now = time.monotonic()
+        request_id = current_request_id.get()
+        for i in range(0, len(text), self.MESSAGE_LIMIT):
+            chunk = text[i:i + self.MESSAGE_LIMIT]
+            if pending and len(pending[-1][0]) + len(chunk) + 2 <= self.MESSAGE_LIMIT:
+                pending[-1][0] += "\n\n" + chunk
+            else:
+                pending.append([chunk, now, request_id])
+        if chat_id not in self.workers:
+            self.workers[chat_id] = lifecycle.spawn(self._drain(chat_id))
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= 10000:
+                self._prune_idle_buckets()
+            # Negative ids are groups and channels, which have a lower limit
+            bucket = TokenBucket(20 / 60, 3) if chat_id < 0 else TokenBucket(1, 3)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+    
+    def _prune_idle_buckets(self):
+        # A bucket that has refilled completely carries no state worth keeping
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if chat_id not in self.workers and bucket.is_full():
+                del self.chat_buckets[chat_id]
+    
+    async def _drain(self, chat_id: int):
+        pending = self.pending[chat_id]
+        try:
+            while pending:
+                await asyncio.sleep(self._chat_bucket(chat_id).reserve())
+                await asyncio.sleep(self.global_bucket.reserve())
+                text, queued_at, request_id = pending.pop(0)
+                # The drain task outlives the update that started it
+                current_request_id.set(request_id)
+                if await self._send_with_retry(chat_id, text):
+                    self.sent += 1
+                    self.latencies_ms.append((time.monotonic() - queued_at) * 1000)
+                else:
+                    self.dropped += 1
+        finally:
+            del self.workers[chat_id]
+            if not pending:
+                del self.pending[chat_id]
+    
+    async def _send_with_retry(self, chat_id: int, text: str) -> bool:
+        if self.bot is None:
+            logger.warning(f"Dropping Telegram message for {chat_id}: bot not running")
+            return False
+        import telegram.error
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except telegram.error.RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Telegram flood control for {chat_id}, retrying in {retry_after}s")
+                self.retries += 1
+                await asyncio.sleep(float(retry_after))
+            except telegram.error.NetworkError as e:
+                logger.warning(f"Telegram send to {chat_id} failed: {str(e)}")
+                self.retries += 1
+                await asyncio.sleep(2 ** attempt)
+            except telegram.error.TelegramError as e:
+                logger.error(f"Telegram rejected message for {chat_id}: {str(e)}")
+                return False
+        logger.error(f"Giving up on Telegram message for {chat_id} after {self.MAX_ATTEMPTS} attempts")
+        return False
+    
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies_ms)
+        
+        def pick(percentile: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))], 1)
+        
+        return {
+            "queue_depth": sum(len(pending) for pending in self.pending.values()),
+            "active_chats": len(self.workers),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "send_latency_ms": {"p50": pick(50), "p95": pick(95), "max": pick(100)}
+        }
+
+telegram_send_queue = TelegramSendQueue()
+
+def queue_reply(update, text: str):
+    """Queue a reply to the chat an update came from"""
+    telegram_send_queue.send(update.effective_chat.id, text)
+
+# Admission control
+class RouteLimiter:
+    """Caps concurrent calls to an expensive route with a short wait queue.
+    
+    Requests beyond `max_concurrent` wait for a slot, but at most `max_queue`
+    may wait and none longer than `queue_timeout`; the rest are shed with a
+    503 so the backlog (and latency) stays bounded.
+    """
+    
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+    
+    def _reject(self):
+        self.shed += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({self.name}), please retry shortly",
+            headers={"Retry-After": str(max(1, round(self.queue_timeout)))}
+        )
+    
+    async def acquire(self):
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject()
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        self.active += 1
+        self.admitted += 1
+    
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed
+        }
+
+class ClientRateLimiter:
+    """Per-client token buckets keyed by IP ("ip:...") or Telegram user ("tg:...")"""
+    
+    def __init__(self, per_minute: float, burst: int, max_clients: int = 100000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.limited = 0
+    
+    def check(self, key: str, cost: float = 1) -> float:
+        """Return 0 if the client may proceed, else seconds until it may"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self.buckets = {k: b for k, b in self.buckets.items() if not b.is_full()}
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        wait = bucket.try_acquire(cost)
+        if wait:
+            self.limited += 1
+        return wait
+
+route_limiters = {
+    "chat": RouteLimiter("chat", CHAT_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+    "search": RouteLimiter("search", SEARCH_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+}
+client_rate_limiter = ClientRateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+# A full batch may start at once; after that prompts refill at the hourly rate
+batch_prompt_limiter = ClientRateLimiter(BATCH_CLIENT_PROMPTS_PER_HOUR / 60, BATCH_MAX_PROMPTS)
+
+metrics.gauge(
+    "telegram_send_queue_depth", "Outbound Telegram messages waiting to be sent",
+    lambda: {(): sum(len(pending) for pending in telegram_send_queue.pending.values())}
+)
+metrics.gauge(
+    "telegram_send_active_chats", "Chats with an outbound drain task running",
+    lambda: {(): len(telegram_send_queue.workers)}
+)
+metrics.gauge(
+    "telegram_updates_in_flight_chats", "Chats with webhook updates being processed",
+    lambda: {(): len(update_dispatcher.chat_tails)}
+)
+metrics.gauge(
+    "admission_active_requests", "Requests holding a slot per limited route",
+    lambda: {(name,): limiter.active for name, limiter in route_limiters.items()}, ("route",)
+)
+metrics.gauge(
+    "admission_waiting_requests", "Requests queued for a slot per limited route",
+    lambda: {(name,): limiter.waiting for name, limiter in route_limiters.items()}, ("route",)
+)
+
+def trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_key(request: Request) -> str:
+    # nginx sets X-Real-IP; anyone else could pick a fresh IP per request
+    peer = request.client.host if request.client else "unknown"
+    real_ip = request.headers.get("X-Real-IP")
+    if real_ip and trusted_proxy(peer):
+        return "ip:" + real_ip
+    return "ip:" + peer
+
+def admission(route: str):
+    """Dependency applying the client rate limit and the route's concurrency cap"""
+    async def dependency(request: Request):
+        limiter = route_limiters[route]
+        wait = client_rate_limiter.check(client_key(request))
+        if wait:
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, round(wait)))}
             )
-            personal_info["summary"] = response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"Error generating summary: {str(e)}")
-            personal_info["summary"] = f"Information gathered about {name} includes possible social profiles, professional details, and online mentions."
-    else:
-        personal_info["summary"] = f"Information gathered about {name} includes possible social profiles, professional details, and online mentions."
+        await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
     
-    # Assemble the results
-    results = {
-        "personal_info": personal_info,
-        "social_profiles": social_profiles,
-        "professional_info": professional_info,
-        "articles": articles,
-        "mentions": mentions[:5],  # Limit to top 5 mentions
-    }
+    return dependency
+
+def telegram_rate_limited(update) -> bool:
+    """Apply the client rate limit to a Telegram user, replying if limited"""
+    wait = client_rate_limiter.check(f"tg:{update.effective_user.id}")
+    if wait:
+        queue_reply(update, f"You're sending requests too quickly. Please try again in {max(1, round(wait))} seconds.")
+        return True
+    return False
+
+# Diagnostics: sampling profiler and slow request log
+def require_admin(request: Request):
+    """Dependency guarding diagnostics endpoints with the X-Admin-Token header"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack from a side thread.
     
-    return results
+    Stacks are aggregated in folded format ("outer;inner;leaf count"), which
+    flamegraph.pl, speedscope and inferno read directly. Only the sampling
+    thread does work, so overhead is a few percent at the default 100 Hz.
+    """
+    
+    # Leaf frames that mean a thread is parked rather than doing work
+    IDLE_FUNCTIONS = {"select", "poll", "wait", "_worker", "accept", "_wait_for_tstate_lock", "dequeue"}
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    
+    def _collect(self, seconds: float, interval: float, include_idle: bool) -> Dict[str, int]:
+        stacks: Dict[str, int] = {}
+        own_thread = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                if not include_idle and frame.f_code.co_name in self.IDLE_FUNCTIONS:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(labels))
+                stacks[key] = stacks.get(key, 0) + 1
+            time.sleep(interval)
+        return stacks
+    
+    async def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> str:
+        """Sample for `seconds` and return the folded stacks"""
+        if not self.lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="A profile is already running")
+        try:
+            stacks = await asyncio.to_thread(self._collect, seconds, interval, include_idle)
+        finally:
+            self.lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
 
-# Telegram Bot Handlers
-async def start_telegram_bot():
+profiler = SamplingProfiler()
+
+async def store_slow_request(entry: Dict[str, Any]):
+    try:
+        await slow_requests.insert_one(entry)
+    except Exception as e:
+        logger.error(f"Error recording slow request: {str(e)}")
+
+@functools.lru_cache(maxsize=None)
+def get_orjson():
+    """The orjson module, or None if it is not installed"""
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        logger.warning("orjson not installed, using the standard json encoder")
+        return None
+
+def orjson_default(value: Any):
+    # orjson handles datetimes itself; this covers ObjectId, models and the rest
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+def dumps_json(content: Any) -> bytes:
+    """Serialize to JSON bytes, with datetimes in ISO 8601"""
+    orjson = get_orjson()
+    if orjson is None:
+        return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson; reports serialization time as a stage.
+    
+    Returning one of these from an endpoint also skips FastAPI's
+    jsonable_encoder pass, so large lists of Mongo documents are encoded in
+    a single step.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        with stage("json_serialize"):
+            return dumps_json(content)
+
+@functools.lru_cache(maxsize=None)
+def get_brotli():
+    """The brotli module, or None if it is not installed"""
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "text/csv", "application/javascript")
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    if offered.get("br", 0) > 0 and get_brotli() is not None:
+        return "br"
+    if offered.get("gzip", offered.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return get_brotli().compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+class CompressionMiddleware:
+    """Compresses complete responses above a size threshold with br or gzip.
+    
+    Streaming responses (SSE, NDJSON batches) pass through untouched so their
+    chunks still reach the client as they are produced. Large bodies are
+    compressed in a worker thread to keep the event loop responsive.
+    """
+    
+    def __init__(self, app, minimum_size: int = 1024, thread_size: int = 256 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Hold the headers until the body shows whether to compress
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+            
+            with stage(f"compress_{encoding}"):
+                if len(body) >= self.thread_size:
+                    body = await asyncio.to_thread(compress_body, body, encoding)
+                else:
+                    body = compress_body(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+        
+        await self.app(scope, receive, send_compressed)
+
+async def start_telegram_bot(register_webhook: bool = True):
     """Initialize and start the Telegram bot"""
+    global telegram_application
+    
     if not TELEGRAM_BOT_TOKEN:
         logger.warning("Telegram bot token not configured")
         return
     
+    import telegram
+    from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters
     try:
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        if TELEGRAM_MODE == "webhook":
+            # Updates are pushed to /api/telegram/webhook, no long polling
+            builder = builder.updater(None)
+        application = builder.build()
+        
+        # Runs before the other handlers, in the same task
+        application.add_handler(TypeHandler(telegram.Update, tag_update_request_id), group=-1)
         
         # Command handlers
         application.add_handler(CommandHandler("start", start_command))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("search", search_command))
+        application.add_handler(CommandHandler("watch", watch_command))
         
         # Message handlers
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -370,15 +4111,55 @@ async def start_telegram_bot():
         # Start the bot
         await application.initialize()
         await application.start()
-        await application.updater.start_polling()
+        if TELEGRAM_MODE == "webhook":
+            if register_webhook:
+                await application.bot.set_webhook(
+                    url=TELEGRAM_WEBHOOK_URL,
+                    secret_token=TELEGRAM_WEBHOOK_SECRET or None
+                )
+        else:
+            await application.updater.start_polling()
+        telegram_application = application
         
-        logger.info("Telegram bot started successfully")
+        logger.info(f"Telegram bot started successfully ({TELEGRAM_MODE} mode)")
     except Exception as e:
         logger.error(f"Failed to start Telegram bot: {str(e)}")
 
+async def stop_telegram_polling():
+    """Stop fetching updates; the application keeps running for in-flight handlers"""
+    application = telegram_application
+    if application is None or application.updater is None or not application.updater.running:
+        return
+    try:
+        await application.updater.stop()
+    except Exception as e:
+        logger.error(f"Error stopping Telegram polling: {str(e)}")
+
+async def stop_telegram_bot():
+    """Stop polling and shut the running Telegram application down"""
+    global telegram_application
+    
+    application = telegram_application
+    if application is None:
+        return
+    telegram_application = None
+    try:
+        if application.updater is not None and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        logger.info("Telegram bot stopped")
+    except Exception as e:
+        logger.error(f"Error stopping Telegram bot: {str(e)}")
+
+async def tag_update_request_id(update, context):
+    """Use the update_id as request id for everything logged while handling it"""
+    current_request_id.set(f"tg-{update.update_id}")
+
 async def start_command(update, context):
     """Handle /start command"""
-    await update.message.reply_text(
+    queue_reply(
+        update,
         "Welcome to the Cybersecurity AI Assistant! I can help you with cybersecurity questions, analyze datasets, search for information, and provide detailed profiles on individuals.\n\n"
         "🔍 Key Features:\n"
         "• Cybersecurity expertise and insights\n"
@@ -396,7 +4177,8 @@ async def start_command(update, context):
 
 async def help_command(update, context):
     """Handle /help command"""
-    await update.message.reply_text(
+    queue_reply(
+        update,
         "Here's what I can do for you:\n\n"
         "1. Answer cybersecurity questions\n"
         "2. Search for detailed information about a person\n"
@@ -406,7 +4188,8 @@ async def help_command(update, context):
         "/start - Start the bot\n"
         "/help - Show this help message\n"
         "/search [query] - Search for information\n"
-        "/search person:John Smith - Get detailed info about a person\n\n"
+        "/search person:John Smith - Get detailed info about a person\n"
+        "/watch [query] - Get notified when new results appear\n\n"
         "You can also just send me messages like:\n"
         "• Any cybersecurity question\n"
         "• name:John Smith - To get detailed information about a person\n"
@@ -417,13 +4200,15 @@ async def search_command(update, context):
     """Handle /search command"""
     query = ' '.join(context.args)
     if not query:
-        await update.message.reply_text("Please provide a search query. Examples:\n/search vulnerability in Windows 11\n/search person:John Smith")
+        queue_reply(update, "Please provide a search query. Examples:\n/search vulnerability in Windows 11\n/search person:John Smith")
+        return
+    if telegram_rate_limited(update):
         return
     
     # Check if it's a person search
     if query.lower().startswith("person:") or query.lower().startswith("name:"):
         name = query.split(":", 1)[1].strip()
-        await update.message.reply_text(f"Searching for detailed information about: {name}...")
+        queue_reply(update, f"Searching for detailed information about: {name}...")
         
         # Process as a person search
         person_info = await person_search(name)
@@ -488,13 +4273,8 @@ async def search_command(update, context):
         # Add disclaimer
         response += "⚠️ Note: This information is automatically gathered from public web sources and may not be 100% accurate."
         
-        # Send response in chunks if it's too long
-        if len(response) > 4000:
-            chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
-            for chunk in chunks:
-                await update.message.reply_text(chunk)
-        else:
-            await update.message.reply_text(response)
+        # The send queue splits long responses into chunks
+        queue_reply(update, response)
         
         # Save search in database
         search_data = {
@@ -505,10 +4285,11 @@ async def search_command(update, context):
             "timestamp": datetime.utcnow()
         }
         await search_results.insert_one(search_data)
+        await record_usage("person_search", telegram_user_id=update.effective_user.id)
         return
     
     # Regular web search
-    await update.message.reply_text(f"Searching for: {query}...")
+    queue_reply(update, f"Searching for: {query}...")
     
     # Perform web search
     results = await web_search(query)
@@ -522,7 +4303,7 @@ async def search_command(update, context):
     else:
         response = "I couldn't find any relevant information for your query."
     
-    await update.message.reply_text(response)
+    queue_reply(update, response)
     
     # Save search in database
     search_data = {
@@ -533,16 +4314,42 @@ async def search_command(update, context):
         "timestamp": datetime.utcnow()
     }
     await search_results.insert_one(search_data)
+    await record_usage("web_search", query=query, telegram_user_id=update.effective_user.id)
+
+async def watch_command(update, context):
+    """Handle /watch command: re-run a search daily and report new results"""
+    query = ' '.join(context.args)
+    if not query:
+        queue_reply(update, "Please provide a query to watch. Example:\n/watch CVE-2024-3094")
+        return
+    if telegram_rate_limited(update):
+        return
+    # Every watchlist is polled by the scheduler, so one chat cannot add them without limit
+    if await watchlists.count_documents({"telegram_chat_id": update.effective_chat.id}) >= MAX_WATCHES_PER_CHAT:
+        queue_reply(
+            update,
+            f"This chat already has {MAX_WATCHES_PER_CHAT} watchlists, the most allowed. "
+            "Delete one in the dashboard before adding another."
+        )
+        return
+    watchlist = await create_watchlist(WatchlistCreate(
+        name=query[:50],
+        query=query,
+        telegram_chat_id=update.effective_chat.id
+    ))
+    queue_reply(update, f"Watching '{query}'. I'll message you when new results appear (watchlist {watchlist['id'][:8]}).")
 
 async def handle_message(update, context):
     """Handle regular text messages"""
     user_text = update.message.text
     user_id = update.effective_user.id
+    if telegram_rate_limited(update):
+        return
     
     # Check if it's a name search
     if user_text.startswith("name:") or user_text.startswith("person:"):
         name = user_text.split(":", 1)[1].strip()
-        await update.message.reply_text(f"Searching for detailed information about: {name}...")
+        queue_reply(update, f"Searching for detailed information about: {name}...")
         
         person_info = await person_search(name)
         personal_info = person_info["personal_info"]
@@ -621,26 +4428,24 @@ async def handle_message(update, context):
         # Add disclaimer
         response += "⚠️ Note: This information is automatically gathered from public web sources and may not be 100% accurate."
         
-        # Send response in chunks if it's too long
-        if len(response) > 4000:
-            chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
-            for chunk in chunks:
-                await update.message.reply_text(chunk)
-        else:
-            await update.message.reply_text(response)
+        # The send queue splits long responses into chunks
+        queue_reply(update, response)
+        await record_usage("person_search", telegram_user_id=user_id)
         return
     
     # Otherwise treat as a cybersecurity question
-    await update.message.reply_text("Thinking about your question...")
+    queue_reply(update, "Thinking about your question...")
     
-    # Get AI response
+    # Get AI response, with this user's earlier turns as context
     if openai_client:
-        ai_response = await get_llm_response(user_text)
+        history = await conversation_memory.get_messages(user_id)
+        ai_response = await get_llm_response(user_text, history, route="telegram", user_id=user_id)
+        await conversation_memory.add_exchange(user_id, user_text, ai_response)
     else:
         # Fallback if no OpenAI API key
         ai_response = "I need my AI capabilities to be configured to answer this properly. Please set up an OpenAI API key."
     
-    await update.message.reply_text(ai_response)
+    queue_reply(update, ai_response)
     
     # Save conversation to database
     conversation_data = {
@@ -651,6 +4456,7 @@ async def handle_message(update, context):
         "timestamp": datetime.utcnow()
     }
     await conversations.insert_one(conversation_data)
+    await record_usage("chat", telegram_user_id=user_id)
 
 # API Routes
 @api_router.get("/")
@@ -672,20 +4478,163 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
+    event_hub.publish("status_check", status_obj.dict())
     return status_obj
 
-@api_router.get("/status/checks", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+@api_router.get("/events")
+async def stream_events():
+    """Server-sent events: status, status_check and dataset updates"""
+    subscriber = event_hub.subscribe()
+    
+    async def event_stream():
+        try:
+            # Initial snapshot so a new tab needs no separate status fetch
+            yield f"event: status\ndata: {json.dumps(await get_status())}\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    frame = ": keepalive\n\n"
+                yield frame
+        finally:
+            event_hub.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def encode_status_cursor(doc: Dict[str, Any]) -> str:
+    """Build an opaque pagination cursor from the last returned status check"""
+    raw = json.dumps([doc["timestamp"].isoformat(), doc["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_status_cursor(cursor: str) -> Dict[str, Any]:
+    """Turn a pagination cursor into a Mongo filter for the next (older) page"""
+    try:
+        timestamp, check_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = datetime.fromisoformat(timestamp)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "id": {"$lt": check_id}}
+    ]}
+
+@api_router.get("/status/checks")
+async def get_status_checks(limit: int = 100, cursor: Optional[str] = None):
+    """Return status checks newest first, one page at a time.
+    
+    The next page's cursor is sent in the X-Next-Cursor header. Documents are
+    serialized directly from the projection instead of building a StatusCheck
+    model per row.
+    """
+    limit = max(1, min(limit, 1000))
+    query = decode_status_cursor(cursor) if cursor else {}
+    docs = await db.status_checks.find(
+        query,
+        {"_id": 0, "id": 1, "client_name": 1, "timestamp": 1}
+    ).sort([("timestamp", -1), ("id", -1)]).limit(limit).to_list(limit)
+    
+    headers = {}
+    if len(docs) == limit:
+        headers["X-Next-Cursor"] = encode_status_cursor(docs[-1])
+    return FastJSONResponse(content=docs, headers=headers)
+
+@api_router.get("/status/checks/summary")
+async def get_status_checks_summary():
+    """Per-client check counts and last-seen times, computed inside Mongo"""
+    pipeline = [
+        {"$group": {
+            "_id": "$client_name",
+            "count": {"$sum": 1},
+            "last_seen": {"$max": "$timestamp"}
+        }},
+        {"$sort": {"last_seen": -1}}
+    ]
+    rows = await db.status_checks.aggregate(pipeline).to_list(None)
+    return [
+        {"client_name": row["_id"], "count": row["count"], "last_seen": row["last_seen"]}
+        for row in rows
+    ]
+
+@api_router.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Receive Telegram updates and hand them to the concurrent dispatcher"""
+    if TELEGRAM_MODE != "webhook" or telegram_application is None:
+        raise HTTPException(status_code=503, detail="Telegram webhook not active")
+    lifecycle.check_accepting()
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    
+    data = await request.json()
+    update_id = data.get("update_id")
+    if update_id is None or await is_duplicate_update(update_id):
+        return {"ok": True}
+    
+    import telegram
+    update = telegram.Update.de_json(data, telegram_application.bot)
+    chat_id = update.effective_chat.id if update.effective_chat else update_id
+    update_dispatcher.submit(chat_id, lambda: telegram_application.process_update(update))
+    
+    # Acknowledge immediately; processing continues in the background
+    return {"ok": True}
+
+@api_router.get("/admission")
+async def get_admission_stats():
+    """Concurrency, queueing and shedding per limited route"""
+    return {
+        "routes": {name: limiter.snapshot() for name, limiter in route_limiters.items()},
+        "rate_limit": {
+            "per_minute": client_rate_limiter.rate * 60,
+            "burst": client_rate_limiter.burst,
+            "tracked_clients": len(client_rate_limiter.buckets),
+            "limited": client_rate_limiter.limited
+        }
+    }
+
+@api_router.get("/upstreams")
+async def get_upstreams():
+    """Circuit breaker state and call counters per upstream"""
+    return {name: upstream.snapshot() for name, upstream in outbound_clients.items()}
+
+@api_router.get("/llm/usage")
+async def get_llm_usage(days: int = 7):
+    """Daily LLM token, cost and latency totals per route"""
+    days = max(1, min(days, 31))
+    since_day = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    docs = await llm_usage_daily.find(
+        {"day": {"$gte": since_day}, "scope": {"$not": {"$regex": "^user:"}}},
+        {"_id": 0}
+    ).sort("day", -1).to_list(days * (len(LLM_ROUTE_LIMITS) + 1))
+    return {
+        "budgets": {"daily": LLM_DAILY_TOKEN_BUDGET, "per_user_daily": LLM_USER_DAILY_TOKEN_BUDGET},
+        "usage": docs
+    }
+
+@api_router.get("/memory/stats")
+async def get_memory_stats():
+    """Conversation memory cache usage"""
+    return conversation_memory.stats()
+
+@api_router.get("/telegram/queue")
+async def get_telegram_queue_stats():
+    """Outbound Telegram queue depth and send latency"""
+    return telegram_send_queue.stats()
+
+def save_upload(source, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer, 1 << 20)
 
 @api_router.post("/dataset/upload")
 async def upload_dataset(
-    background_tasks: BackgroundTasks,
     name: str = Form(...),
     description: str = Form(...),
     file: UploadFile = File(...)
 ):
+    lifecycle.check_accepting()
+    
     # Generate unique ID for dataset
     dataset_id = str(uuid.uuid4())
     
@@ -693,41 +4642,185 @@ async def upload_dataset(
     file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
     file_path = f"{DATASET_DIR}/{dataset_id}.{file_extension}"
     
-    # Save file
+    # Save file (in a thread; large uploads would otherwise stall the loop)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(save_upload, file.file, file_path)
+        reader = await asyncio.to_thread(DatasetReader, file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
+    # The extension is the client's; the content decides how the file is read
+    unsupported = None
+    if reader.format == "binary":
+        unsupported = "Unsupported dataset format: expected text records, an archive or a compressed file"
+    elif reader.format == "zstd" and get_zstandard() is None:
+        unsupported = "zstd uploads need the zstandard package on the server"
+    if unsupported:
+        await asyncio.to_thread(os.remove, file_path)
+        raise HTTPException(status_code=415, detail=unsupported)
+    
     # Create dataset record
     dataset = DatasetUpload(
         id=dataset_id,
         name=name,
         description=description,
-        file_path=file_path
+        file_path=file_path,
+        format=reader.format
     )
     
-    # Save to database
-    await datasets.insert_one(dataset.dict())
+    # Save to database; an upload under an existing name is its next version
+    for attempt in range(5):
+        latest = await datasets.find_one({"name": name}, {"version": 1}, sort=[("version", -1)])
+        dataset.version = (latest or {}).get("version", 1 if latest else 0) + 1
+        try:
+            await datasets.insert_one(dataset.model_dump())
+            break
+        except DuplicateKeyError:
+            continue  # Another upload took this version number
+    else:
+        raise HTTPException(status_code=409, detail="Too many concurrent uploads for this dataset")
+    event_hub.publish("dataset", dataset.model_dump())
     
-    # Process dataset in background
-    background_tasks.add_task(process_dataset, dataset_id, file_path)
+    # Process dataset in background (tracked, so shutdown can checkpoint it)
+    lifecycle.spawn(process_dataset(dataset_id, file_path))
     
-    return {"id": dataset_id, "name": name, "status": "uploaded"}
+    return {"id": dataset_id, "name": name, "version": dataset.version, "format": dataset.format, "status": "uploaded"}
 
 @api_router.get("/datasets")
 async def get_datasets():
     all_datasets = await datasets.find().to_list(1000)
-    # Convert MongoDB ObjectId to string to make it JSON serializable
-    for dataset in all_datasets:
-        if "_id" in dataset:
-            dataset["_id"] = str(dataset["_id"])
-    return all_datasets
+    # Encoded directly; ObjectId becomes a string and datetimes ISO 8601
+    return FastJSONResponse(all_datasets)
+
+async def find_dataset_version(name: str, version: int) -> Dict[str, Any]:
+    doc = await datasets.find_one({"name": name, "version": version}, {"_id": 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail=f"Dataset {name} has no version {version}")
+    if doc["status"] != "complete":
+        raise HTTPException(status_code=409, detail=f"Version {version} of {name} is {doc['status']}")
+    return doc
+
+async def version_chunks(dataset_id: str) -> Dict[str, int]:
+    """Chunk hash -> size for every chunk of one dataset version"""
+    chunks: Dict[str, int] = {}
+    async for manifest in dataset_manifests.find({"dataset_id": dataset_id}, {"chunks": 1, "sizes": 1}):
+        chunks.update(zip(manifest["chunks"], manifest["sizes"]))
+    return chunks
 
-@api_router.post("/search/web")
+# Chunk hashes per $in query, so a large version stays far below the BSON size limit
+CHUNK_QUERY_BATCH = 5000
+
+async def find_chunks(chunk_hashes, query: Dict[str, Any]):
+    """Yield the chunks among `chunk_hashes` that match `query`"""
+    hashes = list(chunk_hashes)
+    for i in range(0, len(hashes), CHUNK_QUERY_BATCH):
+        async for doc in dataset_chunks.find({"_id": {"$in": hashes[i:i + CHUNK_QUERY_BATCH]}, **query}, {"iocs": 1}):
+            yield doc
+
+async def iocs_present(values: set, chunk_hashes: set) -> set:
+    """The subset of `values` that occurs in any of the given chunks"""
+    present = set()
+    if not values:
+        return present
+    async for doc in find_chunks(chunk_hashes, {"iocs": {"$in": list(values)}}):
+        present.update(value for value in doc["iocs"] if value in values)
+    return present
+
+def read_matching_records(file_path: str, spans: List[tuple], needle: bytes, limit: int) -> List[str]:
+    """Lines containing `needle` (case-insensitive) within the given spans (blocking)"""
+    records = []
+    for data in DatasetReader(file_path).read_spans(spans):
+        for line in data.splitlines():
+            if needle in line.lower():
+                records.append(line.decode("utf-8", "replace"))
+                if len(records) >= limit:
+                    return records
+    return records
+
+@api_router.get("/datasets/{name}/versions")
+async def get_dataset_versions(name: str):
+    docs = await datasets.find({"name": name}, {"_id": 0, "checkpoint": 0}).sort("version", -1).to_list(1000)
+    if not docs:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return FastJSONResponse(docs)
+
+@api_router.get("/datasets/{name}/iocs")
+async def search_dataset_iocs(name: str, value: str, version: Optional[int] = None, limit: int = 20):
+    """Versions of a dataset that contain an indicator, with the matching records"""
+    needle = value.strip().lower()
+    limit = max(1, min(limit, 200))
+    query: Dict[str, Any] = {"name": name, "status": "complete"}
+    if version is not None:
+        query["version"] = version
+    versions = await datasets.find(query, {"_id": 0, "id": 1, "version": 1, "file_path": 1}).sort("version", -1).to_list(1000)
+    if not versions:
+        raise HTTPException(status_code=404, detail="No processed versions of this dataset")
+    
+    matches = []
+    # Chunk hash -> whether it contains the indicator; versions share most chunks
+    checked: Dict[str, bool] = {}
+    for entry in versions:
+        manifests = await dataset_manifests.find(
+            {"dataset_id": entry["id"]}, {"chunks": 1, "offsets": 1, "sizes": 1}
+        ).to_list(None)
+        unchecked = {chunk for manifest in manifests for chunk in manifest["chunks"] if chunk not in checked}
+        found = {doc["_id"] async for doc in find_chunks(unchecked, {"iocs": needle})}
+        checked.update((chunk, chunk in found) for chunk in unchecked)
+        spans = [
+            (offset, size)
+            for manifest in manifests
+            for chunk, offset, size in zip(manifest["chunks"], manifest["offsets"], manifest["sizes"])
+            if checked[chunk]
+        ]
+        if spans:
+            records = await asyncio.to_thread(read_matching_records, entry["file_path"], spans, needle.encode(), limit)
+            matches.append({"version": entry["version"], "dataset_id": entry["id"], "records": records})
+    return {"name": name, "value": needle, "versions": matches}
+
+@api_router.get("/datasets/{name}/diff")
+async def diff_dataset_versions(name: str, base: int, head: int, limit: int = 1000):
+    """Changed chunks between two versions and the indicators they added or removed"""
+    limit = max(1, min(limit, 10000))
+    base_doc = await find_dataset_version(name, base)
+    head_doc = await find_dataset_version(name, head)
+    base_chunks, head_chunks = await asyncio.gather(version_chunks(base_doc["id"]), version_chunks(head_doc["id"]))
+    added = set(head_chunks) - set(base_chunks)
+    removed = set(base_chunks) - set(head_chunks)
+    
+    async def chunk_iocs(hashes: set) -> set:
+        values = set()
+        async for doc in find_chunks(hashes, {}):
+            values.update(doc["iocs"])
+        return values
+    
+    # An indicator in a changed chunk may still occur elsewhere in the other version
+    added_iocs = await chunk_iocs(added)
+    added_iocs -= await iocs_present(added_iocs, set(base_chunks))
+    removed_iocs = await chunk_iocs(removed)
+    removed_iocs -= await iocs_present(removed_iocs, set(head_chunks))
+    return {
+        "name": name,
+        "base": base,
+        "head": head,
+        "unchanged_chunks": len(head_chunks) - len(added),
+        "added_chunks": len(added),
+        "removed_chunks": len(removed),
+        "added_bytes": sum(head_chunks[chunk] for chunk in added),
+        "removed_bytes": sum(base_chunks[chunk] for chunk in removed),
+        "added_iocs": sorted(added_iocs)[:limit],
+        "removed_iocs": sorted(removed_iocs)[:limit]
+    }
+
+@api_router.post("/search/web", dependencies=[Depends(admission("search"))])
 async def search_web_api(query: WebSearchQuery):
-    results = await web_search(query.query)
+    queries = query.queries or (expand_security_query(query.query) if query.expand else [query.query])
+    queries = list(dict.fromkeys(q.strip() for q in queries if q.strip()))[:SEARCH_FANOUT_MAX_QUERIES]
+    if len(queries) > 1:
+        results = await multi_query_search(queries)
+    else:
+        results = await web_search(queries[0] if queries else query.query)
+    if query.deep:
+        results = await attach_pages(results)
     
     # Save search in database
     search_data = {
@@ -737,10 +4830,14 @@ async def search_web_api(query: WebSearchQuery):
         "timestamp": datetime.utcnow()
     }
     await search_results.insert_one(search_data)
+    await record_usage("web_search", query=query.query)
     
-    return {"query": query.query, "results": results}
+    response = {"query": query.query, "results": results}
+    if len(queries) > 1:
+        response["queries"] = queries
+    return FastJSONResponse(response)
 
-@api_router.post("/search/person")
+@api_router.post("/search/person", dependencies=[Depends(admission("search"))])
 async def search_person_api(query: NameSearchQuery):
     results = await person_search(query.name)
     
@@ -752,10 +4849,11 @@ async def search_person_api(query: NameSearchQuery):
         "timestamp": datetime.utcnow()
     }
     await search_results.insert_one(search_data)
+    await record_usage("person_search")
     
     return results
 
-@api_router.post("/chat")
+@api_router.post("/chat", dependencies=[Depends(admission("chat"))])
 async def chat_api(message_data: MessageData):
     if not openai_client:
         return {"error": "OpenAI API key not configured"}
@@ -770,99 +4868,376 @@ async def chat_api(message_data: MessageData):
         "timestamp": datetime.utcnow()
     }
     await conversations.insert_one(conversation_data)
+    await record_usage("chat")
     
     return {"response": ai_response}
 
+@api_router.post("/chat/batch", dependencies=[Depends(admission("chat"))])
+async def chat_batch_api(request: BatchChatRequest, http_request: Request):
+    """Answer many prompts, streaming NDJSON results as they complete.
+    
+    Re-posting an existing batch_id (or GET /chat/batch/{id}) resumes the
+    stream instead of starting the batch again.
+    """
+    lifecycle.check_accepting()
+    if not openai_client:
+        return {"error": "OpenAI API key not configured"}
+    if request.batch_id and (request.batch_id in active_batches or await chat_batches.find_one({"batch_id": request.batch_id})):
+        return await batch_stream(request.batch_id)
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="No prompts given")
+    if len(request.prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+    
+    wait = batch_prompt_limiter.check(client_key(http_request), len(request.prompts))
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Batch prompt budget exceeded",
+            headers={"Retry-After": str(max(1, round(wait)))}
+        )
+    
+    batch_id = request.batch_id or str(uuid.uuid4())
+    now = datetime.utcnow()
+    try:
+        # The unique batch_id index makes this the claim: only one request creates it
+        await chat_batches.insert_one({
+            "batch_id": batch_id,
+            "prompts": request.prompts,
+            "total": len(request.prompts),
+            "status": "running",
+            "worker_id": WORKER_ID,
+            "heartbeat_at": now,
+            "created_at": now
+        })
+    except DuplicateKeyError:
+        return await batch_stream(batch_id)
+    start_batch(batch_id, request.prompts)
+    return await batch_stream(batch_id)
+
+@api_router.get("/chat/batch/{batch_id}", dependencies=[Depends(admission("chat"))])
+async def resume_chat_batch(batch_id: str, after: int = 0):
+    """Resume a batch stream, skipping the first `after` results"""
+    # A stale batch is restarted here, which is new work
+    lifecycle.check_accepting()
+    return await batch_stream(batch_id, max(0, after))
+
+@api_router.post("/watchlists")
+async def create_watchlist_api(data: WatchlistCreate):
+    return await create_watchlist(data)
+
+@api_router.get("/watchlists")
+async def list_watchlists():
+    return await watchlists.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+
+@api_router.delete("/watchlists/{watchlist_id}")
+async def delete_watchlist(watchlist_id: str):
+    result = await watchlists.delete_one({"id": watchlist_id})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Watchlist not found")
+    await asyncio.gather(
+        watchlist_seen.delete_many({"watchlist_id": watchlist_id}),
+        watchlist_hits.delete_many({"watchlist_id": watchlist_id})
+    )
+    return {"status": "deleted"}
+
+@api_router.get("/watchlists/{watchlist_id}/hits")
+async def get_watchlist_hits(watchlist_id: str, limit: int = 50):
+    limit = max(1, min(limit, 500))
+    return await watchlist_hits.find(
+        {"watchlist_id": watchlist_id}, {"_id": 0}
+    ).sort("found_at", -1).limit(limit).to_list(limit)
+
+@api_router.get("/analytics")
+async def get_analytics(hours: int = 24, days: int = 7, top: int = 10):
+    """Serve dashboard metrics from the pre-aggregated rollup collections"""
+    # Clamp the windows so the cost never depends on total history size
+    hours = max(1, min(hours, 168))
+    days = max(1, min(days, 31))
+    top = max(1, min(top, 50))
+    now = datetime.utcnow()
+    
+    since_hour = (now - timedelta(hours=hours - 1)).strftime("%Y-%m-%dT%H")
+    hourly = await usage_hourly.find({"_id": {"$gte": since_hour}}).sort("_id", 1).to_list(hours)
+    
+    top_terms = await search_term_counts.find().sort("count", -1).limit(top).to_list(top)
+    top_users = await telegram_user_activity.find().sort("total", -1).limit(top).to_list(top)
+    
+    since_day = (now - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    latency_docs = await llm_latency_daily.find({"_id": {"$gte": since_day}}).to_list(days)
+    buckets: Dict[str, int] = {}
+    count = 0
+    sum_ms = 0.0
+    for doc in latency_docs:
+        count += doc.get("count", 0)
+        sum_ms += doc.get("sum_ms", 0.0)
+        for key, value in doc.get("buckets", {}).items():
+            buckets[key] = buckets.get(key, 0) + value
+    
+    return {
+        "queries_per_hour": [
+            {"hour": doc["_id"], "total": doc.get("total", 0), "counts": doc.get("counts", {})}
+            for doc in hourly
+        ],
+        "top_search_terms": [
+            {"term": doc["_id"], "count": doc["count"]} for doc in top_terms
+        ],
+        "telegram_user_volume": [
+            {"user_id": doc["_id"], "total": doc.get("total", 0), "counts": doc.get("counts", {}), "last_seen": doc.get("last_seen")}
+            for doc in top_users
+        ],
+        "llm_latency": {
+            "window_days": days,
+            "count": count,
+            "mean_ms": round(sum_ms / count, 1) if count else None,
+            "p50_ms": histogram_percentile(buckets, count, 50),
+            "p95_ms": histogram_percentile(buckets, count, 95),
+            "p99_ms": histogram_percentile(buckets, count, 99),
+            "buckets": buckets
+        }
+    }
+
+@api_router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def run_profile(seconds: float = 10, interval_ms: float = 10, include_idle: bool = False):
+    """Sample all threads for a while and return folded stacks for a flame graph"""
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = max(interval_ms, 1) / 1000
+    folded = await profiler.profile(seconds, interval, include_idle)
+    return PlainTextResponse(folded)
+
+@api_router.get("/admin/loop-stalls", dependencies=[Depends(require_admin)])
+async def get_loop_stalls():
+    """Event loop stalls grouped by the call site that blocked, worst first"""
+    return loop_watchdog.snapshot()
+
+@api_router.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def get_slow_requests(limit: int = 50):
+    """Most recent slow requests with their per-span breakdown"""
+    cursor = slow_requests.find({}, {"_id": 0}).sort("$natural", -1).limit(min(max(limit, 1), 500))
+    return await cursor.to_list(length=None)
+
+@api_router.get("/config")
+async def get_config():
+    """Current config version and which credentials are set (never the values)"""
+    doc = await app_config.find_one({"_id": "runtime"}) or {}
+    return {
+        "version": doc.get("version", 0),
+        "applied_version": runtime_config_version,
+        "updated_at": doc.get("updated_at"),
+        "openai": "configured" if OPENAI_API_KEY else "not configured",
+        "telegram_bot": "configured" if TELEGRAM_BOT_TOKEN else "not configured"
+    }
+
 @api_router.post("/config/telegram")
 async def configure_telegram(config: TelegramConfig):
-    global TELEGRAM_BOT_TOKEN, telegram_bot
-    
     try:
-        # Validate token by creating a temporary bot
-        temp_bot = telegram.Bot(token=config.token)
-        await temp_bot.get_me()
-        
-        # Token is valid, update the .env file
-        env_path = ROOT_DIR / '.env'
-        with open(env_path, 'r') as file:
-            env_content = file.read()
-        
-        # Replace token in env file
-        if 'TELEGRAM_BOT_TOKEN' in env_content:
-            env_content = re.sub(
-                r'TELEGRAM_BOT_TOKEN=".*?"', 
-                f'TELEGRAM_BOT_TOKEN="{config.token}"', 
-                env_content
-            )
-        else:
-            env_content += f'\nTELEGRAM_BOT_TOKEN="{config.token}"'
-        
-        with open(env_path, 'w') as file:
-            file.write(env_content)
-        
-        # Update global variables
-        TELEGRAM_BOT_TOKEN = config.token
-        telegram_bot = temp_bot
-        
-        # Start the bot in the background
-        asyncio.create_task(start_telegram_bot())
-        
-        return {"status": "success", "message": "Telegram bot configured successfully"}
+        bot = await validate_telegram_token(config.token)
+        doc = await update_runtime_config(
+            config.expected_version,
+            clients={"telegram": bot},
+            telegram_bot_token=config.token
+        )
+        return {"status": "success", "message": "Telegram bot configured successfully", "version": doc["version"]}
+    except ConfigConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         return {"status": "error", "message": f"Failed to configure Telegram bot: {str(e)}"}
 
 @api_router.post("/config/openai")
 async def configure_openai(config: OpenAIConfig):
-    global OPENAI_API_KEY, openai_client
-    
     try:
-        # Validate API key by creating a temporary client
-        temp_client = openai.OpenAI(api_key=config.api_key)
-        # Make a simple API call to validate
-        temp_client.models.list()
-        
-        # API key is valid, update the .env file
-        env_path = ROOT_DIR / '.env'
-        with open(env_path, 'r') as file:
-            env_content = file.read()
-        
-        # Replace API key in env file
-        if 'OPENAI_API_KEY' in env_content:
-            env_content = re.sub(
-                r'OPENAI_API_KEY=".*?"', 
-                f'OPENAI_API_KEY="{config.api_key}"', 
-                env_content
-            )
-        else:
-            env_content += f'\nOPENAI_API_KEY="{config.api_key}"'
-        
-        with open(env_path, 'w') as file:
-            file.write(env_content)
-        
-        # Update global variables
-        OPENAI_API_KEY = config.api_key
-        openai_client = temp_client
-        
-        return {"status": "success", "message": "OpenAI API configured successfully"}
+        candidate = await validate_openai_key(config.api_key)
+        doc = await update_runtime_config(
+            config.expected_version,
+            clients={"openai": candidate},
+            openai_api_key=config.api_key
+        )
+        return {"status": "success", "message": "OpenAI API configured successfully", "version": doc["version"]}
+    except ConfigConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         return {"status": "error", "message": f"Failed to configure OpenAI API: {str(e)}"}
 
-# Include the router in the main app
-app.include_router(api_router)
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class RequestContextMiddleware:
+    """Request id, deadline, span trace and latency metric for every request.
+    
+    A well-formed X-Request-ID from the proxy is reused so logs can be joined
+    with nginx's; otherwise a new id is generated and returned. Tasks started
+    by the request inherit the id and the deadline. Latency is observed by
+    route template when the response starts, and requests slower than
+    SLOW_REQUEST_THRESHOLD_MS are logged with their spans.
+    
+    This is one pure ASGI layer: the app runs in the request's own task, and
+    streamed bodies pass straight through.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        request_id = headers.get("x-request-id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        timeout = REQUEST_DEADLINE_SECONDS
+        try:
+            timeout = min(timeout, float(headers.get("x-request-timeout", timeout)))
+        except ValueError:
+            pass
+        trace = RequestTrace()
+        tokens = [
+            (current_request_id, current_request_id.set(request_id)),
+            (request_deadline, request_deadline.set(time.monotonic() + timeout)),
+            (current_trace, current_trace.set(trace))
+        ]
+        started = False
+        
+        async def send_with_request_id(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                MutableHeaders(raw=message.setdefault("headers", []))["X-Request-ID"] = request_id
+                self.finish(scope, trace, message["status"], request_id)
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if not started:
+                self.finish(scope, trace, 500, request_id)
+            for var, token in reversed(tokens):
+                var.reset(token)
+    
+    def finish(self, scope, trace: RequestTrace, status: int, request_id: str):
+        elapsed = time.perf_counter() - trace.start
+        route = getattr(scope.get("route"), "path", None)
+        http_request_duration.observe(elapsed, scope["method"], route or "unmatched", status)
+        duration_ms = elapsed * 1000
+        if duration_ms >= SLOW_REQUEST_THRESHOLD_MS:
+            lifecycle.spawn(store_slow_request({
+                "request_id": request_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route,
+                "status": status,
+                "duration_ms": round(duration_ms, 1),
+                "untracked_ms": round(duration_ms - sum(span["duration_ms"] for span in trace.spans), 1),
+                "spans": trace.spans,
+                "timestamp": datetime.utcnow()
+            }))
+
+async def get_metrics():
+    """Prometheus text exposition of all registered metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-@app.on_event("startup")
 async def startup_event():
-    # Start the Telegram bot if token is configured
+    configure_logging()
+    DATASET_DIR.mkdir(exist_ok=True)
+    lifecycle.start()
+    init_integrations()
+    if LOOP_WATCHDOG_ENABLED:
+        loop_watchdog.start()
+    
+    # Slow request log is capped so it never needs cleaning up
+    try:
+        if "slow_requests" not in await db.list_collection_names():
+            await db.create_collection("slow_requests", capped=True, size=SLOW_REQUEST_LOG_BYTES)
+    except Exception as e:
+        logger.error(f"Failed to create slow request log: {str(e)}")
+    
+    # Server-sent events from other workers, and this worker's for them
+    try:
+        if "event_relay" not in await db.list_collection_names():
+            await db.create_collection("event_relay", capped=True, size=EVENT_RELAY_BYTES)
+    except Exception as e:
+        logger.error(f"Failed to create event relay: {str(e)}")
+    lifecycle.spawn(event_hub.run_relay(event_relay), service=True)
+    
+    # Indexes backing the analytics top-N queries
+    try:
+        await search_term_counts.create_index([("count", -1)])
+        await telegram_user_activity.create_index([("total", -1)])
+    except Exception as e:
+        logger.error(f"Failed to create analytics indexes: {str(e)}")
+    
+    # Dataset version numbers, the shared chunk index and version manifests
+    try:
+        await datasets.create_index(
+            [("name", 1), ("version", -1)],
+            unique=True,
+            partialFilterExpression={"version": {"$exists": True}}
+        )
+        await dataset_chunks.create_index("iocs")
+        await dataset_manifests.create_index([("dataset_id", 1), ("seq", 1)], unique=True)
+    except Exception as e:
+        logger.error(f"Failed to create dataset indexes: {str(e)}")
+    
+    # Datasets cut off by the last shutdown or by a crashed worker, now and
+    # whenever another worker on this host stops mid-dataset
+    lifecycle.spawn(run_dataset_resumer(), service=True)
+    
+    # Status check pagination order and expiry
+    try:
+        await db.status_checks.create_index([("timestamp", -1), ("id", -1)])
+        await db.status_checks.create_index(
+            "timestamp",
+            name="status_checks_ttl",
+            expireAfterSeconds=STATUS_CHECK_TTL_DAYS * 86400
+        )
+    except Exception as e:
+        logger.error(f"Failed to create status check indexes: {str(e)}")
+    
+    # Conversation memory lookups and background write-back
+    try:
+        await user_profiles.create_index("user_id", unique=True)
+    except Exception as e:
+        logger.error(f"Failed to create user_profiles index: {str(e)}")
+    lifecycle.spawn(conversation_memory.run_flusher(), service=True)
+    
+    # Batch lookups for resuming streams
+    try:
+        await chat_batches.create_index("batch_id", unique=True)
+        await conversations.create_index([("batch_id", 1), ("seq", 1)], sparse=True)
+    except Exception as e:
+        logger.error(f"Failed to create batch indexes: {str(e)}")
+    
+    # Watchlist scheduling and seen-set lookups
+    try:
+        await watchlists.create_index("id", unique=True)
+        await watchlists.create_index([("enabled", 1), ("next_run_at", 1)])
+        await watchlists.create_index("telegram_chat_id")
+        await watchlist_seen.create_index([("watchlist_id", 1), ("url_key", 1)], unique=True)
+        await watchlist_hits.create_index([("watchlist_id", 1), ("found_at", -1)])
+    except Exception as e:
+        logger.error(f"Failed to create watchlist indexes: {str(e)}")
+    lifecycle.spawn(run_watchlist_scheduler(), service=True)
+    
+    # Usage lookups by day, and load the tokenizer off the event loop
+    try:
+        await llm_usage_daily.create_index([("day", -1), ("scope", 1)])
+    except Exception as e:
+        logger.error(f"Failed to create llm_usage_daily index: {str(e)}")
+    lifecycle.spawn(asyncio.to_thread(get_token_encoder), service=True)
+    
+    # Shared config overrides .env; then follow changes made by other workers
+    try:
+        await telegram_updates.create_index("received_at", expireAfterSeconds=86400)
+        doc = await app_config.find_one({"_id": "runtime"})
+        if doc:
+            await apply_runtime_config(doc)
+    except Exception as e:
+        logger.error(f"Failed to load shared runtime config: {str(e)}")
+    lifecycle.spawn(watch_runtime_config(), service=True)
+    
+    # Start the Telegram bot (on the lease holder only, when polling)
+    telegram_send_queue.bot = telegram_bot
     if TELEGRAM_BOT_TOKEN:
-        asyncio.create_task(start_telegram_bot())
+        lifecycle.spawn(run_telegram_supervisor(), service=True)
     else:
         logger.warning("Telegram bot not started: Token not configured")
     
@@ -872,6 +5247,58 @@ async def startup_event():
     else:
         logger.warning("OpenAI API not configured")
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+async def shutdown_event():
+    """Stop taking work, let running work finish, then close connections.
+    
+    uvicorn only runs this after open HTTP connections are closed; long
+    streams are bounded by --timeout-graceful-shutdown.
+    """
+    # No new Telegram updates; handlers already running can still reply
+    await stop_telegram_polling()
+    report = await lifecycle.shutdown(SHUTDOWN_DRAIN_SECONDS)
+    logger.info(
+        f"Drained {report['drained']} background tasks, cancelled {report['cancelled']}, "
+        f"{telegram_send_queue.stats()['queue_depth']} Telegram replies unsent"
+    )
+    
+    loop_watchdog.stop()
+    await conversation_memory.flush()
+    await page_fetcher.close()
+    for upstream in outbound_clients.values():
+        upstream.close()
+    await stop_telegram_bot()
+    if telegram_bot is not None:
+        await telegram_bot.shutdown()
+    await telegram_lease.release()
     client.close()
+
+def create_app() -> FastAPI:
+    """Build the ASGI app: routes, middleware and lifecycle hooks.
+    
+    Nothing here touches the network or the filesystem; integrations are
+    set up by the startup hook.
+    """
+    application = FastAPI(default_response_class=FastJSONResponse)
+    application.include_router(api_router)
+    application.add_exception_handler(ShuttingDown, shutting_down_handler)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+    application.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_BYTES,
+        thread_size=COMPRESSION_THREAD_BYTES
+    )
+    application.add_middleware(RequestContextMiddleware)
+    # Served outside /api so nginx does not expose it; scrape port 8001
+    application.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+    application.add_event_handler("startup", startup_event)
+    application.add_event_handler("shutdown", shutdown_event)
+    return application
+
+app = create_app()
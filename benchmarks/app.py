@@ -0,0 +1,56 @@
+"""Run the backend for benchmarking with in-process stand-ins.
+
+Started by benchmarks/run.py as a subprocess. Replaces the DuckDuckGo call
+with a fake that sleeps BENCH_SEARCH_LATENCY_MS, and uses an in-memory
+MongoDB (mongomock-motor) unless BENCH_MONGO_URL points at a real one.
+OpenAI and Telegram are reached over HTTP through OPENAI_BASE_URL and
+TELEGRAM_API_BASE_URL, so their client libraries run unmodified.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import uvicorn
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+if not os.environ.get("BENCH_MONGO_URL"):
+    import mongomock_motor
+    import motor.motor_asyncio
+
+    class InMemoryMotorClient(mongomock_motor.AsyncMongoMockClient):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop("event_listeners", None)
+            super().__init__(*args, **kwargs)
+
+    motor.motor_asyncio.AsyncIOMotorClient = InMemoryMotorClient
+    os.environ["MONGO_URL"] = "mongodb://in-memory"
+else:
+    os.environ["MONGO_URL"] = os.environ["BENCH_MONGO_URL"]
+
+import server  # noqa: E402
+
+# Per-request INFO lines from the app and its HTTP clients would swamp the report
+logging.getLogger().setLevel(logging.WARNING)
+
+SEARCH_LATENCY = float(os.environ.get("BENCH_SEARCH_LATENCY_MS", "150")) / 1000
+
+
+def fake_ddgs_text(query, max_results, timeout=None):
+    time.sleep(SEARCH_LATENCY)
+    slug = "-".join(query.lower().split())[:40]
+    return [
+        {"title": f"{query} result {i}", "href": f"https://example.com/{slug}/{i}", "body": f"Advisory {i} for {query}."}
+        for i in range(max_results)
+    ]
+
+
+server.ddgs_text = fake_ddgs_text
+server.DATASET_DIR = Path(tempfile.mkdtemp(prefix="bench-datasets-"))
+
+if __name__ == "__main__":
+    uvicorn.run(server.app, host="127.0.0.1", port=int(os.environ["BENCH_PORT"]), log_level="warning")
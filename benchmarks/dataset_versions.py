@@ -0,0 +1,103 @@
+"""Measure re-ingesting a new version of a feed with a small change.
+
+Writes a synthetic hash feed of --size-mb and processes it as version 1.
+It then changes about 1% of it, the way daily feeds change, and processes
+that as version 2:
+- entries expire from the top
+- new ones are appended
+- a few are edited in place
+
+Only chunks that version 1 did not have are indexed.
+
+    python -m benchmarks.dataset_versions --size-mb 2048
+
+Uses the same in-memory MongoDB as the load test unless BENCH_MONGO_URL is
+set. The in-memory store copies every document, so use a real MongoDB for
+feeds much over 256MB.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from benchmarks.app import server
+
+HEX = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+SUFFIX = np.frombuffer(b",botnet,2024-10-19\n", dtype=np.uint8)
+LINE_BYTES = 32 + len(SUFFIX)
+BLOCK_LINES = 1 << 20
+
+
+def make_block(seed, lines):
+    """`lines` feed entries (a random md5-like hash per line) as bytes"""
+    rng = np.random.default_rng(seed)
+    block = np.empty((lines, LINE_BYTES), dtype=np.uint8)
+    block[:, :32] = HEX[rng.integers(0, 16, size=(lines, 32), dtype=np.uint8)]
+    block[:, 32:] = SUFFIX
+    return block
+
+
+def write_feed(path, blocks, skip_lines=0, edits=(), append_seed=None, append_lines=0):
+    edits = sorted(edits)
+    with open(path, "wb") as handle:
+        first_line = 0
+        for seed in range(blocks):
+            block = make_block(seed, BLOCK_LINES)
+            for line in edits:
+                if first_line <= line < first_line + BLOCK_LINES:
+                    block[line - first_line, :32] = ord("0")
+            start = max(0, skip_lines - first_line)
+            handle.write(block[start:].tobytes())
+            first_line += BLOCK_LINES
+        if append_lines:
+            handle.write(make_block(append_seed, append_lines).tobytes())
+
+
+async def ingest(name, version, path):
+    dataset_id = f"{name}-v{version}"
+    await server.datasets.insert_one({
+        "id": dataset_id, "name": name, "version": version, "file_path": str(path), "status": "uploaded"
+    })
+    start = time.perf_counter()
+    await server.process_dataset(dataset_id, str(path))
+    elapsed = time.perf_counter() - start
+    doc = await server.datasets.find_one({"id": dataset_id})
+    if doc["status"] != "complete":
+        raise SystemExit(f"version {version} failed: {doc.get('error')}")
+    return elapsed, doc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--change", type=float, default=0.01, help="fraction of the feed that changes")
+    args = parser.parse_args()
+
+    blocks = max(1, args.size_mb * (1 << 20) // (BLOCK_LINES * LINE_BYTES))
+    total_lines = blocks * BLOCK_LINES
+    churn = int(total_lines * args.change / 2)
+    v1 = server.DATASET_DIR / "feed-v1.csv"
+    v2 = server.DATASET_DIR / "feed-v2.csv"
+    write_feed(v1, blocks)
+    # Half the change expires from the top and is replaced at the end; 100 edits in between
+    edits = np.random.default_rng(7).choice(np.arange(churn, total_lines), size=100, replace=False)
+    write_feed(v2, blocks, skip_lines=churn, edits=edits.tolist(), append_seed=10 ** 6, append_lines=churn)
+
+    async def run():
+        first, _ = await ingest("feed", 1, v1)
+        second, doc = await ingest("feed", 2, v2)
+        return first, second, doc
+
+    first, second, doc = asyncio.run(run())
+    size_mb = doc["size_bytes"] / (1 << 20)
+    print(f"feed: {size_mb:.0f} MB, {doc['records']} records, {args.change:.1%} changed")
+    print(f"version 1 (full ingest): {first:.1f}s")
+    print(
+        f"version 2 (delta):       {second:.1f}s, {doc['new_chunks']} of {doc['chunks']} chunks indexed, "
+        f"{doc['reused_bytes'] / (1 << 20):.0f} MB reused"
+    )
+
+
+if __name__ == "__main__":
+    main()
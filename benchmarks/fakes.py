@@ -0,0 +1,128 @@
+"""Local stand-ins for the upstreams the backend talks to.
+
+Both servers run in threads of the benchmark driver and answer with a
+configurable latency, so the backend can be loaded without network access.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, handler, latency_ms=0.0, jitter_ms=0.0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        if "json" in self.headers.get("Content-Type", ""):
+            return json.loads(raw or b"{}")
+        return {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OpenAIHandler(JSONHandler):
+    """Minimal OpenAI-compatible API: chat completions and model listing"""
+
+    def do_GET(self):
+        if self.path.endswith("/models"):
+            self.send_json({"object": "list", "data": [{"id": "gpt-4", "object": "model", "created": 0, "owned_by": "bench"}]})
+        else:
+            self.send_json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        body = self.read_body()
+        if not self.path.endswith("/chat/completions"):
+            self.send_json({"error": {"message": "not found"}}, 404)
+            return
+        self.server.delay()
+        prompt_tokens = sum(len(message.get("content", "")) // 4 for message in body.get("messages", []))
+        content = "Fake analysis: patch promptly, monitor indicators of compromise and rotate exposed credentials."
+        with self.server.lock:
+            self.server.completions += 1
+        self.send_json({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+        })
+
+
+class TelegramHandler(JSONHandler):
+    """Minimal Bot API: getMe, webhook calls and sendMessage (timestamps kept per chat)"""
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.read_body()
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                      "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif method in ("setWebhook", "deleteWebhook", "close", "logOut"):
+            result = True
+        elif method == "sendMessage":
+            self.server.delay()
+            chat_id = int(body["chat_id"])
+            with self.server.lock:
+                self.server.messages.setdefault(chat_id, []).append(time.monotonic())
+            result = {"message_id": random.randint(1, 10 ** 9), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": body.get("text", "")}
+        else:
+            result = True
+        self.send_json({"ok": True, "result": result})
+
+    do_GET = do_POST
+
+
+def start_fake_openai(latency_ms, jitter_ms=0.0):
+    server = FakeServer(OpenAIHandler, latency_ms, jitter_ms)
+    server.completions = 0
+    return server.start()
+
+
+def start_fake_telegram(latency_ms, jitter_ms=0.0):
+    server = FakeServer(TelegramHandler, latency_ms, jitter_ms)
+    server.messages = {}
+    return server.start()
@@ -0,0 +1,274 @@
+"""Offline load test for the backend.
+
+Starts fake OpenAI and Telegram servers, launches the backend against them
+(see benchmarks/app.py) and drives a weighted mix of chat, web search,
+dataset uploads and Telegram webhook updates. Prints throughput and
+p50/p95/p99 latency per scenario and compares them with a saved baseline.
+
+    python -m benchmarks.run                       # run and compare with baselines/mixed.json
+    python -m benchmarks.run --save-baseline       # record a new baseline
+    python -m benchmarks.run --duration 60 --concurrency 64 --llm-latency-ms 800
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.fakes import start_fake_openai, start_fake_telegram
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+BOT_TOKEN = "123456:bench-token"
+
+PROFILES = {
+    "mixed": {"chat": 40, "search": 30, "upload": 10, "telegram": 20},
+    "chat": {"chat": 100},
+    "search": {"search": 100},
+}
+
+QUERIES = [
+    "CVE-2024-3094 xz backdoor",
+    "log4shell mitigation",
+    "ransomware initial access techniques",
+    "OAuth token theft detection",
+    "CVE-2023-4966 citrix bleed",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_dataset(rows=2000):
+    lines = ["timestamp,src_ip,dst_ip,port,action"]
+    for i in range(rows):
+        lines.append(f"2024-01-01T00:{i % 60:02d}:00,10.0.{i % 256}.{i % 200},192.168.1.{i % 50},{443 + i % 5},allow")
+    return "\n".join(lines).encode()
+
+
+class LoadDriver:
+    def __init__(self, base_url, telegram, weights):
+        self.base_url = base_url
+        self.telegram = telegram
+        self.scenarios = list(weights)
+        self.weights = list(weights.values())
+        self.latencies = {name: [] for name in weights}
+        self.statuses = {name: {} for name in weights}
+        self.update_sent_at = {}
+        self.next_update_id = 1
+        self.dataset = make_dataset()
+
+    async def chat(self, client):
+        return await client.post("/api/chat", json={"message": f"How do I respond to {random.choice(QUERIES)}?"})
+
+    async def search(self, client):
+        return await client.post("/api/search/web", json={"query": random.choice(QUERIES)})
+
+    async def upload(self, client):
+        files = {"file": ("flows.csv", self.dataset, "text/csv")}
+        return await client.post("/api/dataset/upload", data={"name": "bench", "description": "load test"}, files=files)
+
+    async def telegram_update(self, client):
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        chat_id = 1000000 + update_id
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                "text": f"What is {random.choice(QUERIES)}?",
+            },
+        }
+        self.update_sent_at[chat_id] = time.monotonic()
+        return await client.post("/api/telegram/webhook", json=update)
+
+    async def worker(self, client, deadline):
+        actions = {"chat": self.chat, "search": self.search, "upload": self.upload, "telegram": self.telegram_update}
+        while time.monotonic() < deadline:
+            name = random.choices(self.scenarios, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await actions[name](client)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            self.latencies[name].append(time.perf_counter() - start)
+            self.statuses[name][status] = self.statuses[name].get(status, 0) + 1
+
+    async def run(self, duration, concurrency):
+        limits = httpx.Limits(max_connections=concurrency)
+        # Each worker looks like a different client so per-IP rate limits don't dominate
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + duration
+            start = time.perf_counter()
+            await asyncio.gather(*(self.worker(client, deadline) for _ in range(concurrency)))
+            return time.perf_counter() - start
+
+    def telegram_reply_latencies(self):
+        """Time from posting an update to the first sendMessage for that chat"""
+        latencies = []
+        for chat_id, sent_at in self.update_sent_at.items():
+            replies = self.telegram.messages.get(chat_id)
+            if replies:
+                latencies.append(replies[-1] - sent_at)
+        return latencies
+
+
+def summarize(latencies, elapsed, statuses=None):
+    summary = {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": None, "p95_ms": None, "p99_ms": None,
+    }
+    for pct in (50, 95, 99):
+        value = percentile(latencies, pct)
+        summary[f"p{pct}_ms"] = round(value * 1000, 1) if value is not None else None
+    if statuses is not None:
+        summary["statuses"] = {str(key): count for key, count in sorted(statuses.items(), key=str)}
+    return summary
+
+
+def start_backend(port, openai_url, telegram_url, args):
+    env = dict(
+        os.environ,
+        BENCH_PORT=str(port),
+        BENCH_SEARCH_LATENCY_MS=str(args.search_latency_ms),
+        DB_NAME="bench",
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=f"{openai_url}/v1",
+        TELEGRAM_BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_MODE="webhook",
+        TELEGRAM_WEBHOOK_URL=f"http://127.0.0.1:{port}/api/telegram/webhook",
+        TELEGRAM_API_BASE_URL=f"{telegram_url}/bot",
+        RATE_LIMIT_PER_MINUTE="1000000",
+        RATE_LIMIT_BURST="1000000",
+        LOOP_WATCHDOG_ENABLED="1",
+    )
+    if args.mongo_url:
+        env["BENCH_MONGO_URL"] = args.mongo_url
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.app"], cwd=ROOT, env=env)
+
+
+def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        try:
+            if httpx.get(f"{url}/api/status", timeout=1).status_code == 200:
+                # Give the Telegram application time to initialize against the fake
+                time.sleep(1)
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Backend did not start")
+
+
+def compare(results, baseline, tolerance):
+    """Return regressions: p95 up or throughput down by more than `tolerance`"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or not current["requests"]:
+            continue
+        if previous.get("p95_ms") and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+        if previous.get("throughput_rps") and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['throughput_rps']} req/s vs baseline {previous['throughput_rps']} req/s")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'scenario':<16} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for name, row in results["scenarios"].items():
+        statuses = ", ".join(f"{code}: {count}" for code, count in row.get("statuses", {}).items())
+        print(f"{name:<16} {row['requests']:>8} {row['throughput_rps']:>8} {str(row['p50_ms']):>8} "
+              f"{str(row['p95_ms']):>8} {str(row['p99_ms']):>8}  {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline backend load test")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="mixed")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--search-latency-ms", type=float, default=150)
+    parser.add_argument("--telegram-latency-ms", type=float, default=20)
+    parser.add_argument("--mongo-url", help="Use a real MongoDB instead of the in-memory one")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression vs baseline (fraction)")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(1)
+    openai_fake = start_fake_openai(args.llm_latency_ms, args.llm_latency_ms * 0.2)
+    telegram_fake = start_fake_telegram(args.telegram_latency_ms)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    backend = start_backend(port, openai_fake.url, telegram_fake.url, args)
+    try:
+        wait_until_ready(base_url, backend)
+        weights = PROFILES[args.profile]
+        asyncio.run(LoadDriver(base_url, telegram_fake, weights).run(args.warmup, args.concurrency))
+
+        driver = LoadDriver(base_url, telegram_fake, weights)
+        driver.next_update_id = 10 ** 6
+        elapsed = asyncio.run(driver.run(args.duration, args.concurrency))
+        time.sleep(2)  # Let queued Telegram replies go out
+
+        scenarios = {name: summarize(driver.latencies[name], elapsed, driver.statuses[name]) for name in weights}
+        if "telegram" in weights:
+            scenarios["telegram_reply"] = summarize(driver.telegram_reply_latencies(), elapsed)
+        all_latencies = [value for values in driver.latencies.values() for value in values]
+        scenarios["total"] = summarize(all_latencies, elapsed)
+        results = {
+            "profile": args.profile,
+            "settings": {key: getattr(args, key) for key in ("duration", "concurrency", "llm_latency_ms", "search_latency_ms", "telegram_latency_ms")},
+            "mongo": "real" if args.mongo_url else "in-memory",
+            "scenarios": scenarios,
+        }
+    finally:
+        backend.terminate()
+        backend.wait()
+        openai_fake.stop()
+        telegram_fake.stop()
+
+    print_table(results)
+    baseline_path = BASELINE_DIR / f"{args.profile}.json"
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {baseline_path.relative_to(ROOT)}")
+        return
+    if baseline_path.exists():
+        regressions = compare(results, json.loads(baseline_path.read_text()), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Within {args.tolerance:.0%} of baseline {baseline_path.relative_to(ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
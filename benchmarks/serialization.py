@@ -0,0 +1,107 @@
+"""Compare response encoding before and after the fast JSON path.
+
+For representative payloads of /api/datasets, /api/status/checks and a deep
+/api/search/web, measures CPU time of FastAPI's default path
+(jsonable_encoder + json.dumps) against orjson via FastJSONResponse. It
+also measures bytes on the wire and compression time for gzip and brotli.
+
+    python -m benchmarks.serialization
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from backend.server import FastJSONResponse, compress_body, get_brotli
+
+REPEAT = 20
+
+
+def dataset_docs(count=1000):
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "name": f"firewall-export-{i}",
+            "description": "Perimeter firewall flow export for incident triage",
+            "file_path": f"/app/backend/datasets/{uuid.uuid4()}.csv",
+            "upload_date": now - timedelta(minutes=i),
+            "status": random.choice(["complete", "processing", "failed"]),
+            "size_bytes": random.randint(10 ** 4, 10 ** 8),
+            "records": random.randint(100, 10 ** 6),
+        }
+        for i in range(count)
+    ]
+
+
+def status_checks(count=1000):
+    now = datetime.utcnow()
+    return [
+        {"id": str(uuid.uuid4()), "client_name": f"client-{i % 40}", "timestamp": now - timedelta(seconds=i)}
+        for i in range(count)
+    ]
+
+
+def deep_search(count=25):
+    words = "exploit remote code execution patch advisory vendor mitigation indicator attacker payload".split()
+    return {
+        "query": "CVE-2024-3094 exploit",
+        "results": [
+            {
+                "title": f"Advisory {i}",
+                "href": f"https://example.com/advisory/{i}",
+                "body": " ".join(random.choices(words, k=40)),
+                "page": {"status": "ok", "title": f"Advisory {i}", "text": " ".join(random.choices(words, k=700))},
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def cpu_ms(func, payload):
+    start = time.process_time()
+    for _ in range(REPEAT):
+        body = func(payload)
+    return (time.process_time() - start) / REPEAT * 1000, body
+
+
+def default_path(payload):
+    # What FastAPI does for a plain return value (ObjectId needs its old manual str())
+    encoded = jsonable_encoder(payload, custom_encoder={ObjectId: str})
+    return JSONResponse(encoded).body
+
+
+def fast_path(payload):
+    return FastJSONResponse(payload).body
+
+
+def main():
+    random.seed(7)
+    payloads = {
+        "datasets (1000)": dataset_docs(),
+        "status checks (1000)": status_checks(),
+        "deep search (25)": deep_search(),
+    }
+    encodings = ["gzip"] + (["br"] if get_brotli() else [])
+
+    print(f"{'payload':<22} {'default ms':>10} {'orjson ms':>10} {'speedup':>8} {'raw KB':>8}"
+          + "".join(f" {enc + ' KB':>8} {enc + ' ms':>8}" for enc in encodings))
+    for name, payload in payloads.items():
+        default_ms, _ = cpu_ms(default_path, payload)
+        fast_ms, body = cpu_ms(fast_path, payload)
+        row = f"{name:<22} {default_ms:>10.2f} {fast_ms:>10.2f} {default_ms / fast_ms:>7.1f}x {len(body) / 1024:>8.1f}"
+        for encoding in encodings:
+            compress_ms, compressed = cpu_ms(lambda data: compress_body(data, encoding), body)
+            row += f" {len(compressed) / 1024:>8.1f} {compress_ms:>8.2f}"
+        print(row)
+    if "br" not in encodings:
+        print("brotli not installed; only gzip measured")
+
+
+if __name__ == "__main__":
+    main()
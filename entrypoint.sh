@@ -6,7 +6,8 @@ cd /backend || { echo "Backend directory not found"; exit 1; }
 
 echo "Starting FastAPI backend"
 # Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+# Open connections (SSE, streams) get 5s on shutdown, then background work drains
+uvicorn server:app --host 0.0.0.0 --port 8001 --timeout-graceful-shutdown 5 &
 BACKEND_PID=$!
 
 echo "Waiting for backend to start..."
@@ -21,8 +22,8 @@ fi
 nginx -g 'daemon off;' &
 NGINX_PID=$!
 
-# Handle termination signals
-trap 'kill $BACKEND_PID $NGINX_PID; exit 0' SIGTERM SIGINT
+# Handle termination signals; wait so the backend can drain and checkpoint
+trap 'kill $BACKEND_PID $NGINX_PID; wait $BACKEND_PID; exit 0' SIGTERM SIGINT
 
 # Check if processes are still running
 while kill -0 $BACKEND_PID 2>/dev/null && kill -0 $NGINX_PID 2>/dev/null; do
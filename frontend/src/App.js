@@ -49,22 +49,42 @@ const Sidebar = ({ activeTab, setActiveTab }) => {
 };
 
 // Dashboard component
-const Dashboard = ({ status }) => {
+const Dashboard = ({ status, events }) => {
   const [statusChecks, setStatusChecks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingChecks, setLoadingChecks] = useState(false);
+
+  // Checks are served a page at a time; the next page's cursor comes back in a header
+  const fetchStatusChecks = async (cursor) => {
+    setLoadingChecks(true);
+    try {
+      const response = await axios.get(`${API}/status/checks`, {
+        params: cursor ? { cursor } : {}
+      });
+      setStatusChecks((checks) => cursor ? [...checks, ...response.data] : response.data);
+      setNextCursor(response.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Error fetching status checks:", error);
+    } finally {
+      setLoadingChecks(false);
+    }
+  };
 
   useEffect(() => {
-    const fetchStatusChecks = async () => {
-      try {
-        const response = await axios.get(`${API}/status/checks`);
-        setStatusChecks(response.data);
-      } catch (error) {
-        console.error("Error fetching status checks:", error);
-      }
-    };
-    
     fetchStatusChecks();
   }, []);
 
+  // New checks are pushed by the server instead of re-fetching the list
+  useEffect(() => {
+    if (!events) return;
+    const onStatusCheck = (e) => {
+      const check = JSON.parse(e.data);
+      setStatusChecks((checks) => [check, ...checks]);
+    };
+    events.addEventListener("status_check", onStatusCheck);
+    return () => events.removeEventListener("status_check", onStatusCheck);
+  }, [events]);
+
   return (
     <div className="p-6">
       <h2 className="text-2xl font-bold mb-6">Dashboard</h2>
@@ -131,6 +151,15 @@ const Dashboard = ({ status }) => {
                 ))}
               </tbody>
             </table>
+            {nextCursor && (
+              <button
+                onClick={() => fetchStatusChecks(nextCursor)}
+                disabled={loadingChecks}
+                className="mt-4 bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded focus:outline-none focus:shadow-outline disabled:opacity-50"
+              >
+                {loadingChecks ? "Loading..." : "Load more"}
+              </button>
+            )}
           </div>
         ) : (
           <p className="text-gray-500">No system checks recorded yet.</p>
@@ -141,7 +170,7 @@ const Dashboard = ({ status }) => {
 };
 
 // Dataset Management component
-const DatasetManagement = () => {
+const DatasetManagement = ({ events }) => {
   const [datasets, setDatasets] = useState([]);
   const [name, setName] = useState("");
   const [description, setDescription] = useState("");
@@ -162,6 +191,25 @@ const DatasetManagement = () => {
     fetchDatasets();
   }, []);
 
+  // Apply pushed dataset uploads and processing progress in place
+  useEffect(() => {
+    if (!events) return;
+    const onDataset = (e) => {
+      const update = JSON.parse(e.data);
+      setDatasets((current) => {
+        const index = current.findIndex((dataset) => dataset.id === update.id);
+        if (index === -1) {
+          return [...current, update];
+        }
+        const next = [...current];
+        next[index] = { ...next[index], ...update };
+        return next;
+      });
+    };
+    events.addEventListener("dataset", onDataset);
+    return () => events.removeEventListener("dataset", onDataset);
+  }, [events]);
+
   const handleFileChange = (e) => {
     setFile(e.target.files[0]);
   };
@@ -194,8 +242,10 @@ const DatasetManagement = () => {
       setFile(null);
       setMessage({ text: "Dataset uploaded successfully", type: "success" });
       
-      // Refresh the dataset list
-      fetchDatasets();
+      // Refresh the dataset list unless the server pushes the new dataset
+      if (!events) {
+        fetchDatasets();
+      }
     } catch (error) {
       console.error("Error uploading dataset:", error);
       setMessage({ text: "Failed to upload dataset", type: "error" });
@@ -823,6 +873,8 @@ function App() {
     database: "unknown"
   });
 
+  const [events, setEvents] = useState(null);
+
   useEffect(() => {
     const fetchStatus = async () => {
       try {
@@ -833,12 +885,19 @@ function App() {
       }
     };
     
-    fetchStatus();
+    // Fall back to polling when the browser has no EventSource support
+    if (typeof EventSource === "undefined") {
+      fetchStatus();
+      const intervalId = setInterval(fetchStatus, 30000);
+      return () => clearInterval(intervalId);
+    }
     
-    // Refresh status every 30 seconds
-    const intervalId = setInterval(fetchStatus, 30000);
+    // One push channel per tab; it sends a status snapshot on (re)connect
+    const source = new EventSource(`${API}/events`);
+    source.addEventListener("status", (e) => setStatus(JSON.parse(e.data)));
+    setEvents(source);
     
-    return () => clearInterval(intervalId);
+    return () => source.close();
   }, []);
 
   return (
@@ -846,8 +905,8 @@ function App() {
       <Sidebar activeTab={activeTab} setActiveTab={setActiveTab} />
       
       <div className="flex-1 overflow-y-auto">
-        {activeTab === "dashboard" && <Dashboard status={status} />}
-        {activeTab === "dataset" && <DatasetManagement />}
+        {activeTab === "dashboard" && <Dashboard status={status} events={events} />}
+        {activeTab === "dataset" && <DatasetManagement events={events} />}
         {activeTab === "search" && <SearchEngine />}
         {activeTab === "config" && <Configuration />}
       </div>
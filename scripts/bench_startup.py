@@ -0,0 +1,91 @@
+"""Measure backend import time with `python -X importtime`.
+
+Imports backend/server.py in fresh interpreters, prints the median
+cumulative import time and the slowest top-level imports, and exits
+non-zero if any integration that should load lazily was imported at
+startup, or if the median is more than --tolerance above the recorded
+baseline (benchmarks/baselines/startup.json). --max-ms sets an absolute
+limit instead.
+
+    python scripts/bench_startup.py --runs 5                  # compare with the baseline
+    python scripts/bench_startup.py --runs 9 --save-baseline  # record a new baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "baselines", "startup.json")
+
+# Imported on first use by server.py; none of these may load at startup
+LAZY_MODULES = ["openai", "telegram", "duckduckgo_search", "bs4", "lxml", "tiktoken", "httpx", "numpy"]
+
+
+def import_profile():
+    """Run one import and return [(depth, module, cumulative microseconds)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each nesting level indents the module name by two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        profile.append((depth, name.strip(), int(cumulative)))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=float(os.environ.get("STARTUP_MAX_MS", "0")) or None,
+                        help="Absolute limit; overrides the baseline comparison")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression vs baseline (fraction)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    totals = [sum(micros for depth, _, micros in profile if depth == 0) / 1000 for profile in profiles]
+    median = statistics.median(totals)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump({"median_ms": round(median, 1), "runs": args.runs}, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"Saved baseline: median {median:.0f} ms over {args.runs} runs")
+
+    limit = args.max_ms
+    if limit is None and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)["median_ms"]
+        # Import times vary by a few percent between runs and more between machines
+        limit = baseline * (1 + args.tolerance)
+
+    # Direct imports of server.py are where startup time can be won back
+    children = [(name, micros) for depth, name, micros in profiles[-1] if depth == 1]
+    slowest = sorted(children, key=lambda item: item[1], reverse=True)[:args.top]
+    limit_text = f"limit {limit:.0f} ms" if limit else "no limit, no baseline recorded"
+    print(f"backend import: median {median:.0f} ms over {args.runs} runs ({limit_text})")
+    for name, micros in slowest:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failed = False
+    imported = {name for _, name, _ in profiles[-1]}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(eager)}")
+        failed = True
+    if limit and median > limit:
+        print(f"FAIL: startup regression, {median:.0f} ms > {limit:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
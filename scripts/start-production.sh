@@ -0,0 +1,13 @@
+#!/bin/bash
+# Run the backend with several worker processes (no auto-reload).
+# Shared state (runtime config, Telegram leadership, seen updates) lives in
+# MongoDB, so any number of workers can serve the same deployment.
+
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+
+cd "$(dirname "$0")/../backend" || { echo "Backend directory not found"; exit 1; }
+
+echo "Starting FastAPI backend with $WEB_CONCURRENCY workers"
+# Streams get 5s to finish on shutdown; background work then drains for
+# SHUTDOWN_DRAIN_SECONDS and dataset progress is checkpointed
+exec uvicorn server:app --host 0.0.0.0 --port 8001 --workers "$WEB_CONCURRENCY" --timeout-graceful-shutdown 5
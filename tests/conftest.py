@@ -0,0 +1,17 @@
+import pytest
+
+import backend.server as server
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An in-memory database; `mongo.use("name", ...)` points server collections at it"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient().db
+
+    def use(*names):
+        for name in names:
+            monkeypatch.setattr(server, name, db[name])
+
+    db.use = use
+    return db
@@ -0,0 +1,27 @@
+import pytest
+from starlette.requests import Request
+
+import backend.server as server
+
+
+def make_request(peer, real_ip=None):
+    headers = [(b"x-real-ip", real_ip.encode())] if real_ip else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 50000)})
+
+
+@pytest.mark.parametrize("peer, real_ip, expected", [
+    ("127.0.0.1", "203.0.113.7", "ip:203.0.113.7"),
+    ("::1", "203.0.113.7", "ip:203.0.113.7"),
+    ("127.0.0.1", None, "ip:127.0.0.1"),
+    # A direct client cannot choose its own rate limit bucket
+    ("198.51.100.9", "203.0.113.7", "ip:198.51.100.9"),
+    ("testclient", "203.0.113.7", "ip:testclient"),
+])
+def test_client_key_only_trusts_proxies(peer, real_ip, expected):
+    assert server.client_key(make_request(peer, real_ip)) == expected
+
+
+def test_trusted_proxies_accept_networks(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+    assert server.client_key(make_request("10.1.2.3", "203.0.113.7")) == "ip:203.0.113.7"
+    assert server.client_key(make_request("127.0.0.1", "203.0.113.7")) == "ip:127.0.0.1"
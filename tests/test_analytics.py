@@ -0,0 +1,52 @@
+import asyncio
+
+import backend.server as server
+
+
+def test_usage_counters_accumulate_per_bucket(mongo):
+    mongo.use("usage_hourly", "search_term_counts", "telegram_user_activity", "llm_latency_daily")
+
+    async def run():
+        await server.record_usage("search", query="CVE-2024  Exploit", telegram_user_id=7)
+        await server.record_usage("search", query="cve-2024 exploit")
+        await server.record_usage("chat", telegram_user_id=7)
+        await server.record_usage("chat", count=3)
+        return await server.get_analytics(hours=2, days=1)
+
+    analytics = asyncio.run(run())
+    # All in one hour bucket, unless the test ran across the hour
+    hours = analytics["queries_per_hour"]
+    counts = {}
+    for hour in hours:
+        for event, count in hour["counts"].items():
+            counts[event] = counts.get(event, 0) + count
+    assert len(hours) in (1, 2)
+    assert counts == {"search": 2, "chat": 4}
+    assert sum(hour["total"] for hour in hours) == 6
+    assert analytics["top_search_terms"] == [{"term": "cve-2024 exploit", "count": 2}]
+    [user] = analytics["telegram_user_volume"]
+    assert (user["user_id"], user["total"], user["counts"]) == (7, 2, {"search": 1, "chat": 1})
+
+
+def test_latency_percentiles_come_from_fixed_buckets(mongo):
+    mongo.use("usage_hourly", "search_term_counts", "telegram_user_activity", "llm_latency_daily")
+
+    async def run():
+        for latency_ms in [80] * 90 + [700] * 9 + [45000]:
+            await server.record_llm_latency(latency_ms)
+        return await server.get_analytics(days=2)
+
+    latency = asyncio.run(run())["llm_latency"]
+    assert latency["count"] == 100
+    assert latency["buckets"] == {"le_100": 90, "le_1000": 9, "le_60000": 1}
+    # Each percentile reads back as the upper bound of the bucket it falls in
+    assert (latency["p50_ms"], latency["p95_ms"], latency["p99_ms"]) == (100, 1000, 1000)
+    assert latency["mean_ms"] == round((80 * 90 + 700 * 9 + 45000) / 100, 1)
+
+
+def test_percentile_in_the_open_bucket_has_no_bound():
+    assert server.latency_bucket(50) == "le_50"
+    assert server.latency_bucket(50.1) == "le_100"
+    assert server.latency_bucket(120000) == "le_inf"
+    assert server.histogram_percentile({"le_50": 1, "le_inf": 1}, 2, 99) is None
+    assert server.histogram_percentile({}, 0, 50) is None
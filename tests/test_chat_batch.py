@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import backend.server as server
+
+
+@pytest.fixture
+def batches(mongo, monkeypatch):
+    mongo.use("chat_batches", "conversations", "usage_hourly")
+    monkeypatch.setattr(server, "active_batches", server.OrderedDict())
+    answered = []
+
+    async def fake_llm(prompt, route="chat", **kwargs):
+        answered.append(prompt)
+        return f"answer to {prompt}"
+
+    monkeypatch.setattr(server, "get_llm_response", fake_llm)
+    return answered
+
+
+async def stale_batch():
+    """A batch whose worker died after storing the answer to prompt 0"""
+    await server.chat_batches.insert_one({
+        "batch_id": "b1",
+        "prompts": ["p0", "p1", "p2"],
+        "status": "running",
+        "heartbeat_at": datetime.utcnow() - timedelta(minutes=5)
+    })
+    await server.conversations.insert_one(
+        {"batch_id": "b1", "index": 0, "seq": 0, "message": "p0", "response": "answer to p0"}
+    )
+
+
+async def read_lines(response):
+    return [line async for line in response.body_iterator]
+
+
+def test_resumed_batch_only_answers_unfinished_prompts(batches):
+    async def run():
+        await stale_batch()
+        response = await server.batch_stream("b1")
+        # Results must reach the client one by one, not in proxy-buffered bursts
+        assert response.headers["X-Accel-Buffering"] == "no"
+        lines = await read_lines(response)
+        stored = await server.conversations.find({"batch_id": "b1"}).sort("seq", 1).to_list(None)
+        record = await server.chat_batches.find_one({"batch_id": "b1"})
+        return lines, stored, record
+
+    lines, stored, record = asyncio.run(run())
+    assert sorted(batches) == ["p1", "p2"]
+    assert len(lines) == 3
+    assert [doc["seq"] for doc in stored] == [0, 1, 2]
+    assert sorted(doc["index"] for doc in stored) == [0, 1, 2]
+    assert record["status"] == "complete"
+
+
+class FlakyInserts:
+    """Wraps a collection, counting bulk inserts and failing the first one"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def insert_one(self, doc):
+        raise AssertionError("answers are stored in bulk")
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("primary stepped down")
+        return await self.collection.insert_many(docs, ordered=ordered)
+
+
+def test_answers_are_stored_in_bulk_and_a_failed_write_is_retried(batches, monkeypatch):
+    flaky = FlakyInserts(server.conversations)
+    monkeypatch.setattr(server, "conversations", flaky)
+    monkeypatch.setattr(server, "BATCH_PERSIST_EVERY", 4)
+
+    async def run():
+        await server.chat_batches.insert_one({"batch_id": "b2", "prompts": [], "status": "running"})
+        batch = server.start_batch("b2", [f"p{i}" for i in range(10)])
+        await batch.task
+        stored = await flaky.find({"batch_id": "b2"}).to_list(None)
+        return stored, await server.chat_batches.find_one({"batch_id": "b2"})
+
+    stored, record = asyncio.run(run())
+    assert sorted(doc["index"] for doc in stored) == list(range(10))
+    assert flaky.calls <= 4
+    assert record["status"] == "complete"
+
+
+def test_stale_batch_is_claimed_once(batches):
+    async def run():
+        await stale_batch()
+        record = await server.chat_batches.find_one({"batch_id": "b1"})
+        first, second = await asyncio.gather(server.claim_stale_batch(record), server.claim_stale_batch(record))
+        return first, second, await server.chat_batches.find_one({"batch_id": "b1"})
+
+    first, second, record = asyncio.run(run())
+    assert [first, second].count(True) == 1
+    assert record["worker_id"] == server.WORKER_ID
+
+
+def test_prompt_budget_is_charged_per_prompt():
+    limiter = server.ClientRateLimiter(per_minute=60, burst=10)
+    assert limiter.check("ip:10.0.0.1", 10) == 0
+    assert limiter.check("ip:10.0.0.1", 5) == pytest.approx(5, abs=0.1)
+    assert limiter.check("ip:10.0.0.2", 5) == 0
@@ -0,0 +1,67 @@
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from backend.server import CompressionMiddleware, FastJSONResponse, dumps_json, negotiate_encoding
+
+
+def make_client():
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=100, thread_size=1000)
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/large")
+    async def large(count: int = 50):
+        return [{"id": i, "name": "firewall-export"} for i in range(count)]
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            for i in range(3):
+                yield f"data: {'x' * 200} {i}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return TestClient(app)
+
+
+def test_negotiate_encoding_prefers_br_and_honours_q_zero():
+    assert negotiate_encoding("gzip, deflate, br") == "br"
+    assert negotiate_encoding("gzip, br;q=0") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("") is None
+
+
+def test_dumps_json_handles_datetimes_and_object_ids():
+    object_id = ObjectId()
+    payload = {"_id": object_id, "upload_date": datetime(2024, 1, 2, 3, 4, 5)}
+    assert json.loads(dumps_json(payload)) == {"_id": str(object_id), "upload_date": "2024-01-02T03:04:05"}
+
+
+def test_small_responses_are_not_compressed():
+    response = make_client().get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"ok": True}
+
+
+def test_large_responses_are_compressed_inline_and_in_thread():
+    client = make_client()
+    for count in (5, 200):
+        # The client decodes gzip transparently
+        response = client.get(f"/large?count={count}", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(response.content)
+        assert len(response.json()) == count
+
+
+def test_streaming_responses_pass_through():
+    response = make_client().get("/stream", headers={"Accept-Encoding": "gzip, br"})
+    assert "content-encoding" not in response.headers
+    assert response.text.count("data: ") == 3
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import backend.server as server
+from backend.server import ConversationMemory
+
+
+@pytest.fixture
+def profiles(mongo):
+    asyncio.run(mongo.user_profiles.create_index("user_id", unique=True))
+    return mongo.user_profiles
+
+
+def worker(profiles, recheck_seconds):
+    return ConversationMemory(profiles, max_users=10, token_budget=1000, summary_budget=100, shared=True,
+                              recheck_seconds=recheck_seconds)
+
+
+def stored_turns(profiles):
+    profile = asyncio.run(profiles.find_one({"user_id": 7}))
+    return profile["conversation_version"], [turn["content"] for turn in profile["conversation"]["turns"]]
+
+
+def test_exchanges_from_two_workers_are_all_kept(profiles):
+    a, b = worker(profiles, 60), worker(profiles, 60)
+
+    async def run():
+        # Both cache version 0, then each answers a message from its stale copy
+        await a.get(7)
+        await b.get(7)
+        await a.add_exchange(7, "q1", "a1")
+        await b.add_exchange(7, "q2", "a2")
+
+    asyncio.run(run())
+    # Written before add_exchange returned; b rebuilt its exchange on a's version
+    assert stored_turns(profiles) == (2, ["q1", "a1", "q2", "a2"])
+    assert (a.conflicts, b.conflicts) == (0, 1)
+
+
+def test_hits_skip_mongo_until_the_recheck_interval(profiles, monkeypatch):
+    memory = worker(profiles, 60)
+    reads = []
+    real_find_one = profiles.find_one
+
+    def counting_find_one(*args, **kwargs):
+        reads.append(args)
+        return real_find_one(*args, **kwargs)
+
+    monkeypatch.setattr(profiles, "find_one", counting_find_one)
+
+    async def run():
+        await memory.add_exchange(7, "q1", "a1")
+        for _ in range(5):
+            await memory.get_messages(7)
+        memory.recheck_seconds = 0
+        # Another worker wrote meanwhile: one query returns the newer conversation
+        await profiles.update_one({"user_id": 7}, {"$set": {"conversation_version": 5, "conversation.turns": []}})
+        return await memory.get_messages(7)
+
+    messages = asyncio.run(run())
+    assert len(reads) == 2
+    assert messages == []
+    assert memory.cache[7].version == 5
+
+
+def test_least_recently_used_context_is_evicted_and_written_back(profiles):
+    memory = ConversationMemory(profiles, max_users=2, token_budget=1000, summary_budget=100)
+
+    async def run():
+        await memory.add_exchange(1, "q1", "a1")
+        await memory.add_exchange(2, "q2", "a2")
+        # User 1 is used again, so user 2 is the oldest when user 3 arrives
+        await memory.get_messages(1)
+        await memory.get_messages(3)
+        cached = list(memory.cache)
+        # The evicted context had unsaved changes; it is written back in the background
+        await asyncio.gather(*list(server.lifecycle.work))
+        return cached, await profiles.find_one({"user_id": 2})
+
+    cached, evicted = asyncio.run(run())
+    assert cached == [1, 3]
+    assert memory.stats()["evictions"] == 1
+    assert [turn["content"] for turn in evicted["conversation"]["turns"]] == ["q2", "a2"]
+    assert memory.dirty == {1}
+
+
+def test_old_turns_fold_into_the_summary_over_the_token_budget(profiles):
+    memory = ConversationMemory(profiles, max_users=10, token_budget=60, summary_budget=100)
+
+    async def run():
+        for i in range(6):
+            await memory.add_exchange(7, f"question {i} " + "about ransomware " * 5, f"answer {i} " + "isolate hosts " * 5)
+        await memory.flush()
+        return await memory.get(7)
+
+    context = asyncio.run(run())
+    assert context.turn_tokens() <= 60
+    assert context.turns[-2]["content"].startswith("question 5")
+    assert "User asked: question 4" in context.summary
+    assert "Assistant answered: answer" in context.summary
+    # Only the newest part of the summary is kept once it outgrows its budget
+    assert context.summary.startswith("...")
+    assert len(context.summary) <= 100 * 4 + 3
+    assert context.messages()[0]["role"] == "system"
+    stored = asyncio.run(profiles.find_one({"user_id": 7}))
+    assert stored["conversation"]["summary"] == context.summary
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+import backend.server as server
+
+V1 = b"".join(f"10.0.{i // 250}.{i % 250 + 1},scan,host{i}.example.com\n".encode() for i in range(3000))
+V2 = V1.replace(b"10.0.5.7,scan", b"203.0.113.9,c2") + b"198.51.100.4,c2,new.example.net\n"
+
+
+@pytest.fixture
+def client(mongo, monkeypatch, tmp_path):
+    mongo.use("datasets", "dataset_chunks", "dataset_manifests")
+    monkeypatch.setattr(server, "DATASET_DIR", tmp_path)
+    monkeypatch.setattr(server, "DATASET_CHUNK_BYTES", 4096)
+    monkeypatch.setattr(server.lifecycle, "stopping", False)
+
+    async def indexes():
+        await server.datasets.create_index([("name", 1), ("version", -1)], unique=True)
+
+    asyncio.run(indexes())
+    app = FastAPI()
+    app.include_router(server.api_router)
+    return TestClient(app)
+
+
+def add_version(tmp_path, version, data):
+    path = tmp_path / f"v{version}.csv"
+    path.write_bytes(data)
+    doc = server.DatasetUpload(
+        id=f"d{version}", name="feed", description="", file_path=str(path), version=version, format="csv"
+    )
+
+    async def run():
+        await server.datasets.insert_one(doc.model_dump())
+        await server.process_dataset(doc.id, str(path))
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def feed(client, tmp_path):
+    add_version(tmp_path, 1, V1)
+    add_version(tmp_path, 2, V2)
+    return client
+
+
+def test_versions_lists_newest_first(feed):
+    versions = feed.get("/api/datasets/feed/versions").json()
+    assert [(v["version"], v["status"]) for v in versions] == [(2, "complete"), (1, "complete")]
+    assert feed.get("/api/datasets/missing/versions").status_code == 404
+
+
+def test_iocs_finds_versions_with_matching_records(feed, mongo):
+    body = feed.get("/api/datasets/feed/iocs", params={"value": "10.0.5.8"}).json()
+    assert [v["version"] for v in body["versions"]] == [2, 1]
+    assert body["versions"][0]["records"] == ["10.0.5.8,scan,host1257.example.com"]
+
+    body = feed.get("/api/datasets/feed/iocs", params={"value": "203.0.113.9"}).json()
+    assert [v["version"] for v in body["versions"]] == [2]
+
+    # A chunk outside this dataset with the same indicator does not count
+    asyncio.run(mongo.dataset_chunks.insert_one({"_id": "other", "iocs": ["10.0.5.7"]}))
+    body = feed.get("/api/datasets/feed/iocs", params={"value": "10.0.5.7"}).json()
+    assert [v["version"] for v in body["versions"]] == [1]
+
+
+def test_iocs_caps_limit(feed):
+    body = feed.get("/api/datasets/feed/iocs", params={"value": "scan", "limit": 100000}).json()
+    assert body["versions"] == []
+    body = feed.get("/api/datasets/feed/iocs", params={"value": "example.com", "limit": 100000}).json()
+    assert all(len(v["records"]) <= 200 for v in body["versions"])
+
+
+def test_diff_reports_changed_chunks_and_iocs(feed):
+    diff = feed.get("/api/datasets/feed/diff", params={"base": 1, "head": 2}).json()
+    assert diff["added_iocs"] == ["198.51.100.4", "203.0.113.9", "new.example.net"]
+    assert diff["removed_iocs"] == ["10.0.5.7"]
+    assert 1 <= diff["added_chunks"] <= 3
+    assert diff["unchanged_chunks"] > diff["added_chunks"]
+    assert feed.get("/api/datasets/feed/diff", params={"base": 1, "head": 3}).status_code == 404
+
+
+def test_upload_retries_taken_version_numbers(client, monkeypatch):
+    async def no_processing(dataset_id, file_path, checkpoint=None):
+        pass
+
+    monkeypatch.setattr(server, "process_dataset", no_processing)
+    real_insert = server.datasets.insert_one
+    raced = []
+
+    async def insert_after_race(document, *args, **kwargs):
+        # Another upload takes the version number between our lookup and insert
+        if not raced:
+            raced.append(document["version"])
+            await real_insert({"id": "other", "name": "feed", "version": document["version"]})
+        return await real_insert(document, *args, **kwargs)
+
+    monkeypatch.setattr(server.datasets, "insert_one", insert_after_race)
+    upload = {"name": "feed", "description": "daily"}
+    first = client.post("/api/dataset/upload", data=upload, files={"file": ("a.csv", V1)}).json()
+    second = client.post("/api/dataset/upload", data=upload, files={"file": ("b.csv", V2)}).json()
+    assert raced == [1]
+    assert (first["version"], second["version"]) == (2, 3)
+
+
+def test_upload_gives_up_after_repeated_conflicts(client, monkeypatch):
+    async def always_taken(document, *args, **kwargs):
+        raise DuplicateKeyError("taken")
+
+    monkeypatch.setattr(server.datasets, "insert_one", always_taken)
+    response = client.post("/api/dataset/upload", data={"name": "feed", "description": "daily"}, files={"file": ("a.csv", V1)})
+    assert response.status_code == 409
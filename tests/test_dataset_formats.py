@@ -0,0 +1,159 @@
+import asyncio
+import csv
+import gzip
+import io
+import lzma
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+import backend.server as server
+from backend.server import DatasetPipeline, DatasetReader, csv_records, json_records, sniff_container, sniff_record_format
+
+CSV = b"ip,tag\n10.0.0.1,scan\n" + b'"1.2.3.4","multi\nline note"\n' + b"9.9.9.9,c2\n"
+JSON_ARRAY = b'[\n  {"ip": "1.1.1.1",\n   "tags": ["a", "b"]},\n  {"ip": "2.2.2.2"}, 12345\n]\n'
+SYSLOG = b"Oct 19 10:00:00 fw01 sshd[1]: Failed password from 1.2.3.4\n" * 3
+
+
+def tar_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("sample, expected", [
+    (CSV, "csv"),
+    (b"a\tb\tc\n1\t2\t3\n", "tsv"),
+    (b'{"ip": "1.1.1.1"}\n{"ip": "2.2.2.2"}\n', "jsonl"),
+    (JSON_ARRAY, "json"),
+    (b"[2024-10-19 10:00:00] ERROR login failed\n[2024-10-19 10:00:01] INFO ok\n", "text"),
+    (b"<34>1 2024-10-19T22:14:15Z host app - - started\n", "syslog"),
+    (SYSLOG, "syslog"),
+    (b"<134>Oct 19 10:00:00 host CEF:0|Vendor|IDS|1.0|100|Scan|5|src=1.2.3.4\n", "cef"),
+    (b"free-form notes\nmore notes\n", "text"),
+    (b"\x7fELF\x02\x01\x00\x00", "binary"),
+])
+def test_sniff_record_format(sample, expected):
+    assert sniff_record_format(sample, complete=True) == expected
+
+
+def test_sniff_container():
+    assert sniff_container(gzip.compress(b"x")) == "gzip"
+    assert sniff_container(lzma.compress(b"x")) == "xz"
+    assert sniff_container(tar_bytes([("a.csv", CSV)])) == "tar"
+    assert sniff_container(CSV) is None
+
+
+def test_parsers_give_one_record_per_line_for_any_block_size():
+    for size in (1, 7, 64, len(JSON_ARRAY)):
+        blocks = [JSON_ARRAY[i:i + size] for i in range(0, len(JSON_ARRAY), size)]
+        assert b"".join(json_records(blocks)) == (
+            b'{"ip": "1.1.1.1",    "tags": ["a", "b"]}\n{"ip": "2.2.2.2"}\n12345\n'
+        )
+        blocks = [CSV[i:i + size] for i in range(0, len(CSV), size)]
+        records = b"".join(csv_records(blocks))
+        assert len(records) == len(CSV)
+        assert records.count(b"\n") == 4
+
+
+@pytest.mark.parametrize("data", [
+    b'id,item\n1,5" screen\n2,ok\n3,ok\n4,"last\nrow"\n',
+    b'a,"he said ""hi""\nthen left",x\nb,"",y\nc,"""",z\n"ends in quote""\n",w\n',
+])
+def test_csv_quotes_follow_csv_rules(data):
+    expected = len(list(csv.reader(io.StringIO(data.decode(), newline=""))))
+    for size in (1, 2, 5, len(data)):
+        records = b"".join(csv_records([data[i:i + size] for i in range(0, len(data), size)]))
+        assert len(records) == len(data)
+        assert records.count(b"\n") == expected
+
+
+def test_reader_expands_nested_archives(tmp_path):
+    inner = gzip.compress(tar_bytes([("feed.json", JSON_ARRAY), ("tool.bin", b"\x00" * 64)]))
+    path = tmp_path / "upload.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("flows.csv", CSV)
+        archive.writestr("nested/feeds.tar.gz", inner)
+        archive.writestr("auth.log.xz", lzma.compress(SYSLOG))
+
+    reader = DatasetReader(str(path), block_size=16)
+    stream = b"".join(reader.blocks())
+    formats = [(member["name"], member["format"]) for member in reader.members]
+    assert formats == [
+        ("upload.zip/flows.csv", "csv"),
+        ("upload.zip/nested/feeds.tar.gz/feed.json", "json"),
+        ("upload.zip/nested/feeds.tar.gz/tool.bin", "binary"),
+        ("upload.zip/auth.log.xz", "syslog"),
+    ]
+    assert reader.members[2]["skipped"]
+    assert stream.count(b"\n") == 4 + 3 + 3
+    assert b"1.2.3.4" in stream
+
+
+def test_compressed_offsets_are_in_the_decompressed_stream(tmp_path):
+    path = tmp_path / "feed.csv.gz"
+    path.write_bytes(gzip.compress(CSV * 50))
+    stream = b"".join(DatasetReader(str(path)).blocks())
+    assert stream == CSV.replace(b"multi\nline", b"multi line") * 50
+
+    # Resuming and reading spans decompress from the start and skip ahead
+    assert b"".join(DatasetReader(str(path), block_size=100).blocks(skip=1000)) == stream[1000:]
+    spans = [(2000, 50), (10, 20)]
+    assert list(DatasetReader(str(path)).read_spans(spans)) == [stream[10:30], stream[2000:2050]]
+
+
+def test_expansion_and_member_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "DATASET_MAX_EXPANDED_BYTES", 100000)
+    bomb = tmp_path / "bomb.gz"
+    bomb.write_bytes(gzip.compress(b"a" * 1000000))
+    with pytest.raises(ValueError, match="expands to more than"):
+        b"".join(DatasetReader(str(bomb)).blocks())
+
+    zipped = tmp_path / "bomb.zip"
+    with zipfile.ZipFile(zipped, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("a.txt", b"a" * 1000000)
+    with pytest.raises(ValueError, match="expands to more than"):
+        b"".join(DatasetReader(str(zipped)).blocks())
+
+    monkeypatch.setattr(server, "DATASET_MAX_MEMBERS", 3)
+    many = tmp_path / "many.tar"
+    many.write_bytes(tar_bytes([(f"{i}.csv", CSV) for i in range(5)]))
+    with pytest.raises(ValueError, match="more than 3 files"):
+        b"".join(DatasetReader(str(many)).blocks())
+
+
+class SlowReader:
+    """Produces a block every 50ms, like a slow disk or a heavy decompressor"""
+
+    def blocks(self, skip=0):
+        for i in range(4):
+            time.sleep(0.05)
+            yield bytes([65 + i]) * 10
+
+
+def test_pipeline_hands_over_blocks_as_they_are_ready():
+    async def run():
+        pipeline = DatasetPipeline(SlowReader(), depth=16)
+        reads = []
+        try:
+            while True:
+                data = await pipeline.read(1 << 20)
+                if not data:
+                    return reads
+                reads.append(data)
+                # Chunking this step gives the reader time to queue the next two
+                await asyncio.sleep(0.12)
+        finally:
+            pipeline.close()
+
+    reads = asyncio.run(run())
+    # The first step does not wait for a full slice; later ones take what is queued
+    assert reads[0] == b"A" * 10
+    assert len(reads) < 4
+    assert b"".join(reads) == b"A" * 10 + b"B" * 10 + b"C" * 10 + b"D" * 10
@@ -0,0 +1,64 @@
+import random
+
+from backend.server import ContentChunker, extract_iocs
+
+
+def feed_lines(seed, count):
+    rng = random.Random(seed)
+    return [
+        f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)},"
+        f"{rng.choice(['botnet', 'c2', 'phishing'])},{rng.getrandbits(128):032x}\n".encode()
+        for _ in range(count)
+    ]
+
+
+def chunk(data, piece=1 << 20, avg_size=4096):
+    chunker = ContentChunker(avg_size)
+    chunks = []
+    for i in range(0, len(data), piece):
+        chunks.extend(chunker.feed(data[i:i + piece]))
+    return chunks + chunker.finish()
+
+
+def test_chunks_cover_stream_on_line_boundaries():
+    lines = feed_lines(1, 5000)
+    data = b"".join(lines) + b"no newline at end"
+    chunks = chunk(data)
+
+    assert b"".join(bytes(c["data"]) for c in chunks) == data
+    assert sum(c["records"] for c in chunks) == len(lines) + 1
+    assert all(bytes(c["data"]).endswith(b"\n") for c in chunks[:-1])
+    assert all(c["size"] <= 4 * 4096 for c in chunks)
+
+
+def test_chunks_do_not_depend_on_read_size():
+    data = b"".join(feed_lines(2, 5000))
+    assert [c["hash"] for c in chunk(data)] == [c["hash"] for c in chunk(data, piece=9973)]
+
+
+def test_edits_only_change_nearby_chunks():
+    lines = feed_lines(3, 20000)
+    before = {c["hash"] for c in chunk(b"".join(lines))}
+    # Yesterday's feed with entries expired from the top, one edit, new entries at the end
+    edited = lines[50:]
+    edited[10000] = b"203.0.113.7,c2,changed\n"
+    edited += feed_lines(4, 50)
+    after = chunk(b"".join(edited))
+
+    new = [c for c in after if c["hash"] not in before]
+    assert len(new) <= 6
+    assert sum(c["size"] for c in new) < 0.05 * sum(c["size"] for c in after)
+
+
+def test_extract_iocs_normalizes_and_counts_types():
+    data = (
+        b"198.51.100.23,Evil.Example.COM,https://evil.example.com/payload.exe\n"
+        b"d41d8cd98f00b204e9800998ecf8427e,CVE-2024-3094,admin@example.org\n"
+        b"198.51.100.23 seen again\n"
+    )
+    result = extract_iocs(data)
+    assert "198.51.100.23" in result["iocs"]
+    assert "evil.example.com" in result["iocs"]
+    assert "https://evil.example.com/payload.exe" in result["iocs"]
+    assert "cve-2024-3094" in result["iocs"]
+    assert result["ioc_types"] == {"ipv4": 1, "domain": 1, "url": 1, "md5": 1, "cve": 1, "email": 1}
@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpcore
+import pytest
+
+from backend.server import PageFetcher, extract_main_text
+
+ARTICLE = (
+    b"<html><head><title>CVE-2024-0001 advisory</title><script>var x = 1;</script></head>"
+    b"<body><nav>Home | About</nav><article><h1>Advisory</h1>"
+    b"<p>Remote code execution in Example Server.</p></article>"
+    b"<footer>Copyright</footer></body></html>"
+)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves robots.txt, an article with an ETag, redirects, a large page and a slow page"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        if self.path == "/robots.txt":
+            self._send(200, b"User-agent: *\nDisallow: /private\n", "text/plain")
+        elif self.path == "/article":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self._send(200, ARTICLE, "text/html; charset=utf-8", {"ETag": '"v1"'})
+        elif self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", self.path.split("?to=", 1)[1])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/large":
+            self._send(200, b"<html><body><p>" + b"a" * 200000 + b"</p></body></html>", "text/html")
+        elif self.path.startswith("/slow"):
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            time.sleep(0.2)
+            with server.lock:
+                server.active -= 1
+            self._send(200, ARTICLE, "text/html")
+        else:
+            self._send(200, ARTICLE, "text/html")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fixture_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+    server.active = 0
+    server.peak = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_fetcher(**kwargs):
+    # The fixture server is on loopback, which fetchers refuse by default
+    options = dict(max_bytes=1000000, per_host=2, timeout=5, workers=2, cache_size=10, user_agent="test-bot", allow_private=True)
+    options.update(kwargs)
+    return PageFetcher(**options)
+
+
+def run(fetcher, coro):
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await fetcher.close()
+
+    return asyncio.run(wrapper())
+
+
+def test_extract_main_text_drops_boilerplate():
+    page = extract_main_text(ARTICLE)
+    assert page["title"] == "CVE-2024-0001 advisory"
+    assert "Remote code execution" in page["text"]
+    assert "Home" not in page["text"]
+    assert "var x" not in page["text"]
+
+
+def test_fetch_respects_robots(fixture_server):
+    fetcher = make_fetcher()
+    base = f"http://127.0.0.1:{fixture_server.server_port}"
+
+    result = run(fetcher, fetcher.fetch(f"{base}/private/report"))
+    assert result["status"] == "blocked_by_robots"
+    assert "/private/report" not in fixture_server.requests
+
+
+def test_fetch_revalidates_with_etag(fixture_server):
+    fetcher = make_fetcher()
+    url = f"http://127.0.0.1:{fixture_server.server_port}/article"
+
+    async def fetch_twice():
+        first = await fetcher.fetch(url)
+        second = await fetcher.fetch(url)
+        return first, second
+
+    first, second = run(fetcher, fetch_twice())
+    assert first["status"] == "ok"
+    assert second["status"] == "not_modified"
+    assert second["text"] == first["text"]
+    assert fetcher.cache_hits == 1
+
+
+def test_fetch_caps_page_size(fixture_server):
+    fetcher = make_fetcher(max_bytes=10000)
+    url = f"http://127.0.0.1:{fixture_server.server_port}/large"
+
+    result = run(fetcher, fetcher.fetch(url))
+    assert result["status"] == "ok"
+    assert result["truncated"] is True
+
+
+def test_fetch_limits_requests_per_host(fixture_server):
+    fetcher = make_fetcher(per_host=2)
+    base = f"http://127.0.0.1:{fixture_server.server_port}"
+
+    async def fetch_many():
+        return await asyncio.gather(*(fetcher.fetch(f"{base}/slow/{i}") for i in range(6)))
+
+    results = run(fetcher, fetch_many())
+    assert all(result["status"] == "ok" for result in results)
+    assert fixture_server.peak <= 2
+
+
+def test_fetch_refuses_private_addresses(fixture_server):
+    fetcher = make_fetcher(allow_private=False)
+    for url in (f"http://127.0.0.1:{fixture_server.server_port}/article", "http://169.254.169.254/latest/meta-data/"):
+        assert run(fetcher, fetcher.fetch(url))["status"] == "blocked_address"
+    assert fixture_server.requests == []
+
+
+def test_redirect_targets_are_checked_again(fixture_server):
+    base = f"http://127.0.0.1:{fixture_server.server_port}"
+
+    fetcher = make_fetcher()
+    result = run(fetcher, fetcher.fetch(f"{base}/redirect?to=/private/report"))
+    assert result["status"] == "blocked_by_robots"
+    assert "/private/report" not in fixture_server.requests
+
+    # The first hop is allowed, the loopback address it redirects to is not
+    fetcher = make_fetcher(allow_private=False)
+
+    async def only_localhost_name(host, port):
+        return "127.0.0.1" if host == "localhost" else None
+
+    fetcher.public_address = only_localhost_name
+    url = f"http://localhost:{fixture_server.server_port}/redirect?to={base}/article"
+    result = run(fetcher, fetcher.fetch(url))
+    assert result["status"] == "blocked_address"
+    assert "/article" not in fixture_server.requests
+
+
+def test_connections_go_to_the_checked_address(fixture_server, monkeypatch):
+    # A rebinding host answers with a public address first and loopback after that
+    answers = ["93.184.216.34", "127.0.0.1"]
+    resolved = []
+    connected = []
+
+    async def rebinding_getaddrinfo(host, port, **kwargs):
+        address = answers[min(len(resolved), len(answers) - 1)]
+        resolved.append(address)
+        return [(2, 1, 6, "", (address, port))]
+
+    connect_tcp = httpcore.AnyIOBackend.connect_tcp
+
+    async def record_connect(self, host, port, **kwargs):
+        connected.append(host)
+        # Stand in for the public server with the fixture server
+        return await connect_tcp(self, "127.0.0.1", port, **kwargs)
+
+    monkeypatch.setattr(httpcore.AnyIOBackend, "connect_tcp", record_connect)
+    fetcher = make_fetcher(allow_private=False)
+
+    async def fetch():
+        asyncio.get_running_loop().getaddrinfo = rebinding_getaddrinfo
+        return await fetcher.fetch(f"http://rebind.example:{fixture_server.server_port}/article")
+
+    result = run(fetcher, fetch())
+    assert result["status"] == "blocked_address"
+    assert resolved == ["93.184.216.34", "127.0.0.1"]
+    assert connected == ["93.184.216.34"]
+    assert fixture_server.requests == ["/robots.txt"]
+
+
+def test_redirect_chain_is_bounded(fixture_server):
+    fetcher = make_fetcher(max_redirects=2)
+    url = f"http://127.0.0.1:{fixture_server.server_port}/redirect?to=/redirect?to=/redirect?to=/article"
+    assert run(fetcher, fetcher.fetch(url))["status"] == "too_many_redirects"
+
+
+def test_host_state_is_bounded(fixture_server):
+    fetcher = make_fetcher(max_hosts=2)
+    for port in range(3):
+        run(fetcher, fetcher.allowed(f"http://127.0.0.{port + 2}:1/"))
+    assert len(fetcher.robots) == 2
+    assert len(fetcher.host_limits) <= 2
@@ -0,0 +1,78 @@
+import asyncio
+
+import backend.server as server
+from backend.server import EventHub
+
+
+def test_events_are_relayed_between_workers(mongo):
+    relay = mongo.event_relay
+
+    async def run():
+        # Published before this worker started; not replayed
+        await relay.insert_one({"worker_id": "other", "frame": "event: old\n\n"})
+        hub = EventHub()
+        subscriber = hub.subscribe()
+        task = asyncio.create_task(hub.run_relay(relay))
+        await asyncio.sleep(0.05)
+
+        hub.publish("dataset", {"id": "d1"})
+        await relay.insert_one({"worker_id": "other", "frame": "event: status\ndata: {}\n\n"})
+        frames = [await asyncio.wait_for(subscriber.get(), 5) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        task.cancel()
+        stored = await relay.find({}, {"_id": 0}).to_list(None)
+        return frames, subscriber.qsize(), stored
+
+    frames, left, stored = asyncio.run(run())
+    assert frames == ['event: dataset\ndata: {"id": "d1"}\n\n', "event: status\ndata: {}\n\n"]
+    # This worker's own frame is delivered once, not again when read back
+    assert left == 0
+    assert {"worker_id": server.WORKER_ID, "frame": frames[0]} in stored
+
+
+def test_publish_fans_out_one_frame_to_every_subscriber():
+    hub = EventHub()
+    subscribers = [hub.subscribe() for _ in range(3)]
+    hub.publish("status_check", {"id": "c1"})
+    frames = [subscriber.get_nowait() for subscriber in subscribers]
+    assert frames[0] == 'event: status_check\ndata: {"id": "c1"}\n\n'
+    # Encoded once and shared
+    assert all(frame is frames[0] for frame in frames)
+
+
+def test_full_subscriber_loses_its_oldest_frames():
+    hub = EventHub(queue_size=2)
+    slow = hub.subscribe()
+    for i in range(5):
+        hub.publish("dataset", {"progress": i})
+    assert slow.qsize() == 2
+    assert [slow.get_nowait() for _ in range(2)] == [
+        'event: dataset\ndata: {"progress": 3}\n\n',
+        'event: dataset\ndata: {"progress": 4}\n\n',
+    ]
+
+
+def test_stream_unsubscribes_on_disconnect(monkeypatch):
+    hub = EventHub()
+    monkeypatch.setattr(server, "event_hub", hub)
+
+    async def fake_status():
+        return {"app": "running"}
+
+    monkeypatch.setattr(server, "get_status", fake_status)
+
+    async def run():
+        response = await server.stream_events()
+        body = response.body_iterator
+        frames = [await body.__anext__()]
+        hub.publish("dataset", {"id": "d1"})
+        frames.append(await body.__anext__())
+        subscribed = len(hub.subscribers)
+        # What the server does when the client goes away
+        await body.aclose()
+        return frames, subscribed
+
+    frames, subscribed = asyncio.run(run())
+    assert frames == ['event: status\ndata: {"app": "running"}\n\n', 'event: dataset\ndata: {"id": "d1"}\n\n']
+    assert subscribed == 1
+    assert hub.subscribers == set()
@@ -0,0 +1,118 @@
+import asyncio
+
+import backend.server as server
+from backend.server import Lifecycle
+
+
+def test_shutdown_cancels_services_and_drains_work():
+    async def scenario():
+        lifecycle = Lifecycle()
+        finished = []
+
+        async def poller():
+            await asyncio.sleep(60)
+
+        async def reply(name):
+            await asyncio.sleep(0.05)
+            finished.append(name)
+
+        async def handler():
+            await asyncio.sleep(0.05)
+            # Work queued while draining is waited for too
+            lifecycle.spawn(reply("reply"))
+            finished.append("handler")
+
+        service = lifecycle.spawn(poller(), service=True)
+        lifecycle.spawn(handler())
+        stuck = lifecycle.spawn(asyncio.sleep(60))
+        report = await lifecycle.shutdown(timeout=0.5)
+        return service, stuck, finished, report
+
+    service, stuck, finished, report = asyncio.run(scenario())
+    assert service.cancelled()
+    assert stuck.cancelled()
+    assert finished == ["handler", "reply"]
+    assert report == {"drained": 2, "cancelled": 1}
+
+
+class FakeManifests:
+    async def delete_many(self, query):
+        pass
+
+
+def test_dataset_checkpoints_on_shutdown_and_resumes(tmp_path, monkeypatch):
+    path = tmp_path / "flows.csv"
+    path.write_bytes(b"10.0.0.1,scan\n" * 5000 + b"tail")
+    statuses = []
+    stored = []
+
+    async def fake_set_status(dataset_id, status, **fields):
+        statuses.append((status, fields))
+
+    async def fake_store_chunks(dataset_id, seq, chunks):
+        stored.extend(chunks)
+        return chunks
+
+    real_chunk = server.chunk_block
+
+    def chunk_then_stop(*args):
+        # Shutdown starts while the first slice is being chunked
+        server.lifecycle.stopping = True
+        return real_chunk(*args)
+
+    monkeypatch.setattr(server, "set_dataset_status", fake_set_status)
+    monkeypatch.setattr(server, "store_chunks", fake_store_chunks)
+    monkeypatch.setattr(server, "dataset_manifests", FakeManifests())
+    monkeypatch.setattr(server, "DATASET_CHUNK_BYTES", 1024)
+    monkeypatch.setattr(server, "DATASET_SCAN_SLICE_BYTES", 16384)
+    monkeypatch.setattr(server, "DATASET_READ_BLOCK_BYTES", 4096)
+    monkeypatch.setattr(server, "chunk_block", chunk_then_stop)
+    monkeypatch.setattr(server.lifecycle, "stopping", False)
+
+    asyncio.run(server.process_dataset("d1", str(path)))
+    status, fields = statuses[-1]
+    checkpoint = fields["checkpoint"]
+    assert status == "interrupted"
+    # Checkpoints sit on a chunk boundary, not at the end of the read
+    assert 0 < checkpoint["offset"] < 16384
+    assert checkpoint["offset"] == sum(chunk["size"] for chunk in stored)
+
+    monkeypatch.setattr(server, "chunk_block", real_chunk)
+    server.lifecycle.stopping = False
+    asyncio.run(server.process_dataset("d1", str(path), checkpoint))
+    status, fields = statuses[-1]
+    assert status == "complete"
+    assert fields["size_bytes"] == path.stat().st_size
+    assert fields["records"] == 5001
+    assert sum(chunk["size"] for chunk in stored) == path.stat().st_size
+
+
+def test_intake_is_refused_while_shutting_down(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server.lifecycle, "stopping", True)
+    client = TestClient(server.create_app())
+    response = client.post(
+        "/api/dataset/upload", data={"name": "feed", "description": "daily"}, files={"file": ("a.csv", b"a,b\n")}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert client.get("/api/chat/batch/b1").status_code == 503
+
+
+def test_unfinished_datasets_are_looked_for_periodically(monkeypatch):
+    calls = []
+
+    async def fake_resume():
+        calls.append(1)
+
+    monkeypatch.setattr(server, "resume_datasets", fake_resume)
+    monkeypatch.setattr(server, "DATASET_STALE_SECONDS", 0.01)
+
+    async def run():
+        task = asyncio.create_task(server.run_dataset_resumer())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    assert len(calls) >= 3
@@ -0,0 +1,80 @@
+import asyncio
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+from backend.server import JsonLogFormatter, LogSampler, NonBlockingQueueHandler, current_request_id
+
+
+class SlowStream(io.StringIO):
+    """A stream that takes 5ms per write, like a congested pipe"""
+
+    def write(self, text):
+        time.sleep(0.005)
+        return super().write(text)
+
+
+def make_logger(name, handler):
+    log = logging.getLogger(name)
+    log.handlers = [handler]
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    return log
+
+
+def test_sampler_keeps_burst_then_one_in_n():
+    sampler = LogSampler(burst=5, every=10)
+    records = [logging.LogRecord("demo", logging.INFO, "app.py", 7, "hot", None, None) for _ in range(30)]
+    kept = [record for record in records if sampler.filter(record)]
+
+    assert len(kept) == 7
+    assert kept[5].sampled_out == 9
+    warning = logging.LogRecord("demo", logging.WARNING, "app.py", 7, "hot", None, None)
+    assert sampler.filter(warning)
+
+
+def test_burst_from_event_loop_never_waits_for_the_stream():
+    log_queue = queue.SimpleQueue()
+    handler = NonBlockingQueueHandler(log_queue, max_size=100)
+    stream = SlowStream()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(stream))
+    listener.start()
+    log = make_logger("test-burst", handler)
+
+    async def burst():
+        start = time.perf_counter()
+        for i in range(2000):
+            log.error(f"upstream failed {i}")
+        return time.perf_counter() - start
+
+    try:
+        # 2000 writes to this stream would take 10s
+        assert asyncio.run(burst()) < 1.0
+    finally:
+        listener.stop()
+    assert handler.dropped > 0
+    assert len(stream.getvalue().splitlines()) == 2000 - handler.dropped
+
+
+def test_json_lines_carry_request_id_and_extras():
+    log_queue = queue.SimpleQueue()
+    handler = NonBlockingQueueHandler(log_queue, max_size=100)
+    log = make_logger("test-json", handler)
+
+    token = current_request_id.set("req-1")
+    try:
+        try:
+            raise ValueError("bad row")
+        except ValueError:
+            log.exception("Dataset %s failed", "d1", extra={"dataset_id": "d1"})
+    finally:
+        current_request_id.reset(token)
+
+    entry = json.loads(JsonLogFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "Dataset d1 failed"
+    assert entry["request_id"] == "req-1"
+    assert entry["dataset_id"] == "d1"
+    assert "ValueError: bad row" in entry["exc_info"]
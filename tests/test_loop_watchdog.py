@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from backend.server import LoopWatchdog
+
+
+def blocking_handler():
+    time.sleep(0.3)
+
+
+def test_watchdog_attributes_stall_to_call_site():
+    watchdog = LoopWatchdog(threshold=0.1, interval=0.02)
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_handler()
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+
+    asyncio.run(scenario())
+
+    assert watchdog.stalls == 1
+    entry = watchdog.snapshot()["sites"][0]
+    assert entry["call_site"].startswith("blocking_handler (test_loop_watchdog.py:")
+    assert 200 <= entry["max_ms"] <= 400
+    assert "blocking_handler" in entry["stack"]
+
+
+def test_watchdog_ignores_short_pauses():
+    watchdog = LoopWatchdog(threshold=0.2, interval=0.02)
+
+    async def scenario():
+        watchdog.start()
+        for _ in range(5):
+            time.sleep(0.05)
+            await asyncio.sleep(0.02)
+        watchdog.stop()
+
+    asyncio.run(scenario())
+    assert watchdog.stalls == 0
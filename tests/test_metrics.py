@@ -0,0 +1,91 @@
+import time
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import backend.server as server
+from backend.server import Histogram, MetricsRegistry, MongoCommandMetrics, RequestContextMiddleware, mongo_command_duration
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("demo_seconds", "Demo", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, "/api/chat")
+
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{route="/api/chat",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/api/chat",le="1"} 3' in lines
+    assert 'demo_seconds_bucket{route="/api/chat",le="+Inf"} 4' in lines
+    assert 'demo_seconds_count{route="/api/chat"} 4' in lines
+
+
+def test_registry_escapes_labels_and_reads_gauges():
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Demo", ("query",))
+    counter.inc('say "hi"')
+    registry.gauge("demo_depth", "Depth", lambda: {(): 7})
+
+    text = registry.render()
+    assert 'demo_total{query="say \\"hi\\""} 1' in text
+    assert "demo_depth 7" in text
+
+
+def test_mongo_listener_times_commands_per_collection():
+    listener = MongoCommandMetrics()
+    started = SimpleNamespace(
+        command={"find": "watchlists", "filter": {}}, command_name="find", connection_id=("db", 27017), request_id=1
+    )
+    succeeded = SimpleNamespace(command_name="find", connection_id=("db", 27017), request_id=1, duration_micros=2500)
+
+    listener.started(started)
+    listener.succeeded(succeeded)
+
+    series = mongo_command_duration.series[("watchlists", "find")]
+    assert series[2] >= 1
+    assert not listener.pending
+
+
+def test_request_context_middleware(monkeypatch):
+    slow = []
+
+    async def fake_store(entry):
+        slow.append(entry)
+
+    monkeypatch.setattr(server, "store_slow_request", fake_store)
+    monkeypatch.setattr(server, "SLOW_REQUEST_THRESHOLD_MS", 0)
+    app = FastAPI()
+    app.add_middleware(RequestContextMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        with server.stage("lookup"):
+            pass
+        remaining = server.request_deadline.get() - time.monotonic()
+        return {"request_id": server.current_request_id.get(), "remaining": remaining}
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            yield "a\n"
+            yield "b\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    client = TestClient(app)
+    response = client.get("/items/42", headers={"X-Request-ID": "abc-123", "X-Request-Timeout": "3"})
+    body = response.json()
+    assert response.headers["X-Request-ID"] == body["request_id"] == "abc-123"
+    assert 2 < body["remaining"] <= 3
+    assert slow[-1]["route"] == "/items/{item_id}"
+    assert slow[-1]["spans"][0]["name"] == "lookup"
+
+    # A malformed id is replaced; streamed bodies pass through
+    response = client.get("/stream", headers={"X-Request-ID": "bad id!"})
+    assert response.text == "a\nb\n"
+    assert len(response.headers["X-Request-ID"]) == 32
+    assert client.get("/missing").status_code == 404
+
+    rendered = "\n".join(server.http_request_duration.render())
+    assert 'route="/items/{item_id}",status="200"' in rendered
+    assert 'route="unmatched",status="404"' in rendered
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from backend.server import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    OutboundClient,
+    request_deadline,
+)
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    """Serves GET /?mode=... with the fault the test asks for"""
+
+    def do_GET(self):
+        server = self.server
+        server.hits += 1
+        fault = server.faults.pop(0) if server.faults else "ok"
+        if fault == "slow":
+            time.sleep(server.slow_seconds)
+        if fault == "error":
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FaultInjectingHandler)
+    server.hits = 0
+    server.faults = []
+    server.slow_seconds = 1.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server):
+    response = requests.get(f"http://127.0.0.1:{server.server_port}/", timeout=5)
+    response.raise_for_status()
+    return response.text
+
+
+def make_client(name, **kwargs):
+    kwargs.setdefault("retry_on", (requests.RequestException,))
+    kwargs.setdefault("backoff", 0.01)
+    return OutboundClient(name, **kwargs)
+
+
+def test_retries_transient_errors(stub_server):
+    stub_server.faults = ["error", "error"]
+    client = make_client("test-retry", timeout=2, retries=2)
+
+    assert asyncio.run(client.call(fetch, stub_server)) == "ok"
+    assert stub_server.hits == 3
+    assert client.breaker.state == "closed"
+
+
+def test_attempt_timeout_is_retried(stub_server):
+    stub_server.faults = ["slow"]
+    client = make_client("test-timeout", timeout=0.2, retries=1)
+
+    assert asyncio.run(client.call(fetch, stub_server)) == "ok"
+    assert client.attempts == 2
+
+
+def test_breaker_opens_and_fails_fast(stub_server):
+    stub_server.faults = ["error"] * 3
+    client = make_client("test-breaker", timeout=2, retries=0, failure_threshold=3, reset_timeout=60)
+
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(client.call(fetch, stub_server))
+    assert client.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.call(fetch, stub_server))
+    assert stub_server.hits == 3
+
+
+def test_breaker_half_open_probe_closes(stub_server):
+    stub_server.faults = ["error"]
+    client = make_client("test-half-open", timeout=2, retries=0, failure_threshold=1, reset_timeout=0.1)
+
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(client.call(fetch, stub_server))
+    assert client.breaker.state == "open"
+
+    time.sleep(0.15)
+    assert asyncio.run(client.call(fetch, stub_server)) == "ok"
+    assert client.breaker.state == "closed"
+
+
+def test_hedged_request_beats_slow_attempt(stub_server):
+    stub_server.faults = ["slow"]
+    stub_server.slow_seconds = 2.0
+    client = make_client("test-hedge", timeout=5, retries=0, hedge_after=0.1)
+
+    async def timed_call():
+        start = time.monotonic()
+        result = await client.call(fetch, stub_server)
+        return result, time.monotonic() - start
+
+    # Timed inside the loop: asyncio.run also waits for the abandoned thread
+    result, elapsed = asyncio.run(timed_call())
+    assert result == "ok"
+    assert elapsed < 1.0
+    assert client.hedges == 1
+
+
+def test_request_deadline_limits_attempts(stub_server):
+    stub_server.faults = ["slow", "slow", "slow"]
+    client = make_client("test-deadline", timeout=5, retries=2)
+
+    async def call_with_deadline():
+        request_deadline.set(time.monotonic() + 0.3)
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await client.call(fetch, stub_server)
+        return time.monotonic() - start
+
+    assert asyncio.run(call_with_deadline()) < 0.9
+
+
+def test_abandoned_attempt_stops_at_the_sdk_timeout(stub_server):
+    stub_server.faults = ["slow"]
+    stub_server.slow_seconds = 2.0
+    threads = []
+
+    def fetch_with_timeout(server, timeout):
+        threads.append(threading.current_thread().name)
+        response = requests.get(f"http://127.0.0.1:{server.server_port}/", timeout=timeout)
+        response.raise_for_status()
+        return response.text
+
+    client = make_client("test-sdk-timeout", timeout=0.2, retries=0, timeout_kwarg="timeout", max_threads=1)
+
+    async def calls():
+        with pytest.raises(DeadlineExceeded):
+            await client.call(fetch_with_timeout, stub_server)
+        # The only thread is free again well before the slow response would end
+        start = time.monotonic()
+        assert await client.call(fetch_with_timeout, stub_server) == "ok"
+        return time.monotonic() - start
+
+    assert asyncio.run(calls()) < 1.0
+    assert threads == ["outbound-test-sdk-timeout_0"] * 2
+    client.close()
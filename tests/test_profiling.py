@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import time
+
+from backend.server import RequestTrace, SamplingProfiler, current_trace, stage
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_busy_thread_as_folded_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    try:
+        folded = asyncio.run(SamplingProfiler().profile(0.3, interval=0.005))
+    finally:
+        stop.set()
+        worker.join()
+
+    busy = [line for line in folded.splitlines() if line.startswith("busy;")]
+    assert busy
+    assert all("busy_loop (test_profiling.py" in line for line in busy)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in busy)
+
+
+def test_stage_adds_spans_to_current_trace():
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    try:
+        with stage("outer_work"):
+            time.sleep(0.01)
+    finally:
+        current_trace.reset(token)
+
+    assert [span["name"] for span in trace.spans] == ["outer_work"]
+    assert trace.spans[0]["duration_ms"] >= 10
+
+    with stage("untraced"):
+        pass
+    assert len(trace.spans) == 1
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+import backend.server as server
+
+
+class FakeBot:
+    def __init__(self):
+        self.closed = False
+
+    async def shutdown(self):
+        self.closed = True
+
+
+@pytest.fixture
+def config(mongo, monkeypatch):
+    mongo.use("app_config")
+    monkeypatch.setattr(server, "runtime_config_version", 0)
+    monkeypatch.setattr(server, "TELEGRAM_BOT_TOKEN", "current-token")
+    monkeypatch.setattr(server, "telegram_bot", None)
+    asyncio.run(server.save_runtime_config(telegram_bot_token="current-token"))
+
+
+def test_conflicting_change_closes_the_validated_bot(config):
+    bot = FakeBot()
+    with pytest.raises(server.ConfigConflict):
+        asyncio.run(server.update_runtime_config(0, clients={"telegram": bot}, telegram_bot_token="new-token"))
+    assert bot.closed
+
+
+def test_unused_validated_bot_is_closed(config):
+    # The token did not change, so the validated bot never replaces the live one
+    bot = FakeBot()
+    doc = asyncio.run(server.update_runtime_config(1, clients={"telegram": bot}, telegram_bot_token="current-token"))
+    assert doc["version"] == 2
+    assert bot.closed
@@ -0,0 +1,50 @@
+import asyncio
+
+import backend.server as server
+from backend.server import expand_security_query, normalize_url, reciprocal_rank_fusion
+
+
+def result(href, title="t"):
+    return {"title": title, "href": href, "body": ""}
+
+
+def test_normalize_url_dedupes_common_variants():
+    variants = [
+        "https://www.example.com/advisory/",
+        "https://EXAMPLE.com/advisory?utm_source=x#section",
+        "https://example.com/advisory",
+    ]
+    assert len({normalize_url(url) for url in variants}) == 1
+    assert normalize_url("https://example.com/a?id=1") != normalize_url("https://example.com/a?id=2")
+
+
+def test_expand_security_query_uses_cve_id():
+    variants = expand_security_query("is cve-2024-3094 exploitable")
+    assert variants[0] == "is cve-2024-3094 exploitable"
+    assert "CVE-2024-3094 exploit" in variants
+    assert "CVE-2024-3094 vendor advisory" in variants
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    first = [result("https://a.com"), result("https://b.com"), result("https://c.com")]
+    second = [result("https://www.c.com/"), result("https://d.com")]
+
+    fused = reciprocal_rank_fusion([first, second], ["q1", "q2"])
+    urls = [normalize_url(entry["href"]) for entry in fused]
+
+    assert urls[0] == normalize_url("https://c.com")
+    assert len(urls) == 4
+    assert fused[0]["matched_queries"] == ["q1", "q2"]
+
+
+def test_multi_query_search_respects_budget(monkeypatch):
+    async def fake_search(query, max_results=5):
+        if query == "slow":
+            await asyncio.sleep(5)
+        return [result(f"https://{query}.com")]
+
+    monkeypatch.setattr(server, "web_search", fake_search)
+    monkeypatch.setattr(server, "SEARCH_FANOUT_BUDGET", 0.2)
+
+    fused = asyncio.run(server.multi_query_search(["fast", "slow", "quick"]))
+    assert sorted(entry["matched_queries"][0] for entry in fused) == ["fast", "quick"]
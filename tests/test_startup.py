@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+LAZY_MODULES = ["openai", "telegram", "duckduckgo_search", "bs4", "lxml", "tiktoken", "httpx"]
+
+
+def test_import_does_not_load_integrations():
+    check = (
+        "import sys, server; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_import_has_no_filesystem_or_thread_side_effects(tmp_path):
+    # A fresh interpreter: in this one other tests may already have started things
+    check = (
+        "import threading, server; "
+        "print(threading.active_count(), not server.logging.getLogger().handlers)"
+    )
+    env = {**os.environ, "PYTHONPATH": str(BACKEND_DIR), "PYTHONDONTWRITEBYTECODE": "1"}
+    backend_before = sorted(os.listdir(BACKEND_DIR))
+    result = subprocess.run(
+        [sys.executable, "-c", check], cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split() == ["1", "True"]
+    assert os.listdir(tmp_path) == []
+    assert sorted(os.listdir(BACKEND_DIR)) == backend_before
@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import backend.server as server
+
+
+def test_status_checks_page_through_across_origins(mongo, monkeypatch):
+    monkeypatch.setattr(server, "db", mongo)
+    monkeypatch.setattr(server.lifecycle, "stopping", False)
+
+    start = datetime(2026, 10, 19, 10, 0)
+
+    async def seed():
+        # Pairs share a timestamp so the id tiebreak is exercised across page edges
+        await mongo.status_checks.insert_many([
+            {"id": f"c{i:03d}", "client_name": "probe", "timestamp": start + timedelta(seconds=i // 2)}
+            for i in range(251)
+        ])
+
+    asyncio.run(seed())
+    client = TestClient(server.create_app())
+    origin = {"Origin": "http://dashboard.example"}
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/api/status/checks", params={"cursor": cursor} if cursor else {}, headers=origin)
+        assert response.status_code == 200
+        # The browser only lets the dashboard read the cursor if CORS exposes it
+        assert "x-next-cursor" in response.headers["access-control-expose-headers"].lower()
+        seen += [check["id"] for check in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert seen == [f"c{i:03d}" for i in reversed(range(251))]
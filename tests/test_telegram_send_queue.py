@@ -0,0 +1,85 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import telegram.error
+
+from backend.server import TelegramSendQueue
+
+
+class FakeBot:
+    """Records sends; raises the queued errors first"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+async def drain(queue):
+    while queue.workers:
+        await asyncio.gather(*list(queue.workers.values()))
+
+
+def test_chunks_for_a_chat_are_coalesced_in_order():
+    queue = TelegramSendQueue(global_rate=100)
+    queue.bot = FakeBot()
+
+    async def run():
+        queue.send(1, "first")
+        queue.send(1, "second")
+        queue.send(1, "x" * (TelegramSendQueue.MESSAGE_LIMIT + 10))
+        queue.send(2, "other chat")
+        await drain(queue)
+
+    asyncio.run(run())
+    texts = [text for chat_id, text, _ in queue.bot.sent if chat_id == 1]
+    # Long text is split at the message limit; short chunks share a message
+    assert texts == ["first\n\nsecond", "x" * 4000, "x" * 10]
+    assert [text for chat_id, text, _ in queue.bot.sent if chat_id == 2] == ["other chat"]
+    assert queue.stats()["sent"] == 4
+    assert queue.pending == {}
+
+
+def test_sends_stay_under_the_global_rate():
+    queue = TelegramSendQueue(global_rate=5)
+    queue.bot = FakeBot()
+
+    async def run():
+        start = time.monotonic()
+        for chat_id in range(8):
+            queue.send(chat_id, "alert")
+        await drain(queue)
+        return start
+
+    start = asyncio.run(run())
+    times = sorted(sent_at - start for _, _, sent_at in queue.bot.sent)
+    assert len(times) == 8
+    # A burst of 5, then one every 0.2s
+    assert times[4] < 0.1
+    assert times[7] >= 0.5
+
+
+def test_retry_after_delays_the_resend_without_losing_the_message():
+    queue = TelegramSendQueue(global_rate=100)
+    queue.bot = FakeBot([telegram.error.RetryAfter(timedelta(milliseconds=300))])
+
+    async def run():
+        start = time.monotonic()
+        queue.send(1, "report")
+        queue.send(2, "unaffected")
+        await drain(queue)
+        return start
+
+    start = asyncio.run(run())
+    sent = {chat_id: (text, sent_at - start) for chat_id, text, sent_at in queue.bot.sent}
+    assert len(queue.bot.sent) == 2
+    assert sent[1][0] == "report"
+    assert sent[1][1] >= 0.3
+    assert sent[2][1] < 0.3
+    stats = queue.stats()
+    assert (stats["sent"], stats["dropped"], stats["retries"]) == (2, 0, 1)
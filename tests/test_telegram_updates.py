@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import backend.server as server
+
+
+def test_updates_do_not_inherit_the_webhook_request_deadline():
+    dispatcher = server.TelegramUpdateDispatcher(4)
+    seen = {}
+    done = threading.Event()
+
+    async def handler():
+        seen["deadline"] = server.request_deadline.get()
+        seen["trace"] = server.current_trace.get()
+        done.set()
+
+    app = FastAPI()
+
+    @app.post("/webhook")
+    async def webhook():
+        seen["request_deadline"] = server.request_deadline.get()
+        dispatcher.submit(1, handler)
+        return {"ok": True}
+
+    app.add_middleware(server.RequestContextMiddleware)
+    with TestClient(app) as client:
+        assert client.post("/webhook").status_code == 200
+        assert done.wait(5)
+
+    assert seen["request_deadline"] is not None
+    assert seen["deadline"] is None
+    assert seen["trace"] is None
+
+
+def test_updates_for_one_chat_run_in_order():
+    async def run():
+        dispatcher = server.TelegramUpdateDispatcher(4)
+        order = []
+
+        def handler(name, delay):
+            async def handle():
+                await asyncio.sleep(delay)
+                order.append(name)
+            return handle
+
+        # The first update is the slowest, yet the chat's later updates wait for it
+        tasks = [dispatcher.submit(1, handler(f"u{i}", delay)) for i, delay in enumerate((0.05, 0.01, 0))]
+        await asyncio.gather(*tasks)
+        return order, dispatcher.chat_tails
+
+    order, tails = asyncio.run(run())
+    assert order == ["u0", "u1", "u2"]
+    assert tails == {}
+
+
+def test_updates_for_different_chats_run_concurrently():
+    async def run(limit):
+        dispatcher = server.TelegramUpdateDispatcher(limit)
+        active = peak = 0
+
+        async def handle():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.02)
+            active -= 1
+
+        await asyncio.gather(*(dispatcher.submit(chat_id, handle) for chat_id in range(6)))
+        return peak
+
+    assert asyncio.run(run(4)) == 4
+    assert asyncio.run(run(1)) == 1
+
+
+def test_failed_update_does_not_block_the_chat():
+    async def run():
+        dispatcher = server.TelegramUpdateDispatcher(2)
+        handled = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def handle():
+            handled.append(True)
+
+        await asyncio.gather(dispatcher.submit(1, fail), dispatcher.submit(1, handle))
+        return handled
+
+    assert asyncio.run(run()) == [True]
+
+
+def test_duplicate_update_ids_are_dropped(mongo, monkeypatch):
+    dispatcher = server.TelegramUpdateDispatcher(2, max_seen=2)
+    assert not dispatcher.is_duplicate(1)
+    assert dispatcher.is_duplicate(1)
+    assert not dispatcher.is_duplicate(2)
+    assert not dispatcher.is_duplicate(3)
+    # Only the most recent ids are remembered
+    assert not dispatcher.is_duplicate(1)
+
+    # With several workers a redelivery to another worker is caught by the shared record
+    mongo.use("telegram_updates")
+    monkeypatch.setattr(server, "WEB_CONCURRENCY", 2)
+    monkeypatch.setattr(server, "update_dispatcher", server.TelegramUpdateDispatcher(2))
+
+    async def run():
+        first = await server.is_duplicate_update(42)
+        # A fresh dispatcher stands in for the other worker's memory
+        server.update_dispatcher = server.TelegramUpdateDispatcher(2)
+        return first, await server.is_duplicate_update(42)
+
+    assert asyncio.run(run()) == (False, True)
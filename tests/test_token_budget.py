@@ -0,0 +1,30 @@
+import pytest
+
+import backend.server as server
+from backend.server import count_tokens, truncate_to_tokens
+
+
+@pytest.mark.parametrize("text, max_tokens", [
+    ("a" * 40000, 500),
+    # Dense head, sparse tail: a proportional cut alone overshoots
+    ("中文 " * 3000 + "x" * 30000, 400),
+    ("short text but still over", 3),
+    ("b" * 1000, 0),
+])
+def test_truncation_fits_the_budget(text, max_tokens):
+    trimmed = truncate_to_tokens(text, max_tokens)
+    marker = trimmed.index("\n[...")
+    if max_tokens >= count_tokens("\n[... 99999 tokens truncated ...]\n"):
+        assert count_tokens(trimmed) <= max_tokens
+    # Never more than the original: head and tail never overlap
+    assert marker <= len(text) // 2
+    assert len(trimmed) - trimmed.index("...]\n") - 5 <= len(text) // 2
+
+
+def test_token_cache_is_bounded_and_keyed_by_digest(monkeypatch):
+    monkeypatch.setattr(server, "TOKEN_COUNT_CACHE_SIZE", 3)
+    monkeypatch.setattr(server, "token_count_cache", server.OrderedDict())
+    for i in range(10):
+        count_tokens(f"text {i} " * 1000)
+    assert len(server.token_count_cache) == 3
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in server.token_count_cache)
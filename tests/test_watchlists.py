@@ -0,0 +1,91 @@
+import asyncio
+
+import backend.server as server
+
+
+def make_watchlist(**fields):
+    watchlist = {"id": "w1", "name": "openssh", "query": "openssh cve", "telegram_chat_id": 42, "baseline_done": True}
+    watchlist.update(fields)
+    return watchlist
+
+
+def results(*paths):
+    return [{"title": path, "href": f"https://example.com/{path}", "body": ""} for path in paths]
+
+
+def test_failed_search_records_no_baseline(mongo, monkeypatch):
+    mongo.use("watchlist_seen", "watchlist_hits")
+    sent = []
+    responses = [[], results("a", "b")]
+
+    async def fake_search(query, max_results=5):
+        return responses.pop(0)
+
+    monkeypatch.setattr(server, "web_search", fake_search)
+    monkeypatch.setattr(server.telegram_send_queue, "send", lambda chat_id, text: sent.append(text))
+
+    # An upstream failure looks like no results: there is nothing to baseline
+    assert asyncio.run(server.run_watchlist(make_watchlist(baseline_done=False))) is None
+    # The next run records the baseline instead of announcing everything
+    assert asyncio.run(server.run_watchlist(make_watchlist(baseline_done=False))) == 0
+    assert sent == []
+
+
+def test_only_newly_inserted_urls_are_reported(mongo, monkeypatch):
+    mongo.use("watchlist_seen", "watchlist_hits")
+    sent = []
+
+    async def fake_search(query, max_results=5):
+        return results("a", "b", "c")
+
+    async def setup():
+        await server.watchlist_seen.create_index([("watchlist_id", 1), ("url_key", 1)], unique=True)
+
+    real_insert_many = server.watchlist_seen.insert_many
+
+    async def insert_many_after_race(documents, **kwargs):
+        # A concurrent run records "b" between our lookup and our insert
+        await server.watchlist_seen.insert_one(
+            {"watchlist_id": "w1", "url_key": server.normalize_url("https://example.com/b")}
+        )
+        return await real_insert_many(documents, **kwargs)
+
+    asyncio.run(setup())
+    monkeypatch.setattr(server, "web_search", fake_search)
+    monkeypatch.setattr(server.watchlist_seen, "insert_many", insert_many_after_race)
+    monkeypatch.setattr(server.telegram_send_queue, "send", lambda chat_id, text: sent.append(text))
+
+    assert asyncio.run(server.run_watchlist(make_watchlist())) == 2
+    hits = asyncio.run(server.watchlist_hits.find().to_list(None))
+    assert sorted(hit["title"] for hit in hits) == ["a", "c"]
+    assert "example.com/b" not in sent[0]
+
+
+class FakeUpdate:
+    def __init__(self, chat_id):
+        self.effective_chat = self.effective_user = type("Chat", (), {"id": chat_id})()
+
+
+def test_watch_command_is_rate_limited_and_capped_per_chat(mongo, monkeypatch):
+    mongo.use("watchlists")
+    sent = []
+    monkeypatch.setattr(server.telegram_send_queue, "send", lambda chat_id, text: sent.append((chat_id, text)))
+    monkeypatch.setattr(server, "MAX_WATCHES_PER_CHAT", 2)
+    monkeypatch.setattr(server, "client_rate_limiter", server.ClientRateLimiter(per_minute=1, burst=3))
+
+    async def watch(chat_id, query):
+        await server.watch_command(FakeUpdate(chat_id), type("Context", (), {"args": query.split()})())
+
+    async def run():
+        for query in ("openssh cve", "xz backdoor", "log4j"):
+            await watch(42, query)
+        await watch(7, "log4j")
+        # Chat 42 has used its burst
+        await watch(42, "regresshion")
+        return await server.watchlists.count_documents({"telegram_chat_id": 42})
+
+    assert asyncio.run(run()) == 2
+    replies = [text for chat_id, text in sent if chat_id == 42]
+    assert "already has 2 watchlists" in replies[2]
+    assert "too quickly" in replies[3]
+    assert sent[3][0] == 7 and sent[3][1].startswith("Watching 'log4j'")